@@ -1,8 +1,76 @@
-from LLM_DNF_Novel.models.RuleBasedDNF import RuleBasedDNF
-from LLM_DNF_Novel.models.dnf_model import DNFModel
-import torch
-from LLM_DNF_Novel.utils.evaluation import evaluate
-from LLM_DNF_Novel.utils.logic_transform import transform_logic_atoms_to_features
+import json
+import os
+import numpy as np
+from LLM_DNF_Novel.models.compiled_dnf import CompiledDNF
+from LLM_DNF_Novel.utils.logic_transform import logic_atoms_to_vector
+
+# torch 相关模块（RuleBasedDNF、DNFModel）只在选用 torch 后端或加载训练模型时才导入
+
+# 评分使用的手写规则（特征顺序为 P1..P10）
+SCORING_NUM_FEATURES = 10
+SCORING_NUM_CLASSES = 2
+SCORING_CONJUNCTIONS = [
+    {0: 6, 4: -6},          # conj0 = P1 ∧ ¬P5
+    {2: 6, 6: 6, 9: -6},    # conj1 = P3 ∧ P7 ∧ ¬P10
+    {1: 6, 3: 6},           # conj2 = P2 ∧ P4
+    {5: -6, 7: 6}           # conj3 = ¬P6 ∧ P8
+]
+SCORING_DISJUNCTIONS = {
+    0: {0: 6, 1: 6},        # 类别0 = conj0 ∨ conj1
+    1: {2: 6, 3: 6}         # 类别1 = conj2 ∨ conj3
+}
+# 第 1 类为高质量决策
+SCORE_CLASS = 1
+# 评分后端："numpy"（默认，无需 torch）或 "torch"
+SCORER_BACKEND = os.environ.get("DNF_SCORER_BACKEND", "numpy")
+# 训练导出的评分规则（见 train_model.py）；文件存在时替代上面的手写规则
+DNF_RULES_PATH = os.environ.get("DNF_RULES_PATH", os.path.join(".llm_cache", "dnf_rules.json"))
+
+_scorers = {}
+_scoring_rules = None
+_trained_rules = False
+
+def load_scoring_rules(path):
+    """
+    读取训练导出的规则文件。
+    :param path: 规则文件路径（train_model.py 的 --rules 输出）。
+    :return: (合取规则 [{feature_index: sign}], 析取规则 {class_index: [conj_index]})。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("num_features") != SCORING_NUM_FEATURES or data.get("num_classes") != SCORING_NUM_CLASSES:
+        raise ValueError(f"规则文件的特征数或类别数与评分模型不一致: {path}")
+    conjunctions = [{int(f): int(sign) for f, sign in rule.items()} for rule in data["conjunctions"]]
+    disjunctions = {int(c): [int(i) for i in conjs] for c, conjs in data["disjunctions"].items()}
+    return conjunctions, disjunctions
+
+def get_scoring_rules():
+    """
+    返回评分使用的规则：DNF_RULES_PATH 存在时为训练导出的规则，否则为手写规则。
+    :return: (合取规则, 析取规则 {class_index: [conj_index]})。
+    """
+    global _scoring_rules, _trained_rules
+    if _scoring_rules is None:
+        rules = (SCORING_CONJUNCTIONS, {c: list(conjs) for c, conjs in SCORING_DISJUNCTIONS.items()})
+        if DNF_RULES_PATH and os.path.exists(DNF_RULES_PATH):
+            try:
+                rules = load_scoring_rules(DNF_RULES_PATH)
+                _trained_rules = True
+                print(f"已加载训练的评分规则 {DNF_RULES_PATH}")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"评分规则 {DNF_RULES_PATH} 无法使用，沿用手写规则: {e}")
+        _scoring_rules = rules
+    return _scoring_rules
+
+def scoring_features():
+    """
+    需要提取的特征下标。使用训练导出的规则时，只包含评分类别（SCORE_CLASS）的合取中出现的特征，
+    其余谓词不影响评分，不再询问；使用手写规则时返回全部特征，记录完整的谓词向量供训练使用。
+    """
+    conjunctions, disjunctions = get_scoring_rules()
+    if not _trained_rules:
+        return list(range(SCORING_NUM_FEATURES))
+    return sorted({f for i in disjunctions.get(SCORE_CLASS, []) for f in conjunctions[i]})
 
 def load_trained_model(model_path, num_features, num_conjuncts, num_classes, device):
     """
@@ -14,6 +82,9 @@ def load_trained_model(model_path, num_features, num_conjuncts, num_classes, dev
     :param device: 设备（CPU 或 GPU）。
     :return: 加载的模型。
     """
+    import torch
+    from LLM_DNF_Novel.models.dnf_model import DNFModel
+
     # 初始化模型
     model = DNFModel(num_features=num_features, num_conjuncts=num_conjuncts, num_classes=num_classes)
     model.load_state_dict(torch.load(model_path, map_location=device))
@@ -34,30 +105,91 @@ def score_goal_and_plan(goal, plan, llm_extractor, goal_predicate_set, plan_pred
     :param device: 设备（CPU 或 GPU）。
     :return: goal 和 plan 的总评分。
     """
+    # 只询问评分规则中出现的谓词
+    predicates = list(goal_predicate_set) + list(plan_predicate_set)
+    keys = [predicates[f] for f in scoring_features()]
     # 使用 GoalEvaluation 模板对 goal 进行评分
-    logic_atoms_goal = llm_extractor.extract_logic_atoms(goal, task="GoalEvaluation",background=background)
-    features_goal = transform_logic_atoms_to_features(logic_atoms_goal, goal_predicate_set)
-    print(f"features_goal: {features_goal}")
+    logic_atoms_goal = llm_extractor.extract_logic_atoms(goal, task="GoalEvaluation",background=background, keys=keys)
     # 使用 PlanEvaluation 模板对 plan 进行评分
-    logic_atoms_plan = llm_extractor.extract_logic_atoms(plan, task="PlanEvaluation",background=background)
-    features_plan = transform_logic_atoms_to_features(logic_atoms_plan, plan_predicate_set)
-    print(f"features_plan: {features_plan}")
-    # 将 goal 和 plan 的特征拼接为模型输入
-    features = torch.cat([features_goal, features_plan]).unsqueeze(0).to(device)
-    model = RuleBasedDNF(num_features=features.size(1), num_conjuncts=4, num_classes=2)
-    
-    model.set_conjunctions([
-        {0: 6, 4: -6},          # conj0 = P1 ∧ ¬P5
-        {2: 6, 6: 6, 9: -6},    # conj1 = P3 ∧ P7 ∧ ¬P10
-        {1: 6, 3: 6},           # conj2 = P2 ∧ P4
-        {5: -6, 7: 6}           # conj3 = ¬P6 ∧ P8
-    ])
-    model.set_disjunctions({
-        0: {0: 6, 1: 6},        # 类别0 = conj0 ∨ conj1
-        1: {2: 6, 3: 6}         # 类别1 = conj2 ∨ conj3
-    })
-    model.to(device)
+    logic_atoms_plan = llm_extractor.extract_logic_atoms(plan, task="PlanEvaluation",background=background, keys=keys)
+    return score_logic_atoms(logic_atoms_goal, logic_atoms_plan, goal_predicate_set, plan_predicate_set, device)
+
+def score_logic_atoms(logic_atoms_goal, logic_atoms_plan, goal_predicate_set, plan_predicate_set, device, backend=None):
+    """
+    对已经提取好的 goal / plan 逻辑原子进行评分。
+    :param logic_atoms_goal: goal 的逻辑原子字典。
+    :param logic_atoms_plan: plan 的逻辑原子字典。
+    :param goal_predicate_set: goal 的谓词集合。
+    :param plan_predicate_set: plan 的谓词集合。
+    :param device: 设备（CPU 或 GPU），仅 torch 后端使用。
+    :param backend: "numpy" 或 "torch"，默认取 SCORER_BACKEND。
+    :return: goal 和 plan 的总评分。
+    """
+    return score_logic_atoms_batch([(logic_atoms_goal, logic_atoms_plan)], goal_predicate_set, plan_predicate_set, device, backend)[0]
+
+def score_logic_atoms_batch(atoms_list, goal_predicate_set, plan_predicate_set, device=None, backend=None):
+    """
+    对多条决策的逻辑原子一次性评分（一次 [B, F] 前向计算）。
+    :param atoms_list: [(goal 逻辑原子, plan 逻辑原子), ...]。
+    :param goal_predicate_set: goal 的谓词集合。
+    :param plan_predicate_set: plan 的谓词集合。
+    :param device: 设备（CPU 或 GPU），仅 torch 后端使用。
+    :param backend: "numpy" 或 "torch"，默认取 SCORER_BACKEND。
+    :return: 每条决策的评分列表。
+    """
+    rows = []
+    for logic_atoms_goal, logic_atoms_plan in atoms_list:
+        features_goal = logic_atoms_to_vector(logic_atoms_goal, goal_predicate_set)
+        print(f"features_goal: {features_goal}")
+        features_plan = logic_atoms_to_vector(logic_atoms_plan, plan_predicate_set)
+        print(f"features_plan: {features_plan}")
+        # 将 goal 和 plan 的特征拼接为模型输入
+        rows.append(features_goal + features_plan)
+    return score_feature_batch(rows, device, backend)
+
+def get_rule_scorer(backend=None, device=None):
+    """
+    返回编译好的评分规则模型，按 (后端, 设备) 缓存，避免每条决策重新构建。
+    :param backend: "numpy"（无需 torch）或 "torch"。
+    :param device: torch 后端使用的设备。
+    :return: CompiledDNF 或 RuleBasedDNF 实例。
+    """
+    backend = backend or SCORER_BACKEND
+    key = (backend, str(device))
+    if key not in _scorers:
+        conjunctions, disjunctions = get_scoring_rules()
+        num_conjuncts = max(1, len(conjunctions))
+        if backend == "numpy":
+            _scorers[key] = CompiledDNF.from_rules(
+                conjunctions, disjunctions, SCORING_NUM_FEATURES, num_conjuncts, SCORING_NUM_CLASSES
+            )
+        elif backend == "torch":
+            from LLM_DNF_Novel.models.RuleBasedDNF import RuleBasedDNF
+            model = RuleBasedDNF(num_features=SCORING_NUM_FEATURES, num_conjuncts=num_conjuncts, num_classes=SCORING_NUM_CLASSES)
+            model.set_conjunctions(conjunctions)
+            model.set_disjunctions({c: {i: 1 for i in conjs} for c, conjs in disjunctions.items()})
+            model.to(device if device is not None else "cpu")
+            _scorers[key] = model
+        else:
+            raise ValueError(f"未知的评分后端: {backend}")
+    return _scorers[key]
+
+def score_feature_batch(features, device=None, backend=None):
+    """
+    对特征矩阵 [B, F] 进行一次前向计算，返回每行第 1 类的激活值。
+    :param features: 二维列表、numpy 数组或 torch 张量。
+    :param device: torch 后端使用的设备。
+    :param backend: "numpy" 或 "torch"，默认取 SCORER_BACKEND。
+    :return: 长度为 B 的评分列表。
+    """
+    backend = backend or SCORER_BACKEND
+    model = get_rule_scorer(backend, device)
+    if backend == "numpy":
+        output = model(np.asarray(features, dtype=np.float32))
+        # 提取第 1 类的概率（假设第 1 类为高质量决策）
+        return output[:, SCORE_CLASS].tolist()
+    import torch
+    features = torch.as_tensor(features, dtype=torch.float32, device=device)
     with torch.no_grad():
         output = model(features)  # 模型输出
-        score = output[0, 1].item()  # 提取第 1 类的概率（假设第 1 类为高质量决策）
-    return score    
+    return output[:, SCORE_CLASS].tolist()
@@ -1,6 +1,8 @@
 import torch
 import torch.nn as nn
 
+from LLM_DNF_Novel.models.compiled_dnf import compile_rules
+
 class RuleBasedDNF(nn.Module):
     """
     基于规则的 DNF 模型（无需训练，直接使用手动定义的逻辑规则进行分类）。
@@ -13,6 +15,7 @@ class RuleBasedDNF(nn.Module):
       1. 支持手动设置合取规则和析取规则。
       2. 直接以布尔或 [0,1] 连续值为输入，输出各类别的激活值。
       3. 提供可读规则展示功能。
+      4. 规则在设置时编译为符号 / 掩码张量，前向计算一次完成整个批次。
     """
     def __init__(self, num_features: int, num_conjuncts: int, num_classes: int):
         """
@@ -31,6 +34,11 @@ class RuleBasedDNF(nn.Module):
         self.conj_rules: list[dict[int, int]] = []
         # 存储析取规则的字典 {class_index: [conj_rule_indices]}
         self.disj_rules: dict[int, list[int]] = {}
+        # 编译后的规则张量（随 model.to(device) 一起迁移）
+        self.register_buffer("conj_pos", torch.zeros(num_conjuncts, num_features))
+        self.register_buffer("conj_neg", torch.zeros(num_conjuncts, num_features))
+        self.register_buffer("conj_active", torch.zeros(num_conjuncts))
+        self.register_buffer("class_mask", torch.zeros(num_classes, num_conjuncts))
 
     def set_conjunctions(self, rules: list[dict[int, int]]):
         """
@@ -45,6 +53,7 @@ class RuleBasedDNF(nn.Module):
         """
         # 直接替换规则列表，无需梯度。
         self.conj_rules = rules
+        self._compile()
 
     def set_disjunctions(self, rules: dict[int, dict[int, int]]):
         """
@@ -58,9 +67,43 @@ class RuleBasedDNF(nn.Module):
         """
         # 提取各类别对应的合取规则索引列表
         self.disj_rules = {c: list(conjs.keys()) for c, conjs in rules.items()}
+        self._compile()
+
+    def _compile(self):
+        """
+        将当前的字典规则编译为 conj_pos / conj_neg / conj_active / class_mask 张量。
+        """
+        signs, conj_active, class_mask = compile_rules(
+            self.conj_rules, self.disj_rules, self.num_features, self.num_conjuncts, self.num_classes
+        )
+        device = self.conj_pos.device
+        self.conj_pos = torch.as_tensor(signs > 0, dtype=torch.float32, device=device)
+        self.conj_neg = torch.as_tensor(signs < 0, dtype=torch.float32, device=device)
+        self.conj_active = torch.as_tensor(conj_active, dtype=torch.float32, device=device)
+        self.class_mask = torch.as_tensor(class_mask, dtype=torch.float32, device=device)
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """
+        前向计算（向量化）：
+          1. literal = 1 + pos * (x - 1) - neg * x，即 P 取 x、¬P 取 1 - x、不参与取 1，
+             对特征维累乘得到合取层输出 [B, num_conjuncts]。
+          2. 合取值乘以类别掩码后取最大值，得到析取层输出 [B, num_classes]。
+
+        Args:
+            x (torch.Tensor): 输入张量，形状 [B, num_features]。
+
+        Returns:
+            torch.Tensor: 输出张量，形状 [B, num_classes]。
+        """
+        x = x.unsqueeze(1)
+        literals = 1.0 + self.conj_pos * (x - 1.0) - self.conj_neg * x
+        conj_vals = literals.prod(dim=2) * self.conj_active
+        return (conj_vals.unsqueeze(1) * self.class_mask.unsqueeze(0)).amax(dim=2)
+
+    def forward_loop(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        逐规则、逐特征的参考实现，结果与 forward 相同，仅用于校验和基准对比。
+
         前向计算：
           1. 计算每条合取规则的激活值（AND 运算）。
           2. 对每个类别，将其对应合取规则取最大值（OR 运算）。
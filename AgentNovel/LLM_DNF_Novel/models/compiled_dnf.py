@@ -0,0 +1,87 @@
+import numpy as np
+
+
+def compile_rules(conj_rules: list[dict[int, int]], disj_rules: dict[int, list[int]],
+                  num_features: int, num_conjuncts: int, num_classes: int):
+    """
+    将字典形式的合取 / 析取规则编译为稠密矩阵。
+
+    Args:
+        conj_rules   (list[dict]): 合取规则列表，每条为 {feature_index: sign}。
+        disj_rules   (dict): 析取规则 {class_index: [conj_rule_indices]}。
+        num_features  (int): 输入特征维度。
+        num_conjuncts (int): 合取规则数量（未定义的规则恒为 0）。
+        num_classes   (int): 输出类别数量。
+
+    Returns:
+        tuple: (signs, conj_active, class_mask)
+            signs       [num_conjuncts, num_features] int8，+1 为 P，-1 为 ¬P，0 为不参与。
+            conj_active [num_conjuncts] bool，该合取规则是否已定义。
+            class_mask  [num_classes, num_conjuncts] bool，类别是否包含该合取规则。
+    """
+    signs = np.zeros((num_conjuncts, num_features), dtype=np.int8)
+    conj_active = np.zeros(num_conjuncts, dtype=bool)
+    for i, rule in enumerate(conj_rules[:num_conjuncts]):
+        conj_active[i] = True
+        for feat_idx, sign in rule.items():
+            signs[i, feat_idx] = 1 if sign > 0 else -1
+
+    class_mask = np.zeros((num_classes, num_conjuncts), dtype=bool)
+    for class_idx, conj_idxs in disj_rules.items():
+        class_mask[class_idx, list(conj_idxs)] = True
+    return signs, conj_active, class_mask
+
+
+class CompiledDNF:
+    """
+    纯 NumPy 实现的规则 DNF 前向计算，不依赖 torch。
+
+    与 RuleBasedDNF 语义一致：
+      - 合取：对规则中的特征做乘积，P 取 x，¬P 取 1 - x。
+      - 析取：类别取其合取规则的最大值，没有规则的类别恒为 0。
+    """
+    # 大批量输入按块计算，限制 [B, C, F] 中间结果的内存占用
+    chunk_size = 65536
+
+    def __init__(self, signs: np.ndarray, conj_active: np.ndarray, class_mask: np.ndarray):
+        self.num_conjuncts, self.num_features = signs.shape
+        self.num_classes = class_mask.shape[0]
+        self.pos = (signs > 0).astype(np.float32)
+        self.neg = (signs < 0).astype(np.float32)
+        self.conj_active = conj_active.astype(np.float32)
+        self.class_mask = class_mask.astype(np.float32)
+
+    @classmethod
+    def from_rules(cls, conj_rules, disj_rules, num_features, num_conjuncts, num_classes) -> "CompiledDNF":
+        return cls(*compile_rules(conj_rules, disj_rules, num_features, num_conjuncts, num_classes))
+
+    def conjunctions(self, x: np.ndarray) -> np.ndarray:
+        """
+        计算合取层输出，形状 [B, num_conjuncts]。
+        """
+        x = x[:, None, :]
+        # P: x；¬P: 1 - x；不参与: 1
+        literals = 1.0 + self.pos * (x - 1.0) - self.neg * x
+        return literals.prod(axis=2) * self.conj_active
+
+    def forward(self, x: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            x (np.ndarray): 输入，形状 [B, num_features]，取值 0/1 或 [0,1]。
+
+        Returns:
+            np.ndarray: 输出，形状 [B, num_classes]。
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[None, :]
+        outputs = []
+        for start in range(0, x.shape[0], self.chunk_size):
+            conj_vals = self.conjunctions(x[start:start + self.chunk_size])
+            # 合取值非负，用掩码相乘后取最大即为 OR
+            outputs.append((conj_vals[:, None, :] * self.class_mask[None, :, :]).max(axis=2))
+        if not outputs:
+            return np.zeros((0, self.num_classes), dtype=np.float32)
+        return np.concatenate(outputs, axis=0)
+
+    __call__ = forward
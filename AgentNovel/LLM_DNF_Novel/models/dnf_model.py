@@ -2,6 +2,18 @@ import torch
 import torch.nn as nn
 
 class DNFModel(nn.Module):
+    """
+    可训练的 DNF 模型（软逻辑），训练后可导出为 RuleBasedDNF 的硬规则。
+
+    逻辑结构：
+      - 合取层：权重 w[c, f] 经 tanh 后，符号表示文字为 P_f（> 0）或 ¬P_f（< 0），
+        绝对值表示该文字参与合取的程度；合取值 = ∏_f (1 - |tanh(w)| · (1 - literal))，
+        literal 对 P_f 取 x_f、对 ¬P_f 取 1 - x_f。
+      - 析取层：sigmoid(v[k, c]) 表示合取 c 属于类别 k 的程度；
+        类别值 = 1 - ∏_c (1 - sigmoid(v) · conj_c)（软 OR）。
+
+    |tanh(w)| 趋于 1 或 0、sigmoid(v) 趋于 1 或 0 时，与 RuleBasedDNF 的前向计算一致。
+    """
     def __init__(self, num_features, num_conjuncts, num_classes):
         super(DNFModel, self).__init__()
         self.num_features = num_features
@@ -11,14 +23,24 @@ class DNFModel(nn.Module):
         # 定义合取项（Conjunctions）和析取项（Disjunctions）的权重
         self.conjunctions = nn.Linear(num_features, num_conjuncts, bias=False)
         self.disjunctions = nn.Linear(num_conjuncts, num_classes, bias=False)
+        # 特征掩码：被剪枝的谓词置 0，不再参与任何合取
+        self.register_buffer("feature_mask", torch.ones(num_features))
+
+    def conjunction_values(self, x):
+        """
+        计算合取层输出，形状 [B, num_conjuncts]。
+        """
+        strength = torch.tanh(self.conjunctions.weight)              # [C, F]
+        x = x.unsqueeze(1)                                           # [B, 1, F]
+        literals = torch.where(strength > 0, x, 1.0 - x)             # [B, C, F]
+        terms = 1.0 - strength.abs() * self.feature_mask * (1.0 - literals)
+        return terms.prod(dim=2)
 
     def forward(self, x):
         # 计算合取项
-        conjuncts = torch.sigmoid(self.conjunctions(x))
-        # 计算析取项
-        disjuncts = torch.sigmoid(self.disjunctions(conjuncts))
-        print(f"conjuncts: {conjuncts}")
-        print(f"disjuncts: {disjuncts}")
-        # 返回每个类的概率 
-         
-        return disjuncts
\ No newline at end of file
+        conjuncts = self.conjunction_values(x)
+        # 计算析取项：软 OR
+        membership = torch.sigmoid(self.disjunctions.weight)         # [K, C]
+        disjuncts = 1.0 - (1.0 - membership.unsqueeze(0) * conjuncts.unsqueeze(1)).prod(dim=2)
+        # 返回每个类的激活值 [B, num_classes]
+        return disjuncts
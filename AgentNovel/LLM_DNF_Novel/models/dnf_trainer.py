@@ -0,0 +1,267 @@
+import json
+import os
+
+import numpy as np
+
+from LLM_DNF_Novel.models.compiled_dnf import CompiledDNF
+
+# torch 只在训练和导出 RuleBasedDNF 时导入；规则抽取、评估和重要性计算只依赖 NumPy
+
+# 默认训练参数
+NUM_CONJUNCTS = 8
+NUM_CLASSES = 2
+EPOCHS = 200
+BATCH_SIZE = 64
+LEARNING_RATE = 0.05
+# 导出硬规则：|tanh(w)| 达到该值的文字保留在合取中，sigmoid(v) 达到该值的合取计入类别
+LITERAL_THRESHOLD = 0.5
+MEMBERSHIP_THRESHOLD = 0.5
+# 第 1 类为高质量决策（与 mark.SCORE_CLASS 一致），该类输出 >= 0.5 判为正例
+SCORE_CLASS = 1
+# 置换重要性的重复次数
+PERMUTATION_REPEATS = 10
+# 重要性不高于该值的谓词被剪枝；剪枝后规则的 macro-F1 下降不超过 PRUNE_TOLERANCE 才采用
+PRUNE_THRESHOLD = 0.0
+PRUNE_TOLERANCE = 0.01
+
+
+def train_dnf(features, labels, num_conjuncts: int = NUM_CONJUNCTS, epochs: int = EPOCHS,
+              batch_size: int = BATCH_SIZE, learning_rate: float = LEARNING_RATE, feature_mask=None,
+              model=None, seed: int = 0, device: str = "cpu"):
+    """
+    在 CPU（或指定设备）上按批训练 DNFModel，损失为各类别输出与独热标签的二元交叉熵。
+
+    :param features: 0/1 特征矩阵 [N, F]
+    :param labels: 标签 [N]，取值为类别下标
+    :param feature_mask: 可选的特征掩码 [F]，为 0 的谓词不参与合取（剪枝后继续训练时使用）
+    :param model: 继续训练的已有模型；为 None 时新建
+    :return: 训练后的 DNFModel（评估模式）
+    """
+    import torch
+    import torch.nn.functional as F
+    from LLM_DNF_Novel.models.dnf_model import DNFModel
+    from LLM_DNF_Novel.utils.dataset import make_loader
+
+    torch.manual_seed(seed)
+    if model is None:
+        model = DNFModel(num_features=features.shape[1], num_conjuncts=num_conjuncts, num_classes=NUM_CLASSES)
+    if feature_mask is not None:
+        model.feature_mask.copy_(torch.as_tensor(feature_mask, dtype=torch.float32))
+    model.to(device)
+    model.train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+    loader = make_loader(features, labels, batch_size, shuffle=True, seed=seed)
+    report_every = max(1, epochs // 10)
+    for epoch in range(1, epochs + 1):
+        total = 0.0
+        for x, y in loader:
+            x, y = x.to(device), y.to(device)
+            target = F.one_hot(y, model.num_classes).float()
+            output = model(x).clamp(1e-6, 1 - 1e-6)
+            loss = F.binary_cross_entropy(output, target)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(y)
+        if epoch % report_every == 0 or epoch == epochs:
+            print(f"epoch {epoch}/{epochs} loss {total / len(labels):.4f}")
+    model.eval()
+    return model
+
+
+def predict_model(model, features, device: str = "cpu") -> np.ndarray:
+    """
+    用训练好的软逻辑模型预测 0/1 标签。
+    """
+    import torch
+
+    with torch.no_grad():
+        output = model(torch.as_tensor(features, dtype=torch.float32, device=device)).cpu().numpy()
+    return (output[:, SCORE_CLASS] >= 0.5).astype(np.int64)
+
+
+def model_weights(model):
+    """
+    返回 (合取层权重 [C, F], 析取层权重 [K, C], 特征掩码 [F]) 的 NumPy 数组。
+    """
+    return (model.conjunctions.weight.detach().cpu().numpy(),
+            model.disjunctions.weight.detach().cpu().numpy(),
+            model.feature_mask.detach().cpu().numpy())
+
+
+def extract_rules(conj_weights: np.ndarray, disj_weights: np.ndarray, feature_mask: np.ndarray = None,
+                  literal_threshold: float = LITERAL_THRESHOLD, membership_threshold: float = MEMBERSHIP_THRESHOLD):
+    """
+    把 DNFModel 的权重离散化为 RuleBasedDNF 形式的规则。
+    只保留被某个类别使用的合取，相同的合取合并为一条。
+
+    :return: (合取规则 [{feature_index: ±1}], 析取规则 {class_index: [conj_index]})
+    """
+    strength = np.tanh(conj_weights)
+    mask = np.ones(strength.shape[1]) if feature_mask is None else np.asarray(feature_mask)
+    membership = 1.0 / (1.0 + np.exp(-disj_weights))
+
+    conj_rules, index = [], {}
+    disj_rules = {}
+    for class_idx in range(membership.shape[0]):
+        members = []
+        for conj_idx in np.nonzero(membership[class_idx] >= membership_threshold)[0]:
+            rule = {int(f): 1 if s > 0 else -1 for f, s in enumerate(strength[conj_idx])
+                    if mask[f] > 0 and abs(s) >= literal_threshold}
+            key = tuple(sorted(rule.items()))
+            if key not in index:
+                index[key] = len(conj_rules)
+                conj_rules.append(rule)
+            if index[key] not in members:
+                members.append(index[key])
+        disj_rules[class_idx] = members
+    return conj_rules, disj_rules
+
+
+def rules_scorer(conj_rules, disj_rules, num_features: int, num_classes: int = NUM_CLASSES) -> CompiledDNF:
+    """
+    把规则编译为 NumPy 前向计算（与 RuleBasedDNF 结果一致）。
+    """
+    return CompiledDNF.from_rules(conj_rules, disj_rules, num_features, max(1, len(conj_rules)), num_classes)
+
+
+def predict_rules(conj_rules, disj_rules, features: np.ndarray) -> np.ndarray:
+    """
+    用硬规则预测 0/1 标签。
+    """
+    scorer = rules_scorer(conj_rules, disj_rules, features.shape[1])
+    return (scorer(features)[:, SCORE_CLASS] >= 0.5).astype(np.int64)
+
+
+def rule_features(conj_rules, disj_rules) -> list:
+    """
+    评分类别（SCORE_CLASS）的合取中出现的特征下标（升序）。不在其中的谓词对评分没有影响，无需询问。
+    """
+    return sorted({f for i in disj_rules.get(SCORE_CLASS, []) for f in conj_rules[i]})
+
+
+def permutation_importance(conj_rules, disj_rules, features: np.ndarray, labels: np.ndarray,
+                           repeats: int = PERMUTATION_REPEATS, seed: int = 0) -> dict:
+    """
+    置换重要性：逐个打乱特征列，规则预测的 macro-F1 平均下降多少。
+    规则中未出现的特征重要性为 0。
+
+    :return: {特征下标: 重要性}
+    """
+    from LLM_DNF_Novel.utils.evaluation import evaluate
+
+    rng = np.random.default_rng(seed)
+    _, base_f1 = evaluate(predict_rules(conj_rules, disj_rules, features), labels)
+    importance = {f: 0.0 for f in range(features.shape[1])}
+    for f in rule_features(conj_rules, disj_rules):
+        drops = []
+        for _ in range(repeats):
+            shuffled = features.copy()
+            shuffled[:, f] = rng.permutation(shuffled[:, f])
+            _, f1 = evaluate(predict_rules(conj_rules, disj_rules, shuffled), labels)
+            drops.append(base_f1 - f1)
+        importance[f] = float(np.mean(drops))
+    return importance
+
+
+def to_rule_based(conj_rules, disj_rules, num_features: int, num_classes: int = NUM_CLASSES):
+    """
+    构建与规则对应的 RuleBasedDNF（torch 后端评分使用）。
+    """
+    from LLM_DNF_Novel.models.RuleBasedDNF import RuleBasedDNF
+
+    model = RuleBasedDNF(num_features=num_features, num_conjuncts=max(1, len(conj_rules)), num_classes=num_classes)
+    model.set_conjunctions(conj_rules)
+    model.set_disjunctions({c: {i: 1 for i in conjs} for c, conjs in disj_rules.items()})
+    return model
+
+
+def _metrics(predictions, labels) -> dict:
+    from LLM_DNF_Novel.utils.evaluation import evaluate
+
+    acc, macro_f1 = evaluate(predictions, labels)
+    return {"accuracy": round(float(acc), 4), "macro_f1": round(float(macro_f1), 4)}
+
+
+def fit_and_extract(train_x, train_y, val_x, val_y, test_x, test_y, predicates,
+                    num_conjuncts: int = NUM_CONJUNCTS, epochs: int = EPOCHS, batch_size: int = BATCH_SIZE, learning_rate: float = LEARNING_RATE,
+                    prune_threshold: float = PRUNE_THRESHOLD, prune_tolerance: float = PRUNE_TOLERANCE,
+                    seed: int = 0, device: str = "cpu"):
+    """
+    完整流程：训练 → 导出规则 → 在验证集上计算置换重要性 → 剪枝并继续训练 → 再次导出。
+    剪枝后规则在验证集上的 macro-F1 下降超过 prune_tolerance 时保留剪枝前的结果。
+    重要性和剪枝决定只使用验证集，测试集只用于报告最终模型和规则的指标。
+
+    :param predicates: 特征对应的谓词名
+    :return: (DNFModel, 结果字典)；结果字典可由 save_rules 保存，供评分（mark.get_scoring_rules）使用
+    """
+    num_features = train_x.shape[1]
+    model = train_dnf(train_x, train_y, num_conjuncts, epochs, batch_size, learning_rate, seed=seed, device=device)
+    conj_rules, disj_rules = extract_rules(*model_weights(model))
+    metrics = {
+        "train_examples": int(len(train_y)),
+        "val_examples": int(len(val_y)),
+        "test_examples": int(len(test_y)),
+        "validation": {"rules": _metrics(predict_rules(conj_rules, disj_rules, val_x), val_y)},
+    }
+    importance = permutation_importance(conj_rules, disj_rules, val_x, val_y, seed=seed)
+
+    mask = np.array([1.0 if importance[f] > prune_threshold else 0.0 for f in range(num_features)])
+    pruned = [predicates[f] for f in range(num_features) if mask[f] == 0]
+    if pruned and mask.any():
+        print(f"剪枝谓词 {pruned}，继续训练")
+        state = {k: v.clone() for k, v in model.state_dict().items()}
+        model = train_dnf(train_x, train_y, num_conjuncts, max(1, epochs // 2), batch_size, learning_rate,
+                          feature_mask=mask, model=model, seed=seed, device=device)
+        pruned_conj, pruned_disj = extract_rules(*model_weights(model))
+        pruned_metrics = _metrics(predict_rules(pruned_conj, pruned_disj, val_x), val_y)
+        base_f1 = metrics["validation"]["rules"]["macro_f1"]
+        metrics["validation"]["pruned_rules"] = pruned_metrics
+        metrics["pruned"] = pruned_metrics["macro_f1"] >= base_f1 - prune_tolerance
+        if metrics["pruned"]:
+            conj_rules, disj_rules = pruned_conj, pruned_disj
+        else:
+            print(f"剪枝后验证集 macro-F1 下降过多（{base_f1} -> {pruned_metrics['macro_f1']}），保留剪枝前的规则")
+            model.load_state_dict(state)
+
+    # 最终模型和规则在未参与训练和选择的测试集上评估
+    metrics["model"] = _metrics(predict_model(model, test_x, device), test_y)
+    metrics["rules"] = _metrics(predict_rules(conj_rules, disj_rules, test_x), test_y)
+
+    used = rule_features(conj_rules, disj_rules)
+    result = {
+        "num_features": num_features,
+        "num_classes": NUM_CLASSES,
+        "predicates": list(predicates),
+        "conjunctions": conj_rules,
+        "disjunctions": disj_rules,
+        "active_predicates": [predicates[f] for f in used],
+        "pruned_predicates": [predicates[f] for f in range(num_features) if f not in used],
+        "importance": {predicates[f]: round(value, 4) for f, value in importance.items()},
+        "metrics": metrics,
+    }
+    return model, result
+
+
+def save_rules(result: dict, path: str) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def format_rules(result: dict) -> str:
+    """
+    可读的规则文本，谓词以名称表示，例如 "类别1 = (p2 ∧ p4) ∨ (¬p6 ∧ p8)"。
+    """
+    predicates = result["predicates"]
+    lines = []
+    for class_idx, conjs in sorted(result["disjunctions"].items(), key=lambda item: int(item[0])):
+        clauses = []
+        for conj_idx in conjs:
+            rule = result["conjunctions"][conj_idx]
+            terms = [(predicates[int(f)] if sign > 0 else f"¬{predicates[int(f)]}") for f, sign in rule.items()]
+            clauses.append("(" + (" ∧ ".join(terms) if terms else "∅") + ")")
+        lines.append(f"类别{class_idx} = " + (" ∨ ".join(clauses) if clauses else "∅"))
+    return "\n".join(lines)
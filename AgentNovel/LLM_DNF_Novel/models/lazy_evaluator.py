@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+
+from LLM_DNF_Novel.utils.prompt_templates import PROMPT_TEMPLATES
+
+# 谓词历史统计的默认存储位置
+PREDICATE_STATS_PATH = os.environ.get("PREDICATE_STATS_PATH", os.path.join(".llm_cache", "predicate_stats.json"))
+
+
+class PredicateStats:
+    """
+    记录每个谓词历史上回答为 true 的次数，用于估计 P(谓词为真)。
+    """
+    def __init__(self, path: str = None):
+        self.path = path
+        self.counts: dict[str, list[int]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.counts = {k: list(v) for k, v in json.load(f).items()}
+
+    def p_true(self, key: str) -> float:
+        """
+        带拉普拉斯平滑的真值概率，无历史时为 0.5。
+        """
+        true_count, total = self.counts.get(key, (0, 0))
+        return (true_count + 1) / (total + 2)
+
+    def update(self, key: str, value: bool) -> None:
+        with self._lock:
+            true_count, total = self.counts.get(key, (0, 0))
+            self.counts[key] = [true_count + int(value), total + 1]
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.counts, f, ensure_ascii=False)
+
+
+class LazyPredicateEvaluator:
+    """
+    按 DNF 规则结构惰性地询问谓词：
+
+      - 合取规则中任一文字为假，该合取即为 0；全部文字为真，该合取即为 1。
+      - 类别中任一合取为 1，类别输出为 1；全部合取为 0，类别输出为 0。
+      - 目标类别的输出全部确定后立即停止，剩余谓词不再调用 LLM。
+
+    输入为 0/1 布尔特征时，得到的目标类别输出与询问全部谓词完全一致。
+    """
+    def __init__(self, extractor, conj_rules, disj_rules, feature_keys, target_classes=(1,), stats: PredicateStats = None):
+        """
+        :param extractor: LLMExtractor 实例（需提供 extract_predicate，支持 return_source）。
+        :param conj_rules: 合取规则列表 [{feature_index: sign}]。
+        :param disj_rules: 析取规则 {class_index: {conj_index: ...}} 或 {class_index: [conj_index]}。
+        :param feature_keys: 特征下标对应的谓词名，如 ["p1", ..., "p10"]。
+        :param target_classes: 需要确定输出的类别。
+        :param stats: 可选的谓词历史统计，用于决定询问顺序。
+        """
+        self.extractor = extractor
+        self.conj_rules = [{f: (1 if s > 0 else -1) for f, s in rule.items()} for rule in conj_rules]
+        self.disj_rules = {c: list(conjs) for c, conjs in disj_rules.items()}
+        self.feature_keys = list(feature_keys)
+        self.target_classes = list(target_classes)
+        self.stats = stats
+        self.task_of = {key: task for task, prompts in PROMPT_TEMPLATES.items() for key in prompts}
+        # 累计统计：queried 为得到回答的谓词数，其中 llm_calls 来自 LLM 调用、local 来自本地分类器
+        self.queried = 0
+        self.llm_calls = 0
+        self.local = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def _conj_state(self, conj_idx, known):
+        """
+        返回合取规则的状态：0 / 1 已确定，None 未确定。
+        """
+        undecided = False
+        for feat_idx, sign in self.conj_rules[conj_idx].items():
+            if feat_idx not in known:
+                undecided = True
+                continue
+            literal = known[feat_idx] if sign > 0 else 1 - known[feat_idx]
+            if literal == 0:
+                return 0
+        return None if undecided else 1
+
+    def _open_conjunctions(self, known):
+        """
+        返回尚未确定输出的目标类别中、仍未确定的合取规则下标。
+        """
+        open_conjs = []
+        for class_idx in self.target_classes:
+            states = [self._conj_state(c, known) if c < len(self.conj_rules) else 0 for c in self.disj_rules.get(class_idx, [])]
+            if 1 in states or all(state == 0 for state in states):
+                continue
+            open_conjs.extend(c for c, state in zip(self.disj_rules[class_idx], states) if state is None)
+        return open_conjs
+
+    def _literal_false_prob(self, feat_idx, sign):
+        p_true = self.stats.p_true(self.feature_keys[feat_idx]) if self.stats else 0.5
+        return 1 - p_true if sign > 0 else p_true
+
+    def _next_feature(self, known, open_conjs):
+        """
+        选择最可能让某个合取规则立即确定的谓词：
+        文字为假直接否定合取；文字为真且是合取中最后一个未知项时直接满足合取。
+        """
+        gains = {}
+        for conj_idx in set(open_conjs):
+            rule = self.conj_rules[conj_idx]
+            unknown = [f for f in rule if f not in known]
+            for feat_idx in unknown:
+                p_false = self._literal_false_prob(feat_idx, rule[feat_idx])
+                gains[feat_idx] = gains.get(feat_idx, 0.0) + p_false + (1 - p_false) / len(unknown)
+        return max(sorted(gains), key=lambda f: gains[f])
+
+    def evaluate(self, goal, plan, background):
+        """
+        对一条决策惰性提取逻辑原子。
+        :param goal: 决策中的目标。
+        :param plan: 决策中的计划。
+        :param background: 背景信息（建议传入背景摘要）。
+        :return: (goal 逻辑原子, plan 逻辑原子, 本次询问的谓词数)
+        """
+        known = {}
+        sources = {"llm": 0, "local": 0}
+        atoms = {"GoalEvaluation": {}, "PlanEvaluation": {}}
+        while True:
+            open_conjs = self._open_conjunctions(known)
+            if not open_conjs:
+                break
+            feat_idx = self._next_feature(known, open_conjs)
+            key = self.feature_keys[feat_idx]
+            task = self.task_of[key]
+            text = goal if task == "GoalEvaluation" else plan
+            answer, source = self.extractor.extract_predicate(text, task, key, background, return_source=True)
+            sources[source] += 1
+            atoms[task][key] = answer
+            known[feat_idx] = 1 if answer == "true" else 0
+            # 请求失败（"Error"）等无效回答不计入历史统计，避免被当作 false 影响询问顺序
+            if self.stats is not None and answer in ("true", "false"):
+                self.stats.update(key, answer == "true")
+
+        with self._lock:
+            self.queried += len(known)
+            self.llm_calls += sources["llm"]
+            self.local += sources["local"]
+            self.skipped += len(self.feature_keys) - len(known)
+        print(f"惰性谓词评估：询问 {len(known)} 项（LLM {sources['llm']}，本地 {sources['local']}），"
+              f"跳过 {len(self.feature_keys) - len(known)} 项")
+        return atoms["GoalEvaluation"], atoms["PlanEvaluation"], len(known)
@@ -1,31 +1,270 @@
+import json
+
+from LLM_DNF_Novel.models.local_classifier import get_local_model, log_pairs
 from LLM_DNF_Novel.utils.prompt_templates import PROMPT_TEMPLATES
-from llm import get_response_from_llm
+from llm import LLMError, get_response_from_llm, gather_responses
+from structured_output import StructuredOutputError, parse_json
+
+# 背景摘要中保留的最近事件条数
+DIGEST_RECENT_EVENTS = 3
+
+
+def build_background_digest(background) -> str:
+    """
+    将 background（完整环境 + 每个角色的 __dict__）压缩为紧凑的 JSON 摘要，
+    每轮只需生成一次，供所有谓词判断共用。
+    :param background: 包含 "environment" 和 "personal_info" 的背景字典
+    :return: 紧凑 JSON 字符串
+    """
+    if isinstance(background, str):
+        return background
+    environment = background.get("environment", {}) or {}
+    personal_info = background.get("personal_info", {}) or {}
+
+    def _description(value):
+        return value.get("description", "") if isinstance(value, dict) else value
+
+    digest = {
+        "environment": {
+            "location": environment.get("location", ""),
+            "event": environment.get("event", ""),
+            "atmosphere": environment.get("atmosphere", ""),
+            "recent_events": list(environment.get("recent_events", []))[-DIGEST_RECENT_EVENTS:],
+            "long_term_goal": _description(environment.get("long_term_goal", "")),
+            "environment_goal": _description(environment.get("environment_goal", "")),
+        },
+        "characters": {
+            name: {
+                "personality": info.get("personality", ""),
+                "role": info.get("role", ""),
+                "profession": info.get("profession", ""),
+                "health_status": info.get("health_status", ""),
+                "goal": (info.get("goal") or [""])[-1],
+            }
+            for name, info in personal_info.items()
+        },
+    }
+    return json.dumps(digest, ensure_ascii=False, separators=(",", ":"))
+
+
+def _normalize_answer(value) -> str:
+    """
+    将模型给出的判断统一为 "true" / "false"，无法识别时返回 None。
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower()
+    return None
+
+
+def _parse_json_array(response: str):
+    """
+    从模型回答中取出 JSON 数组（允许包裹在代码块或说明文字中，或被截断）。
+    """
+    try:
+        data, _ = parse_json(response, expect="array")
+    except StructuredOutputError:
+        return None
+    return data if isinstance(data, list) else None
 
 
 class LLMExtractor:
-    def extract_logic_atoms(self, text, task,background):
+    def __init__(self, local_model=None):
+        """
+        :param local_model: 本地谓词分类器（LocalPredicateModel），默认加载 PREDICATE_MODEL_PATH；
+            置信度足够的谓词由它直接判断，其余交给 LLM，LLM 的回答记录为训练数据
+        """
+        self.local_model = local_model if local_model is not None else get_local_model()
+
+    def _local_answers(self, items):
+        # items: [(文本, 谓词名)]，返回本地判断结果，未启用或置信度不足的为 None
+        if self.local_model is None:
+            return [None] * len(items)
+        return self.local_model.predict(items)
+
+    def _predicate_system(self, background):
+        # 说明和背景在同一轮的所有谓词判断中相同，作为 system 前缀
+        return ("You are a helpful assistant for evaluating text quality. "
+                f"Please respond with only 'true' or 'false'.\nbackground:{background}")
+
+    def _predicate_prompt(self, text, prompt):
+        # 同一文本的各个谓词共享 Text 前缀，谓词问题放在最后，并要求只返回 true 或 false
+        return f"Text: {text}\n{prompt}\nPlease respond with only 'true' or 'false'."
+
+    def extract_predicate(self, text, task, key, background, return_source=False):
+        """
+        只询问单个谓词
+        :param text: 输入的文本
+        :param task: 使用的任务模板（GoalEvaluation 或 PlanEvaluation）
+        :param key: 谓词名，如 "p1"
+        :param return_source: 为 True 时同时返回回答来源（"local" 为本地分类器，"llm" 为 LLM 调用）
+        :return: 模型回答（"true" / "false"，请求失败时为 "Error"）；return_source 为 True 时为 (回答, 来源)
+        """
+        local = self._local_answers([(text, key)])[0]
+        if local is not None:
+            return (local, "local") if return_source else local
+        full_prompt = self._predicate_prompt(text, PROMPT_TEMPLATES[task][key])
+        try:
+            answer = get_response_from_llm(full_prompt, cache=True, call_site=f"predicate-{key}",
+                                           system=self._predicate_system(background)).strip()
+            log_pairs([(text, key, answer)])
+        except LLMError as e:
+            print(f"Error during API call for {key}: {e}")
+            answer = "Error"
+        return (answer, "llm") if return_source else answer
+
+    def extract_logic_atoms(self, text, task,background, keys=None):
         """
         使用 LLM 提取逻辑原子
         :param text: 输入的文本
         :param task: 使用的任务模板（GoalEvaluation 或 PlanEvaluation）
+        :param keys: 只提取这些谓词（评分规则中出现的谓词），默认提取模板中的全部谓词
         :return: 提取的逻辑原子字典
         """
         prompts = PROMPT_TEMPLATES.get(task, {})
         if not prompts:
             raise ValueError(f"Task '{task}' not found in PROMPT_TEMPLATES.")
+        if keys is not None:
+            prompts = {k: p for k, p in prompts.items() if k in keys}
 
         logic_atoms = {}
-        for key, prompt in prompts.items():
-            # 添加前缀到 full_prompt，并要求只返回 true 或 false
-            full_prompt = f"You are a helpful assistant for evaluating text quality.\n{prompt}\nText: {text}\nbackground:{background}Please respond with only 'true' or 'false'."
+        system = self._predicate_system(background)
+        local = self._local_answers([(text, key) for key in prompts])
+        for (key, prompt), local_answer in zip(prompts.items(), local):
+            if local_answer is not None:
+                logic_atoms[key] = local_answer
+                continue
+            full_prompt = self._predicate_prompt(text, prompt)
             try:
-                response = get_response_from_llm(full_prompt)
+                response = get_response_from_llm(full_prompt, cache=True, call_site=f"predicate-{key}", system=system)
                 logic_atoms[key] = response.strip()
-            except Exception as e:
+            except LLMError as e:
                 print(f"Error during API call for {key}: {e}")
                 logic_atoms[key] = "Error"
+        log_pairs([(text, key, logic_atoms[key]) for key, answer in zip(prompts, local) if answer is None])
         print(f"Extracted logic atoms for task '{task}': {logic_atoms}")
         return logic_atoms
+
+    def extract_decisions_batch(self, decisions, background_digest, keys=None, decision_keys=None):
+        """
+        用一次结构化 JSON 请求，同时判断多条决策的全部 GoalEvaluation 与 PlanEvaluation 谓词。
+        本地分类器先判断每个谓词，置信度足够的回答直接采用，每条决策只把其余谓词交给 LLM；
+        全部谓词都能本地判断时不调用 LLM。解析失败或缺失的谓词再逐条回退为单谓词调用。
+        :param decisions: 决策列表，每个决策包含 "goal" 和 "plan"
+        :param background_digest: build_background_digest 生成的背景摘要
+        :param keys: 只提取这些谓词（评分规则中出现的谓词），默认提取全部谓词
+        :param decision_keys: 与 decisions 对应的谓词列表（None 表示全部谓词），给出时替代 keys
+        :return: 与 decisions 一一对应的 (goal 逻辑原子, plan 逻辑原子) 列表
+        """
+        if decision_keys is None:
+            decision_keys = [keys] * len(decisions)
+        goal_prompts, plan_prompts = self._batch_prompts()
+        wanted = [([k for k in goal_prompts if ks is None or k in ks],
+                   [k for k in plan_prompts if ks is None or k in ks]) for ks in decision_keys]
+        items = [(d["goal"], k) for d, (goal_keys, _) in zip(decisions, wanted) for k in goal_keys] + \
+                [(d["plan"], k) for d, (_, plan_keys) in zip(decisions, wanted) for k in plan_keys]
+        local = iter(self._local_answers(items))
+        results = [({k: next(local) for k in goal_keys}, {}) for goal_keys, _ in wanted]
+        for atoms, (_, plan_keys) in zip(results, wanted):
+            atoms[1].update({k: next(local) for k in plan_keys})
+
+        # 每条决策只请求本地置信度不足的谓词
+        pending = [(i, ([k for k, v in goal_atoms.items() if v is None],
+                        [k for k, v in plan_atoms.items() if v is None]))
+                   for i, (goal_atoms, plan_atoms) in enumerate(results)
+                   if None in goal_atoms.values() or None in plan_atoms.values()]
+        deferred = sum(len(goal_keys) + len(plan_keys) for _, (goal_keys, plan_keys) in pending)
+        if deferred < len(items):
+            print(f"本地谓词分类器判断了 {len(items) - deferred}/{len(items)} 个谓词")
+        if pending:
+            answers = self._extract_batch_llm([decisions[i] for i, _ in pending], background_digest,
+                                              [task_keys for _, task_keys in pending])
+            for (i, _), (goal_atoms, plan_atoms) in zip(pending, answers):
+                results[i][0].update(goal_atoms)
+                results[i][1].update(plan_atoms)
+
+        for goal_atoms, plan_atoms in results:
+            print(f"Extracted logic atoms (batched): {goal_atoms} {plan_atoms}")
+        return results
+
+    def _batch_prompts(self, keys=None):
+        goal_prompts = PROMPT_TEMPLATES["GoalEvaluation"]
+        plan_prompts = PROMPT_TEMPLATES["PlanEvaluation"]
+        if keys is not None:
+            goal_prompts = {k: p for k, p in goal_prompts.items() if k in keys}
+            plan_prompts = {k: p for k, p in plan_prompts.items() if k in keys}
+        return goal_prompts, plan_prompts
+
+    def _extract_batch_llm(self, decisions, background_digest, decision_keys):
+        """
+        extract_decisions_batch 中交给 LLM 的部分，LLM 的回答记录为本地分类器的训练数据。
+        :param decision_keys: 与 decisions 对应的 (goal 谓词列表, plan 谓词列表)
+        """
+        used = {k for goal_keys, plan_keys in decision_keys for k in goal_keys + plan_keys}
+        goal_prompts, plan_prompts = self._batch_prompts(used)
+        key_lists = [goal_keys + plan_keys for goal_keys, plan_keys in decision_keys]
+        shared = all(ks == key_lists[0] for ks in key_lists)
+
+        questions = "\n".join(f"{k} (about the goal): {q}" for k, q in goal_prompts.items())
+        questions += "\n" + "\n".join(f"{k} (about the plan): {q}" for k, q in plan_prompts.items())
+        # 各决策需要的谓词相同时沿用统一的键说明，否则在每条决策后列出其谓词
+        items = "\n".join(
+            f"Decision {i}:\nGoal: {d['goal']}\nPlan: {d['plan']}" + ("" if shared else f"\nKeys: {', '.join(ks)}")
+            for i, (d, ks) in enumerate(zip(decisions, key_lists), start=1)
+        )
+        # 说明和谓词问题对所有批次都相同，作为 system 前缀；背景、决策和数量放在最后
+        system = (
+            "You are a helpful assistant for evaluating text quality.\n"
+            f"Answer the questions below for each decision with true or false.\n{questions}"
+        )
+        full_prompt = (
+            f"background:{background_digest}\n\n"
+            f"{items}\n\n"
+            f"Respond with only a JSON array of {len(decisions)} objects in decision order, "
+            + (f"each with the keys {', '.join(key_lists[0])} and boolean values." if shared else
+               "each with exactly the keys listed under its decision and boolean values.")
+        )
+
+        try:
+            answers = _parse_json_array(
+                get_response_from_llm(full_prompt, cache=True, call_site="predicate-batch", system=system)) or []
+        except LLMError as e:
+            # 批量请求失败时全部回退为单谓词请求
+            print(f"批量谓词请求失败: {e}")
+            answers = []
+        results = []
+        missing = []
+        for i, (decision, task_keys) in enumerate(zip(decisions, decision_keys)):
+            answer = answers[i] if i < len(answers) and isinstance(answers[i], dict) else {}
+            atoms = ({}, {})
+            for task_index, task_prompts in enumerate((goal_prompts, plan_prompts)):
+                text = decision["goal"] if task_index == 0 else decision["plan"]
+                for key in task_keys[task_index]:
+                    prompt = task_prompts[key]
+                    value = _normalize_answer(answer.get(key))
+                    if value is None:
+                        missing.append((i, task_index, key, self._predicate_prompt(text, prompt)))
+                    else:
+                        atoms[task_index][key] = value
+            results.append(atoms)
+
+        # 只对解析失败的谓词回退到单谓词请求，并发提交
+        if missing:
+            print(f"批量谓词解析缺失 {len(missing)} 项，回退为单谓词请求")
+            responses = gather_responses([m[3] for m in missing], cache=True, call_site="predicate-fallback",
+                                         system=self._predicate_system(background_digest), return_exceptions=True)
+            for (i, task_index, key, _), response in zip(missing, responses):
+                if isinstance(response, LLMError):
+                    print(f"Error during API call for {key}: {response}")
+                    results[i][task_index][key] = "Error"
+                else:
+                    results[i][task_index][key] = response.strip()
+
+        log_pairs([(decision["goal"] if task_index == 0 else decision["plan"], key, answer)
+                   for decision, atoms in zip(decisions, results)
+                   for task_index in (0, 1) for key, answer in atoms[task_index].items()])
+        return results
     
     
     
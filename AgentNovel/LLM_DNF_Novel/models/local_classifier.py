@@ -0,0 +1,327 @@
+import argparse
+import json
+import os
+import random
+import threading
+import zlib
+
+import numpy as np
+
+# LLM 给出的 (文本, 谓词, 回答) 记录，作为本地分类器的训练数据
+PREDICATE_LOG_PATH = os.environ.get("PREDICATE_LOG_PATH", os.path.join(".llm_cache", "predicate_pairs.jsonl"))
+# 训练好的本地谓词分类器；文件不存在时所有谓词都交给 LLM 判断
+PREDICATE_MODEL_PATH = os.environ.get("PREDICATE_MODEL_PATH", os.path.join(".llm_cache", "predicate_model.npz"))
+
+# 字符 n-gram 的长度范围与哈希后的特征维度
+NGRAM_RANGE = (1, 3)
+NUM_FEATURES = 1 << 14
+# 训练参数：迭代轮数、学习率、L2 正则系数
+EPOCHS = 300
+LEARNING_RATE = 0.5
+L2 = 1e-4
+# 每个谓词至少需要的样本数（且两种回答都要出现），不足时该谓词不启用本地判断
+MIN_EXAMPLES = 50
+# 留出集比例；置信度阈值在留出集上校准，使阈值以上的预测与 LLM 的一致率不低于 TARGET_ACCURACY
+HOLDOUT_RATIO = 0.2
+TARGET_ACCURACY = 0.95
+# 校准后没有满足要求的阈值时使用的默认阈值（不会低于该值）
+CONFIDENCE_THRESHOLD = 0.9
+
+
+def featurize(texts, num_features: int = NUM_FEATURES, ngram_range=NGRAM_RANGE):
+    """
+    将文本转换为哈希后的字符 n-gram 特征（log(1 + 次数)，按行 L2 归一化）。
+
+    :param texts: 文本列表
+    :return: CSR 形式的稀疏矩阵 (indices, values, indptr)，第 i 行为 indices[indptr[i]:indptr[i + 1]]
+    """
+    indices, values, indptr = [], [], [0]
+    low, high = ngram_range
+    for text in texts:
+        counts = {}
+        for n in range(low, high + 1):
+            for start in range(len(text) - n + 1):
+                # crc32 在不同进程间稳定，保证训练和预测的特征一致
+                index = zlib.crc32(text[start:start + n].encode("utf-8")) % num_features
+                counts[index] = counts.get(index, 0) + 1
+        row = np.log1p(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        norm = float(np.sqrt((row * row).sum()))
+        indices.extend(counts)
+        values.extend((row / norm).tolist() if norm else row.tolist())
+        indptr.append(len(indices))
+    return (np.asarray(indices, dtype=np.int64), np.asarray(values, dtype=np.float32),
+            np.asarray(indptr, dtype=np.int64))
+
+
+def _dot(features, weights: np.ndarray) -> np.ndarray:
+    # 稀疏矩阵乘向量：逐行求 x · w
+    indices, values, indptr = features
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return np.bincount(rows, weights=values * weights[indices], minlength=len(indptr) - 1)
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class PredicateClassifier:
+    """
+    单个谓词的逻辑回归分类器，输入为 featurize 得到的稀疏特征。
+    """
+    def __init__(self, weights: np.ndarray = None, bias: float = 0.0, threshold: float = CONFIDENCE_THRESHOLD):
+        self.weights = np.zeros(NUM_FEATURES, dtype=np.float32) if weights is None else weights
+        self.bias = bias
+        # 置信度 max(p, 1 - p) 达到该值时采用本地判断，否则交给 LLM
+        self.threshold = threshold
+
+    def fit(self, features, labels: np.ndarray, epochs: int = EPOCHS, learning_rate: float = LEARNING_RATE,
+            l2: float = L2) -> "PredicateClassifier":
+        """
+        全批量梯度下降训练（Adam），标签为 0 / 1。
+        """
+        indices, values, indptr = features
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        n = len(labels)
+        weights = np.zeros(len(self.weights), dtype=np.float64)
+        bias = 0.0
+        m, v = np.zeros_like(weights), np.zeros_like(weights)
+        mb = vb = 0.0
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+        for step in range(1, epochs + 1):
+            errors = _sigmoid(_dot(features, weights) + bias) - labels
+            grad = np.bincount(indices, weights=values * errors[rows], minlength=len(weights)) / n + l2 * weights
+            grad_b = errors.mean()
+            m = beta1 * m + (1 - beta1) * grad
+            v = beta2 * v + (1 - beta2) * grad * grad
+            mb = beta1 * mb + (1 - beta1) * grad_b
+            vb = beta2 * vb + (1 - beta2) * grad_b * grad_b
+            scale = learning_rate * np.sqrt(1 - beta2 ** step) / (1 - beta1 ** step)
+            weights -= scale * m / (np.sqrt(v) + eps)
+            bias -= scale * mb / (np.sqrt(vb) + eps)
+        self.weights = weights.astype(np.float32)
+        self.bias = float(bias)
+        return self
+
+    def predict_proba(self, features) -> np.ndarray:
+        """
+        返回每行为 true 的概率。
+        """
+        return _sigmoid(_dot(features, self.weights) + self.bias)
+
+    def calibrate(self, probs: np.ndarray, labels: np.ndarray, target: float = TARGET_ACCURACY) -> float:
+        """
+        在留出集上选择最低的置信度阈值，使阈值以上的预测准确率不低于 target。
+        没有满足要求的阈值时返回 1.0（即不启用本地判断）。
+        """
+        confidence = np.maximum(probs, 1 - probs)
+        correct = (probs >= 0.5) == (labels == 1)
+        order = np.argsort(-confidence)
+        # 按置信度从高到低累计准确率，取满足要求的最低阈值
+        accuracy = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+        ok = np.nonzero(accuracy >= target)[0]
+        if len(ok) == 0:
+            return 1.0
+        return max(CONFIDENCE_THRESHOLD, float(confidence[order][ok[-1]]))
+
+
+class LocalPredicateModel:
+    """
+    每个谓词一个 PredicateClassifier；只对置信度达到阈值的谓词给出判断，其余返回 None 交给 LLM。
+    线程安全（预测只读模型参数，统计加锁）。
+    """
+    def __init__(self, classifiers: dict = None):
+        self.classifiers: dict[str, PredicateClassifier] = classifiers or {}
+        self.local = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+
+    def predict(self, items):
+        """
+        批量判断。
+
+        :param items: [(文本, 谓词名)] 列表
+        :return: 与 items 对应的 "true" / "false"，置信度不足或没有该谓词的分类器时为 None
+        """
+        answers = [None] * len(items)
+        by_key = {}
+        for i, (_, key) in enumerate(items):
+            if key in self.classifiers:
+                by_key.setdefault(key, []).append(i)
+        for key, positions in by_key.items():
+            classifier = self.classifiers[key]
+            probs = classifier.predict_proba(featurize([items[i][0] for i in positions]))
+            for i, p in zip(positions, probs):
+                if max(p, 1 - p) >= classifier.threshold:
+                    answers[i] = "true" if p >= 0.5 else "false"
+        local = sum(1 for answer in answers if answer is not None)
+        with self._lock:
+            self.local += local
+            self.deferred += len(items) - local
+        return answers
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"local": self.local, "deferred": self.deferred}
+
+    def save(self, path: str = PREDICATE_MODEL_PATH) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        arrays = {}
+        for key, classifier in self.classifiers.items():
+            arrays[f"{key}.weights"] = classifier.weights
+            arrays[f"{key}.params"] = np.array([classifier.bias, classifier.threshold], dtype=np.float64)
+        arrays["meta"] = np.array(json.dumps({"num_features": NUM_FEATURES, "ngram_range": list(NGRAM_RANGE)}))
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str = PREDICATE_MODEL_PATH) -> "LocalPredicateModel":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["num_features"] != NUM_FEATURES or tuple(meta["ngram_range"]) != NGRAM_RANGE:
+                raise ValueError(f"本地谓词模型的特征配置与当前代码不一致，请重新训练: {path}")
+            classifiers = {}
+            for name in data.files:
+                if name.endswith(".weights"):
+                    key = name[:-len(".weights")]
+                    bias, threshold = data[f"{key}.params"]
+                    classifiers[key] = PredicateClassifier(data[name], float(bias), float(threshold))
+        return cls(classifiers)
+
+
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def get_local_model():
+    """
+    返回进程内共享的本地谓词模型；模型文件不存在或无法加载时返回 None。
+    """
+    global _model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                path = os.environ.get("PREDICATE_MODEL_PATH", PREDICATE_MODEL_PATH)
+                if path and os.path.exists(path):
+                    try:
+                        _model = LocalPredicateModel.load(path)
+                        print(f"[本地谓词] 已加载 {path}：{sorted(_model.classifiers)}")
+                    except (OSError, ValueError, KeyError) as e:
+                        print(f"[本地谓词] 加载 {path} 失败，全部谓词交给 LLM: {e}")
+                _model_loaded = True
+    return _model
+
+
+def get_local_stats() -> dict:
+    """
+    本进程中本地判断与交给 LLM 的谓词数。
+    """
+    return _model.stats() if _model is not None else {"local": 0, "deferred": 0}
+
+
+# ---------- 训练数据记录 ----------
+
+_log_lock = threading.Lock()
+
+
+def log_pairs(pairs, path: str = None) -> None:
+    """
+    追加 LLM 的谓词判断，作为训练数据。写入失败只打印警告。
+
+    :param pairs: [(文本, 谓词名, 回答)]，只记录回答为 "true" / "false" 的项
+    """
+    path = PREDICATE_LOG_PATH if path is None else path
+    lines = [json.dumps({"text": text, "key": key, "answer": answer}, ensure_ascii=False)
+             for text, key, answer in pairs if answer in ("true", "false")]
+    if not path or not lines:
+        return
+    try:
+        with _log_lock:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+    except OSError as e:
+        print(f"[本地谓词] 写入训练数据失败: {e}")
+
+
+def load_pairs(path: str = PREDICATE_LOG_PATH) -> dict:
+    """
+    读取训练数据，同一 (谓词, 文本) 只保留最后一次的回答。
+    :return: {谓词名: [(文本, 0/1)]}
+    """
+    latest = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 跳过写入中断的行
+            latest[(record["key"], record["text"])] = 1 if record["answer"] == "true" else 0
+    data = {}
+    for (key, text), label in latest.items():
+        data.setdefault(key, []).append((text, label))
+    return data
+
+
+# ---------- 训练 ----------
+
+def train(data: dict, seed: int = 0, target: float = TARGET_ACCURACY):
+    """
+    为每个谓词训练分类器：留出 HOLDOUT_RATIO 的样本评估并校准阈值，再用全部样本重新训练。
+
+    :param data: load_pairs 的结果
+    :return: (LocalPredicateModel, 每个谓词的评估报告列表)
+    """
+    from LLM_DNF_Novel.utils.evaluation import evaluate
+
+    classifiers, report = {}, []
+    for key in sorted(data, key=lambda k: (len(k), k)):
+        examples = list(data[key])
+        labels = np.array([label for _, label in examples])
+        row = {"key": key, "examples": len(examples), "true_rate": round(float(labels.mean()), 3),
+               "accuracy": "", "macro_f1": "", "threshold": "", "coverage": "", "status": ""}
+        if len(examples) < MIN_EXAMPLES or labels.min() == labels.max():
+            report.append({**row, "status": "样本不足"})
+            continue
+        random.Random(seed).shuffle(examples)
+        split = max(1, int(len(examples) * HOLDOUT_RATIO))
+        test, training = examples[:split], examples[split:]
+        test_labels = np.array([label for _, label in test])
+        classifier = PredicateClassifier().fit(featurize([t for t, _ in training]),
+                                               np.array([label for _, label in training]))
+        probs = classifier.predict_proba(featurize([t for t, _ in test]))
+        acc, macro_f1 = evaluate((probs >= 0.5).astype(int), test_labels)
+        threshold = classifier.calibrate(probs, test_labels, target)
+        covered = np.maximum(probs, 1 - probs) >= threshold
+        row.update(accuracy=round(float(acc), 3), macro_f1=round(float(macro_f1), 3),
+                   threshold=round(threshold, 3), coverage=round(float(covered.mean()), 3))
+        if threshold >= 1.0:
+            report.append({**row, "status": "未达到目标准确率"})
+            continue
+        final = PredicateClassifier(threshold=threshold).fit(
+            featurize([t for t, _ in examples]), np.array([label for _, label in examples]))
+        classifiers[key] = final
+        report.append({**row, "status": "启用"})
+    return LocalPredicateModel(classifiers), report
+
+
+if __name__ == "__main__":
+    from llm_trace import format_table
+
+    parser = argparse.ArgumentParser(description="用记录的 LLM 谓词判断训练本地谓词分类器")
+    parser.add_argument("--pairs", default=PREDICATE_LOG_PATH, help="训练数据（JSONL）")
+    parser.add_argument("--out", default=PREDICATE_MODEL_PATH, help="模型输出路径")
+    parser.add_argument("--target", type=float, default=TARGET_ACCURACY, help="阈值以上预测的目标准确率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model, report = train(load_pairs(args.pairs), args.seed, args.target)
+    print(format_table(report))
+    if model.classifiers:
+        model.save(args.out)
+        print(f"已保存 {len(model.classifiers)} 个谓词的分类器: {args.out}")
+    else:
+        print("没有谓词达到启用条件，未保存模型")
@@ -1,29 +1,86 @@
-from models.dnf_model import DNFModel
-import torch
+"""
+用记录的谓词向量和结果标签训练 DNFModel，导出评分规则并按重要性剪枝谓词。
 
-def save_predefined_model():
+数据来自评分时自动记录的谓词向量和决策文本（LLM_DNF_Novel/utils/dataset.py，默认 .llm_cache/dnf_dataset.jsonl）。
+流水线不会自动产生结果标签：先导出待标注样本，人工标注后导入（也可在代码中调用 dataset.record_outcome）：
+    python -m LLM_DNF_Novel.utils.dataset export unlabeled.jsonl
+    （在每行补上 "label": 1 或 0）
+    python -m LLM_DNF_Novel.utils.dataset import unlabeled.jsonl
+
+导出的规则文件（默认 .llm_cache/dnf_rules.json）存在时，评分改用其中的规则，规则中未出现的谓词不再向 LLM 询问；
+按 dataset.EXPLORE_RATE 抽取的候选决策仍询问全部谓词，这些完整样本用于重新训练，剪枝掉的谓词也可以重新进入规则。
+
+数据按 训练 / 验证 / 测试 划分：置换重要性和剪枝决定使用验证集，报告的指标来自测试集。
+
+用法（在 AgentNovel 目录下）：
+    python -m LLM_DNF_Novel.train_model --epochs 200 --conjuncts 8
+    python -m LLM_DNF_Novel.train_model --data dnf_dataset.jsonl --prune-threshold 0.01 --dry-run
+"""
+import argparse
+import os
+
+from LLM_DNF_Novel.models import dnf_trainer
+from LLM_DNF_Novel.mark import DNF_RULES_PATH
+from LLM_DNF_Novel.utils.dataset import DNF_DATA_PATH, load_dataset, split_dataset
+
+# 训练得到的 DNFModel 参数（可由 mark.load_trained_model 加载）
+MODEL_PATH = os.path.join(".llm_cache", "dnf_model.pt")
+
+
+def train(data_path: str = DNF_DATA_PATH, rules_path: str = DNF_RULES_PATH, model_path: str = MODEL_PATH,
+          num_conjuncts: int = dnf_trainer.NUM_CONJUNCTS, epochs: int = dnf_trainer.EPOCHS,
+          batch_size: int = dnf_trainer.BATCH_SIZE, learning_rate: float = dnf_trainer.LEARNING_RATE,
+          prune_threshold: float = dnf_trainer.PRUNE_THRESHOLD, test_ratio: float = 0.2, val_ratio: float = 0.2,
+          seed: int = 0, dry_run: bool = False) -> dict:
     """
-    使用预设参数初始化模型并保存。
+    训练、评估、剪枝并保存模型与规则。
+    :return: 结果字典（规则、谓词重要性、评估指标）。
     """
-    # 配置参数
-    num_features = 10  # 特征数量
-    num_conjuncts = 20  # 合取项数量
-    num_classes = 2  # 类别数量
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-    # 初始化模型
-    model = DNFModel(num_features=num_features, num_conjuncts=num_conjuncts, num_classes=num_classes)
-    model.to(device)
-
-    # 设置预设参数（示例：将所有权重初始化为固定值）
-    with torch.no_grad():
-        for param in model.parameters():
-            param.fill_(0.5)  # 将所有参数设置为 0.5（根据需要调整）
-
-    # 保存模型
-    torch.save(model.state_dict(), "dnf_model_predefined.pt")
-    print("Predefined model saved to dnf_model_predefined.pt")
-    
-    
+    import torch
+
+    features, labels, predicates = load_dataset(data_path)
+    train_x, train_y, test_x, test_y = split_dataset(features, labels, test_ratio, seed)
+    # 验证集从训练部分中划出，占全部样本的 val_ratio
+    train_x, train_y, val_x, val_y = split_dataset(train_x, train_y, val_ratio / (1 - test_ratio), seed)
+    print(f"样本 {len(labels)} 条（训练 {len(train_y)}，验证 {len(val_y)}，测试 {len(test_y)}），"
+          f"正例比例 {labels.mean():.3f}")
+
+    model, result = dnf_trainer.fit_and_extract(
+        train_x, train_y, val_x, val_y, test_x, test_y, predicates, num_conjuncts=num_conjuncts, epochs=epochs,
+        batch_size=batch_size, learning_rate=learning_rate, prune_threshold=prune_threshold, seed=seed)
+
+    print("谓词重要性（验证集上打乱后 macro-F1 的下降）：")
+    for name, value in sorted(result["importance"].items(), key=lambda item: -item[1]):
+        print(f"  {name:>4}: {value:.4f}")
+    print(f"导出的规则：\n{dnf_trainer.format_rules(result)}")
+    print(f"评估指标（model / rules 为测试集）：{result['metrics']}")
+    print(f"保留谓词 {result['active_predicates']}，剪枝 {result['pruned_predicates']}")
+    if not result["disjunctions"].get(dnf_trainer.SCORE_CLASS):
+        print("警告：高质量类别没有任何规则，所有决策的评分都将为 0")
+
+    if not dry_run:
+        os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+        torch.save(model.state_dict(), model_path)
+        dnf_trainer.save_rules(result, rules_path)
+        print(f"模型已保存到 {model_path}，规则已保存到 {rules_path}")
+    return result
+
+
 if __name__ == "__main__":
-    save_predefined_model()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="训练 DNF 评分模型并导出规则")
+    parser.add_argument("--data", default=DNF_DATA_PATH, help="评分数据集（JSONL）")
+    parser.add_argument("--rules", default=DNF_RULES_PATH, help="导出的规则文件")
+    parser.add_argument("--model", default=MODEL_PATH, help="模型参数文件")
+    parser.add_argument("--conjuncts", type=int, default=dnf_trainer.NUM_CONJUNCTS, help="合取项数量")
+    parser.add_argument("--epochs", type=int, default=dnf_trainer.EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=dnf_trainer.BATCH_SIZE)
+    parser.add_argument("--lr", type=float, default=dnf_trainer.LEARNING_RATE)
+    parser.add_argument("--prune-threshold", type=float, default=dnf_trainer.PRUNE_THRESHOLD,
+                        help="重要性不高于该值的谓词被剪枝")
+    parser.add_argument("--test-ratio", type=float, default=0.2)
+    parser.add_argument("--val-ratio", type=float, default=0.2, help="验证集比例（用于重要性和剪枝）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dry-run", action="store_true", help="只训练和评估，不保存")
+    args = parser.parse_args()
+    train(args.data, args.rules, args.model, args.conjuncts, args.epochs, args.batch_size, args.lr,
+          args.prune_threshold, args.test_ratio, args.val_ratio, args.seed, args.dry_run)
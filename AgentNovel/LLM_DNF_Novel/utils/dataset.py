@@ -0,0 +1,184 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+# 评分数据集（JSONL）。两类记录按 id 合并：
+#   {"id": ..., "features": [0/1/null, ...], "predicates": [...], "goal": ..., "plan": ...}
+#       评分时记录的谓词向量（null 为未询问）和决策文本（供人工标注）
+#   {"id": ..., "label": 0/1}   之后补充的结果（1 为高质量决策），由 record_outcome 或本模块的 import 命令写入
+# 同一 id 的后出现的字段覆盖先出现的，没有 label 的样本不参与训练
+DNF_DATA_PATH = os.environ.get("DNF_DATA_PATH", os.path.join(".llm_cache", "dnf_dataset.jsonl"))
+# 使用训练导出的规则后，按该比例抽取候选决策询问全部谓词，使新样本仍有完整的谓词向量可供重新训练
+# （剪枝掉的谓词也有机会重新进入规则）；按决策哈希抽样，同一决策的结果稳定
+EXPLORE_RATE = float(os.environ.get("DNF_EXPLORE_RATE", "0.1"))
+
+_lock = threading.Lock()
+
+
+def decision_id(decision: dict) -> str:
+    """
+    决策的稳定标识（goal 与 plan 的哈希），用于把结果关联到评分时记录的谓词向量。
+    """
+    text = json.dumps([decision.get("goal", ""), decision.get("plan", "")], ensure_ascii=False)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def should_explore(decision: dict, rate: float = None) -> bool:
+    """
+    是否对该决策询问全部谓词（见 EXPLORE_RATE）。
+    """
+    rate = EXPLORE_RATE if rate is None else rate
+    return int(decision_id(decision), 16) % 10000 < rate * 10000
+
+
+def _append(records, path: str) -> None:
+    if not path or not records:
+        return
+    try:
+        with _lock:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+    except OSError as e:
+        print(f"[评分数据] 写入失败: {e}")
+
+
+def log_vectors(decisions, vectors, predicates, path: str = None) -> None:
+    """
+    记录候选决策的谓词向量。写入失败只打印警告。
+
+    :param decisions: 决策列表
+    :param vectors: 与 decisions 对应的特征列表，取值 0 / 1 / None（未询问）
+    :param predicates: 特征对应的谓词名
+    """
+    path = DNF_DATA_PATH if path is None else path
+    _append([{"id": decision_id(d), "features": list(v), "predicates": list(predicates),
+              "goal": d.get("goal", ""), "plan": d.get("plan", "")}
+             for d, v in zip(decisions, vectors)], path)
+
+
+def record_outcome(decision, label: int, path: str = None) -> None:
+    """
+    记录决策的结果标签（1 为高质量，0 为低质量），例如人工审阅或后续检查的结论。
+
+    :param decision: 决策字典或 decision_id 的结果
+    """
+    path = DNF_DATA_PATH if path is None else path
+    key = decision if isinstance(decision, str) else decision_id(decision)
+    _append([{"id": key, "label": int(label)}], path)
+
+
+def _merge_records(path: str) -> dict:
+    merged = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 跳过写入中断的行
+            merged.setdefault(record.get("id"), {}).update(record)
+    return merged
+
+
+def load_dataset(path: str = DNF_DATA_PATH):
+    """
+    读取已有结果标签的样本。只使用谓词完整的样本（使用训练规则后，完整样本来自 EXPLORE_RATE 抽样）。
+
+    :return: (特征矩阵 [N, F] float32, 标签 [N] int64, 谓词名列表)
+    :raises ValueError: 没有带标签的样本，或样本的谓词顺序不一致
+    """
+    rows = [r for r in _merge_records(path).values() if "features" in r and r.get("label") is not None]
+    # 有谓词未询问或请求失败的样本无法作为完整输入，跳过
+    complete = [r for r in rows if None not in r["features"]]
+    if len(complete) < len(rows):
+        print(f"[评分数据] 跳过 {len(rows) - len(complete)} 条谓词不完整的样本")
+    rows = complete
+    if not rows:
+        raise ValueError(f"评分数据集中没有带结果标签的样本: {path}")
+    predicates = rows[0].get("predicates") or [f"p{i + 1}" for i in range(len(rows[0]["features"]))]
+    for r in rows:
+        if r.get("predicates", predicates) != predicates:
+            raise ValueError(f"样本 {r['id']} 的谓词顺序与其他样本不一致: {r.get('predicates')}")
+    features = np.asarray([r["features"] for r in rows], dtype=np.float32)
+    labels = np.asarray([int(r["label"]) for r in rows], dtype=np.int64)
+    return features, labels, predicates
+
+
+def export_unlabeled(out_path: str, path: str = DNF_DATA_PATH, complete_only: bool = True) -> int:
+    """
+    导出尚无标签的样本（id、goal、plan）供人工标注，标注后在每行补上 "label": 0/1 再用 import_labels 导入。
+
+    :param complete_only: 只导出谓词完整、标注后可直接用于训练的样本
+    :return: 导出的样本数
+    """
+    rows = [r for r in _merge_records(path).values()
+            if "features" in r and r.get("label") is None and (not complete_only or None not in r["features"])]
+    with open(out_path, "w", encoding="utf-8") as f:
+        for r in rows:
+            f.write(json.dumps({"id": r["id"], "goal": r.get("goal", ""), "plan": r.get("plan", "")},
+                               ensure_ascii=False) + "\n")
+    return len(rows)
+
+
+def import_labels(labels_path: str, path: str = DNF_DATA_PATH) -> int:
+    """
+    导入标注文件（JSONL，每行包含 id 和 label），写入评分数据集。
+
+    :return: 导入的标签数
+    """
+    records = []
+    with open(labels_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("label") not in (0, 1):
+                raise ValueError(f"标签必须为 0 或 1: {line.strip()}")
+            records.append({"id": record["id"], "label": int(record["label"])})
+    _append(records, path)
+    return len(records)
+
+
+def split_dataset(features: np.ndarray, labels: np.ndarray, test_ratio: float = 0.2, seed: int = 0):
+    """
+    随机划分训练集与测试集（划分验证集时对训练部分再调用一次）。
+
+    :return: (训练特征, 训练标签, 测试特征, 测试标签)
+    """
+    order = np.random.default_rng(seed).permutation(len(labels))
+    split = max(1, int(len(labels) * test_ratio))
+    test, train = order[:split], order[split:]
+    return features[train], labels[train], features[test], labels[test]
+
+
+def make_loader(features: np.ndarray, labels: np.ndarray, batch_size: int = 64, shuffle: bool = True,
+                seed: int = 0):
+    """
+    构建 torch DataLoader，每批为 (特征 float32 [B, F], 标签 int64 [B])。
+    """
+    import torch
+    from torch.utils.data import DataLoader, TensorDataset
+
+    generator = torch.Generator().manual_seed(seed)
+    dataset = TensorDataset(torch.as_tensor(features, dtype=torch.float32), torch.as_tensor(labels))
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, generator=generator)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出待标注的评分样本或导入结果标签")
+    parser.add_argument("command", choices=["export", "import"],
+                        help="export：导出无标签样本到 FILE；import：从 FILE 导入 {id, label} 标签")
+    parser.add_argument("file", help="导出或导入的 JSONL 文件")
+    parser.add_argument("--data", default=DNF_DATA_PATH, help="评分数据集（JSONL）")
+    parser.add_argument("--all", action="store_true", help="导出时包含谓词不完整的样本")
+    args = parser.parse_args()
+    if args.command == "export":
+        print(f"导出 {export_unlabeled(args.file, args.data, not args.all)} 条待标注样本到 {args.file}")
+    else:
+        print(f"导入 {import_labels(args.file, args.data)} 条标签到 {args.data}")
@@ -1,6 +1,6 @@
-from sklearn.metrics import accuracy_score, f1_score
-
 def evaluate(predictions, labels):
+    # sklearn 导入较慢，首次评估时才加载
+    from sklearn.metrics import accuracy_score, f1_score
     acc = accuracy_score(labels, predictions)
     macro_f1 = f1_score(labels, predictions, average='macro')
     return acc, macro_f1
\ No newline at end of file
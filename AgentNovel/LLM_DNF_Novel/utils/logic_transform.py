@@ -1,5 +1,3 @@
-import torch
-
 def transform_logic_atoms_to_features(logic_atoms, predicate_set):
     """
     将逻辑原子转换为 DNF 模型的输入特征。
@@ -7,8 +5,15 @@ def transform_logic_atoms_to_features(logic_atoms, predicate_set):
     :param predicate_set: 逻辑谓词集合
     :return: 特征向量
     """
-    features = []
-    for predicate in predicate_set:
-        features.append(1 if logic_atoms.get(predicate, "false") == "true" else 0)
-    return torch.tensor(features, dtype=torch.float32)
+    import torch
+    return torch.tensor(logic_atoms_to_vector(logic_atoms, predicate_set), dtype=torch.float32)
+
+def logic_atoms_to_vector(logic_atoms, predicate_set):
+    """
+    将逻辑原子转换为 0/1 列表（不依赖 torch）。
+    :param logic_atoms: 逻辑原子字典
+    :param predicate_set: 逻辑谓词集合
+    :return: 特征列表
+    """
+    return [1 if logic_atoms.get(predicate, "false") == "true" else 0 for predicate in predicate_set]
 
@@ -1,6 +1,17 @@
 from llm import get_response_from_llm
+import context_builder
 import os
 import json
+import weakref
+from agents.tools.memory_index import MemoryIndex
+
+# 每次提示中最多引用的记忆条数与 token 上限
+MEMORY_TOP_K = 6
+MEMORY_MAX_TOKENS = 400
+
+# 角色 -> (已索引的记忆条数, 索引)；不放在角色属性里，避免进入 agent.__dict__ 背景信息
+_memory_indexes = weakref.WeakKeyDictionary()
+
 class CharacterAgent:
     def __init__(self, name, personality, role, profession, health_status):
         self.name = name
@@ -11,7 +22,45 @@ class CharacterAgent:
         self.memory = []
         self.goal = []
         self.environment = None
+
+    def relevant_memories(self, query, k=MEMORY_TOP_K, max_tokens=MEMORY_MAX_TOKENS):
+        """
+        从角色记忆中检索与 query 最相关的片段（同时保留最新一条），总长度受 max_tokens 限制。
+        """
+        indexed, index = _memory_indexes.get(self, (0, None))
+        # memory 只会被追加；若被整体替换或缩短则重建索引
+        if index is None or indexed > len(self.memory) or index.memories != self.memory[:indexed]:
+            index, indexed = MemoryIndex(), 0
+        for memory in self.memory[indexed:]:
+            index.add(memory)
+        _memory_indexes[self] = (len(self.memory), index)
+        return index.search(query, k, max_tokens)
+
+    @staticmethod
+    def _memory_query(context, *extra):
+        """
+        由当前环境（及目标、上一轮决策等）拼出记忆检索的查询文本。
+        """
+        parts = [str(context.get(key, "")) for key in ("location", "event", "environment_goal", "long_term_goal")]
+        parts.extend(str(item) for item in extra)
+        return " ".join(parts)
         
+    @staticmethod
+    def _environment_lines(environment):
+        """
+        计划提示中的环境信息段。
+        """
+        return f"""
+        - 场景编号：{environment.get('scene_id', '未知')}
+        - 地点：{environment.get('location', '未知')}
+        - 天气：{environment.get('weather', '未知')}
+        - 氛围：{environment.get('atmosphere', '未知')}
+        - 当前事件：{environment.get('event', '未知')}
+        - 长期目标：{environment.get('long_term_goal', '未知')}
+        - 当前的环境目标：{environment.get('environment_goal', '未知')}"""
+
+    # 提示按"固定说明 → 环境 → 角色当前状态与记忆 → 上一轮决策"排列，
+    # 角色设定放在 system 前缀中，同一角色的多轮调用共享尽可能长的前缀
     @staticmethod
     def generate_goal_with_cot(agent, context):
         """
@@ -20,11 +69,12 @@ class CharacterAgent:
         # 提取环境信息
         environment = context.get("environment", {})
         previous_decision = context.get("previous_decision", "无")
+        memories = agent.relevant_memories(agent._memory_query(environment, previous_decision))
 
         # 构建 Prompt
         prompt = f"""
-        你是小说中的角色「{agent.name}」，性格：{agent.personality}，职业：{agent.profession}，扮演的角色：{agent.role}，健康状态：{agent.health_status}。
-        你记得：{''.join(agent.memory[-2:] if len(agent.memory) >= 2 else agent.memory)}。
+        请结合你的设定、记忆与当前环境，使用 Chain-of-Thought 的方式生成你**此刻最合理的目标**。
+        目标应与当前环境目标和长期目标相关联，并推动情节发展。请仅返回最终目标句子。
 
         当前环境信息如下：
         - 场景编号：{environment.get('scene_id', '未知')}
@@ -38,32 +88,21 @@ class CharacterAgent:
         - 最近事件：{', '.join(environment.get('recent_events', []))}
         - 涉及的角色：{', '.join(environment.get('involved_characters', []))}
 
-        上一轮的合并决策为：{previous_decision}
+        你扮演的角色：{agent.role}，健康状态：{agent.health_status}。
+        你记得：{''.join(memories)}。
 
-        请结合你的设定、记忆与当前环境，使用 Chain-of-Thought 的方式生成你**此刻最合理的目标**。
-        目标应与当前环境目标和长期目标相关联，并推动情节发展。请仅返回最终目标句子。
+        上一轮的合并决策为：{previous_decision}
         """
         # 调用 LLM 生成目标
-        return get_response_from_llm(prompt)
+        return get_response_from_llm(prompt, call_site="goal", system=context_builder.character_prefix(agent))
     
     @staticmethod
     def plan_with_cot(agent, context):
         """
         使用角色背景与环境上下文，通过 CoT 推理生成下一步行动计划
         """
+        memories = agent.relevant_memories(agent._memory_query(context, agent.goal))
         prompt = f"""
-        你是小说中的角色「{agent.name}」，性格：{agent.personality}，职业：{agent.profession}，扮演的角色：{agent.role}，当前健康状态：{agent.health_status},你的当前目标：{agent.goal},你记得：{agent.memory}。
-        你目前处于一个特定环境中，环境信息如下：
-
-        - 场景编号：{context['scene_id']}
-        - 地点：{context['location']}
-        - 天气：{context['weather']}
-        - 氛围：{context['atmosphere']}
-        - 当前事件：{context['event']}
-        - 长期目标：{context['long_term_goal']}
-        - 当前的环境目标：{context['environment_goal']}
-        你拥有的记忆片段如下：{''.join(agent.memory)}
-
         请你使用「逐步思考（Chain-of-Thought）」的方式，详细描述你将如何达成当前目标。你应该分析环境、考虑自身状态与过往经验，并考虑当前完成环境目标是否有利于情节发展和提高情节张力。规划出你的行动计划。请使用清晰的推理过程+最终计划。
 
         输出格式：
@@ -74,32 +113,21 @@ class CharacterAgent:
         - 第一步：...
         - 第二步：...
         - 第三步：...
+
+        你目前处于一个特定环境中，环境信息如下：{agent._environment_lines(context)}
+
+        你扮演的角色：{agent.role}，当前健康状态：{agent.health_status}。
+        你拥有的记忆片段如下：{''.join(memories)}
+        你的当前目标：{agent.goal}。
         """
-        return get_response_from_llm(prompt)
+        return get_response_from_llm(prompt, call_site="plan", system=context_builder.character_prefix(agent))
     @staticmethod
     def plan_with_cot_next(agent, context, previous_decision):
         """
         使用角色背景、环境上下文和上一轮的合并决策，通过 CoT 推理生成下一步行动计划。
         """
+        memories = agent.relevant_memories(agent._memory_query(context, agent.goal, previous_decision.get('goal', '')))
         prompt = f"""
-        你是小说中的角色「{agent.name}」，性格：{agent.personality}，职业：{agent.profession}，扮演的角色：{agent.role}，当前健康状态：{agent.health_status}。
-        你的当前目标：{agent.goal}。
-        你记得：{''.join(agent.memory)}。
-
-        当前环境信息如下：
-        - 场景编号：{context['scene_id']}
-        - 地点：{context['location']}
-        - 天气：{context['weather']}
-        - 氛围：{context['atmosphere']}
-        - 当前事件：{context['event']}
-        - 长期目标：{context['long_term_goal']}
-        - 当前的环境目标：{context['environment_goal']}
-        你拥有的记忆片段如下：{''.join(agent.memory)}
-
-        上一轮的合并决策如下：
-        - 合并目标：{previous_decision['goal']}
-        - 合并计划：{previous_decision['plan']}
-
         请你使用「逐步思考（Chain-of-Thought）」的方式，详细描述你将如何结合当前目标、环境信息和上一轮的合并决策，规划出你的下一步行动计划。
         你需要分析环境、考虑自身状态与过往经验，并判断如何在当前情境下推进情节发展和提高情节张力,尽可能和前面的决策产生区别。
 
@@ -111,10 +139,20 @@ class CharacterAgent:
         - 第一步：...
         - 第二步：...
         - 第三步：...
+
+        当前环境信息如下：{agent._environment_lines(context)}
+
+        你扮演的角色：{agent.role}，当前健康状态：{agent.health_status}。
+        你拥有的记忆片段如下：{''.join(memories)}
+        你的当前目标：{agent.goal}。
+
+        上一轮的合并决策如下：
+        - 合并目标：{previous_decision['goal']}
+        - 合并计划：{previous_decision['plan']}
         """
-        return get_response_from_llm(prompt)
+        return get_response_from_llm(prompt, call_site="plan", system=context_builder.character_prefix(agent))
 
-    def receive_environment(self, env):
+    def receive_environment(self, env, character_dir=os.path.join("resources", "character")):
         self.environment = env
 
         # 构建上下文信息
@@ -126,13 +164,14 @@ class CharacterAgent:
             "event": env.event,
             "long_term_goal": env.long_term_goal
         }
-        memory_file_path = os.path.join("resources", "character", f"{self.name}.json")
+        memory_file_path = os.path.join(character_dir, f"{self.name}.json")
         if os.path.exists(memory_file_path):
             try:
                 with open(memory_file_path, "r", encoding="utf-8") as memory_file:
                     memory_data = json.load(memory_file)
                     if isinstance(memory_data, list):
-                        self.memory.extend(memory_data)
+                        # 跳过已有的记忆，避免重复读取时记忆无限增长
+                        self.memory.extend(m for m in memory_data if m not in self.memory)
                     else:
                         print(f"警告：文件 {memory_file_path} 的内容格式不正确，期望为列表。")
             except Exception as e:
@@ -1,35 +1,86 @@
 import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
 from agents.roles import character_registry
-from llm import get_response_from_llm
-from pypinyin import lazy_pinyin
-def update_character_info(agents: dict, decision_text: str, character_dir: str):
+from fileio import atomic_write_json
+from llm import LLMError
+from llm_trace import submit_with_context
+from structured_output import StructuredOutputError, request_json
+
+# 并发更新角色时的最大线程数
+CHARACTER_UPDATE_WORKERS = 4
+# 角色数不超过该值时，合并为一次多角色请求
+BATCH_UPDATE_MAX_CAST = 3
+
+# 单个角色更新结果的结构（只校验会被更新的字段，其余字段原样合并）
+CHARACTER_UPDATE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "role": {"type": "string"},
+        "health_status": {"type": "string"},
+        "memory": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["health_status", "role", "memory"],
+}
+# 多角色更新结果：键为角色名
+BATCH_UPDATE_SCHEMA = {"type": "object", "additionalProperties": CHARACTER_UPDATE_SCHEMA}
+
+# character_dir -> (目录下的 JSON 文件名集合, {角色名: 文件路径})
+_file_index_cache: Dict[str, tuple] = {}
+_file_index_lock = threading.Lock()
+
+def build_character_file_index(character_dir: str) -> Dict[str, str]:
     """
-    根据 agents 中的角色信息和新的剧情决策，更新角色状态（health_status、role、memory、goals等），
-    并保存到对应的角色 JSON 文件中。
+    建立角色名到角色 JSON 文件的索引（读取每个文件的 name 字段）。
+    只有目录中的文件集合发生变化时才重新构建。
 
     参数:
-        agents: dict，包含所有角色的字典，键为角色名，值为角色对象。
-        decision_text: str，新剧情决策文本。
         character_dir: str，存储角色 JSON 文件的目录。
+
+    返回:
+        dict，键为角色名，值为文件路径。
     """
-    for name, agent in agents.items():
-        # 加载角色的当前信息
-        pinyin_name = ''.join(lazy_pinyin(name))
-        character_file = os.path.join(character_dir, f"{pinyin_name}.json")
-        if not os.path.exists(character_file):
-            print(f"警告：角色文件 {character_file} 不存在，跳过更新。")
+    filenames = frozenset(f for f in os.listdir(character_dir) if f.endswith(".json"))
+    with _file_index_lock:
+        cached = _file_index_cache.get(character_dir)
+        if cached and cached[0] == filenames:
+            return cached[1]
+
+    index = {}
+    for filename in sorted(filenames):
+        filepath = os.path.join(character_dir, filename)
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                name = json.load(f).get("name")
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"警告：读取角色文件 {filepath} 失败：{e}")
             continue
+        if name:
+            index[name] = filepath
+    with _file_index_lock:
+        _file_index_cache[character_dir] = (filenames, index)
+    return index
 
-        with open(character_file, "r", encoding="utf-8") as file:
-            character_data = json.load(file)
-        # 构造 LLM 提示
-        prompt = f"""
+def _character_file(index: Dict[str, str], name: str, character_dir: str) -> str:
+    """
+    查找角色文件：优先使用索引，索引中没有时按拼音文件名约定推断。
+    """
+    if name in index:
+        return index[name]
+    from pypinyin import lazy_pinyin
+    return os.path.join(character_dir, f"{''.join(lazy_pinyin(name))}.json")
+
+def _build_update_prompt(character_data: dict, decision_text: str) -> str:
+    # 构造 LLM 提示
+    return f"""
         你是一个小说角色管理助手。以下是一个小说角色的原始信息和一段新的剧情发展，请你根据剧情内容，更新角色的状态和记忆。
         需要你完成以下任务：
         1. 更新 health_status（如果剧情中出现角色伤势变化或处理）；
         2. 更新 role（如果角色承担了新任务或职责）；
-        3. 从剧情总结出具体的记忆片段，结合以前的memory后更新memory，角色之前的memory是：{character_data["memory"]}；
+        3. 从剧情总结出具体的记忆片段，结合以前的memory（即原始角色信息中的 memory）后更新memory；
         4. 归并总结memoy，不要让角色的memory那么臃肿
         请返回完整的 JSON 字典，格式和原始信息一致。
 
@@ -40,31 +91,98 @@ def update_character_info(agents: dict, decision_text: str, character_dir: str):
         "{decision_text}"
         """
 
-        try:
-    # 清洗模型输出
-            llm_response = get_response_from_llm(prompt)
-            llm_response_clean = llm_response.strip()
-            if llm_response_clean.startswith("```json"):
-                llm_response_clean = llm_response_clean.strip("```json").strip("```").strip()
+def _build_batch_update_prompt(characters: Dict[str, dict], decision_text: str) -> str:
+    return f"""
+        你是一个小说角色管理助手。以下是多个小说角色的原始信息和一段新的剧情发展，请你根据剧情内容，分别更新每个角色的状态和记忆。
+        对每个角色完成以下任务：
+        1. 更新 health_status（如果剧情中出现角色伤势变化或处理）；
+        2. 更新 role（如果角色承担了新任务或职责）；
+        3. 从剧情总结出该角色具体的记忆片段，结合以前的 memory 后更新 memory；
+        4. 归并总结 memory，不要让角色的 memory 那么臃肿
+        请只返回一个 JSON 字典：键为角色名，值为该角色完整的 JSON 字典，格式和原始信息一致。
+
+        原始角色信息如下（键为角色名）：
+        {json.dumps(characters, ensure_ascii=False, indent=2)}
 
-            updated_data = json.loads(llm_response_clean)
+        新的剧情内容如下：
+        "{decision_text}"
+        """
 
-            # 合并原有数据
-            if os.path.exists(character_file):
-                with open(character_file, "r", encoding="utf-8") as file:
-                    old_data = json.load(file)
-            else:
-                old_data = {}
+def _save_character(character_file: str, old_data: dict, updated_data: dict) -> None:
+    # 合并原有数据并原子写回
+    old_data.update(updated_data)
+    atomic_write_json(character_file, old_data)
+    print(f"角色文件 {character_file} 已成功更新。")
 
-            old_data.update(updated_data)
+def _update_one(name: str, character_file: str, character_data: dict, decision_text: str) -> None:
+    try:
+        updated_data = request_json(_build_update_prompt(character_data, decision_text),
+                                    CHARACTER_UPDATE_SCHEMA, call_site="character-update")
+        _save_character(character_file, dict(character_data), updated_data)
+    except StructuredOutputError as e:
+        print(f"角色 {name} 的信息更新失败: {e}")
+        print(f"原始模型输出为：{e.raw}")
+    except Exception as e:
+        print(f"角色 {name} 的信息更新失败: {e}")
+
+def _update_batch(targets: Dict[str, tuple], decision_text: str) -> Dict[str, tuple]:
+    """
+    一次请求更新多个角色，返回需要回退为单角色请求的角色。
+    """
+    characters = {name: data for name, (_, data) in targets.items()}
+    try:
+        updated = request_json(_build_batch_update_prompt(characters, decision_text), BATCH_UPDATE_SCHEMA,
+                               call_site="character-update-batch")
+    except (StructuredOutputError, LLMError) as e:
+        print(f"多角色更新失败，回退为逐个更新：{e}")
+        return targets
+
+    remaining = {}
+    for name, (character_file, data) in targets.items():
+        if isinstance(updated.get(name), dict):
+            _save_character(character_file, dict(data), updated[name])
+        else:
+            remaining[name] = (character_file, data)
+    return remaining
+
+def update_character_info(agents: dict, decision_text: str, character_dir: str,
+                          max_workers: int = CHARACTER_UPDATE_WORKERS,
+                          batch_max_cast: int = BATCH_UPDATE_MAX_CAST):
+    """
+    根据 agents 中的角色信息和新的剧情决策，更新角色状态（health_status、role、memory、goals等），
+    并保存到对应的角色 JSON 文件中。
 
-            # 保存更新后的角色信息
-            with open(character_file, "w", encoding="utf-8") as file:
-                json.dump(old_data, file, ensure_ascii=False, indent=4)
+    角色数不超过 batch_max_cast 时合并为一次多角色请求，否则（或合并请求解析失败的角色）
+    以至多 max_workers 个线程并发逐个更新。每个文件只读取一次，写回为原子替换。
 
-            print(f"角色文件 {character_file} 已成功更新。")
+    参数:
+        agents: dict，包含所有角色的字典，键为角色名，值为角色对象。
+        decision_text: str，新剧情决策文本。
+        character_dir: str，存储角色 JSON 文件的目录。
+        max_workers: int，并发更新的最大线程数。
+        batch_max_cast: int，使用多角色合并请求的最大角色数。
+    """
+    index = build_character_file_index(character_dir)
+
+    # 加载角色的当前信息（每个文件只读一次）
+    targets = {}
+    for name in agents:
+        character_file = _character_file(index, name, character_dir)
+        if not os.path.exists(character_file):
+            print(f"警告：角色文件 {character_file} 不存在，跳过更新。")
+            continue
+        with open(character_file, "r", encoding="utf-8") as file:
+            targets[name] = (character_file, json.load(file))
 
-        except Exception as e:
-            print(f"角色 {name} 的信息更新失败: {e}")
-            print(f"原始模型输出为：{llm_response}")
+    if 1 < len(targets) <= batch_max_cast:
+        targets = _update_batch(targets, decision_text)
 
+    if not targets:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets)))) as executor:
+        futures = [
+            submit_with_context(executor, _update_one, name, character_file, data, decision_text)
+            for name, (character_file, data) in targets.items()
+        ]
+        for future in futures:
+            future.result()
@@ -0,0 +1,97 @@
+import math
+import re
+from collections import Counter
+from typing import List
+
+from context_builder import count_tokens
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_CJK_RUN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+")
+_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文按字二元组切分（单字片段保留单字），英文和数字按单词切分。
+    """
+    terms = []
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    terms.extend(w.lower() for w in _WORD_RE.findall(text))
+    return terms
+
+
+class MemoryIndex:
+    """
+    角色记忆的本地 BM25 索引（字二元组），无需外部服务。
+    """
+    def __init__(self, memories: List[str] = None):
+        self.memories: List[str] = []
+        self._doc_terms: List[Counter] = []
+        self._doc_freq: Counter = Counter()
+        self._total_len = 0
+        for memory in memories or []:
+            self.add(memory)
+
+    def add(self, memory: str) -> None:
+        terms = Counter(tokenize(memory))
+        self.memories.append(memory)
+        self._doc_terms.append(terms)
+        self._doc_freq.update(terms.keys())
+        self._total_len += sum(terms.values())
+
+    def __len__(self) -> int:
+        return len(self.memories)
+
+    def scores(self, query: str) -> List[float]:
+        """
+        计算 query 与每条记忆的 BM25 分数。
+        """
+        n = len(self.memories)
+        if n == 0:
+            return []
+        avg_len = self._total_len / n or 1.0
+        query_terms = set(tokenize(query))
+        result = []
+        for terms in self._doc_terms:
+            doc_len = sum(terms.values())
+            score = 0.0
+            for term in query_terms:
+                tf = terms.get(term, 0)
+                if not tf:
+                    continue
+                df = self._doc_freq[term]
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avg_len))
+            result.append(score)
+        return result
+
+    def search(self, query: str, k: int, max_tokens: int, include_recent: int = 1) -> List[str]:
+        """
+        返回与 query 最相关的至多 k 条记忆，总长度不超过 max_tokens，按原始时间顺序排列。
+        :param query: 查询文本（当前环境、目标等）
+        :param k: 最多返回的条数
+        :param max_tokens: 返回记忆的 token 上限
+        :param include_recent: 无论相关度如何都优先保留的最新记忆条数
+        """
+        scores = self.scores(query)
+        n = len(scores)
+        recent = list(range(n - 1, max(n - 1 - include_recent, -1), -1))
+        # 相关度相同时优先较新的记忆
+        ranked = sorted(range(n), key=lambda i: (scores[i], i), reverse=True)
+        chosen, used = [], 0
+        for i in recent + [i for i in ranked if scores[i] > 0 and i not in recent]:
+            if len(chosen) >= k:
+                break
+            tokens = count_tokens(self.memories[i])
+            if used + tokens > max_tokens:
+                continue
+            chosen.append(i)
+            used += tokens
+        return [self.memories[i] for i in sorted(chosen)]
@@ -1,10 +1,31 @@
 from typing import Dict, List
-from llm import get_response_from_llm
+from structured_output import StructuredOutputError, request_json
+
+# 合并结果的结构
+MERGE_SCHEMA = {
+    "type": "object",
+    "properties": {"goal": {"type": "string"}, "plan": {"type": "string"}},
+    "required": ["goal", "plan"],
+}
+
+
+def _scrape_lines(response: str) -> Dict[str, str]:
+    # 兼容按"目标:"/"计划:"逐行输出的回答
+    merged = {"goal": "", "plan": ""}
+    for line in (response or "").splitlines():
+        if "目标:" in line:
+            merged["goal"] = line.replace("目标:", "").strip()
+        elif "计划:" in line:
+            merged["plan"] = line.replace("计划:", "").strip()
+    return merged
 
 
 def merge_decisions(decisions: List[Dict[str, str]]) -> Dict[str, str]:
+    # 固定说明和输出格式在前，各角色的决策在后，便于复用服务端前缀缓存
     input_text = (
-        "以下是三条决策，请将它们合并为一条，并确保合并后的计划中包含明确的主语，并注意行为之间的逻辑性：\n"
+        "以下是多条决策，请将它们合并为一条，并确保合并后的计划中包含明确的主语，并注意行为之间的逻辑性。\n"
+        "请以 JSON 对象返回合并后的目标和计划，格式如下：\n"
+        '{"goal": "合并后的目标内容", "plan": "合并后的计划内容（请确保计划中包含主语，且逻辑清晰），用一段话输出"}\n\n'
     )
     for i, decision in enumerate(decisions, start=1):
         input_text += f"决策 {i}:\n"
@@ -12,28 +33,20 @@ def merge_decisions(decisions: List[Dict[str, str]]) -> Dict[str, str]:
         input_text += f"- 目标: {decision['goal']}\n"
         input_text += f"- 计划: {decision['plan']}\n\n"
 
-    input_text += (
-        "请生成合并后的目标和计划，格式如下：\n"
-        "目标: 合并后的目标内容\n"
-        "计划: 合并后的计划内容（请确保计划中包含主语，且逻辑清晰），用一段话输出\n"        
-    )
-
     # 调用大模型生成合并后的决策
-    merged_response = get_response_from_llm(input_text)
-    print(merged_response)  # 调试用，查看返回内容
-
-    # 解析返回结果
-    merged_goal = ""
-    merged_plan = ""
-    for line in merged_response.splitlines():
-        if "目标:" in line:
-            merged_goal = line.replace("目标:", "").strip()
-        elif "计划:" in line:
-            merged_plan = line.replace("计划:", "").strip()
+    try:
+        merged = request_json(input_text, MERGE_SCHEMA, call_site="merge")
+    except StructuredOutputError as e:
+        # 修正后仍不合格时，尽量从原始输出中按行取出目标和计划
+        merged = _scrape_lines(e.raw)
+        if not merged["goal"] and not merged["plan"]:
+            raise
+        print(f"合并结果不是合法的 JSON，已按行解析：{e}")
+    print(merged)  # 调试用，查看返回内容
 
     # 返回合并后的决策
     return {
         "agent_name": "合并",
-        "goal": merged_goal,
-        "plan": merged_plan,
+        "goal": merged["goal"],
+        "plan": merged["plan"],
     }
\ No newline at end of file
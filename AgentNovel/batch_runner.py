@@ -0,0 +1,112 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List
+
+from project import ProjectPaths
+import rate_limit
+
+# 共享限速状态文件的默认位置
+DEFAULT_RATE_STATE = os.path.join(".llm_rate", "state.json")
+
+
+def _run_project(root: str, options: Dict) -> Dict:
+    """
+    在工作进程中生成一部小说，输出写入 <root>/logs/ 下的日志文件。
+    缓存、追踪和评分数据写入项目目录（ProjectPaths.state_environ），各进程不共享同一个数据库。
+    """
+    paths = ProjectPaths(root)
+    # 各模块在导入时按环境变量确定文件路径，因此先设置环境变量再导入主流程；
+    # 每个工作进程只运行一个项目（max_tasks_per_child=1），模块不会沿用上一个项目的路径
+    os.environ.update(paths.state_environ())
+    from checkpoint import list_runs
+    from main import start_novel
+
+    os.makedirs(paths.log_dir, exist_ok=True)
+    log_path = os.path.join(paths.log_dir, time.strftime("batch-%Y%m%d-%H%M%S.log"))
+    start = time.time()
+    result = {"root": root, "log": log_path}
+    with open(log_path, "a", encoding="utf-8") as log:
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = log
+        try:
+            resume = "" if options["resume"] and list_runs(paths.checkpoint_dir) else None
+            state = start_novel(paths, resume=resume, num_rounds=options["rounds"], pipeline=options["pipeline"])
+            result.update(status="完成", chapters=len(state.get("chapters", [])))
+        except Exception as e:
+            traceback.print_exc()
+            result.update(status="失败", error=str(e))
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+    result["elapsed"] = round(time.time() - start, 1)
+    return result
+
+
+def run_batch(roots: List[str], workers: int, options: Dict, rate_state: str, rpm: float,
+              burst: float, max_concurrency: int) -> List[Dict]:
+    """
+    在进程池中并发生成多部小说，所有进程共享同一个令牌桶限速器和并发预算。
+
+    :param roots: 项目根目录列表
+    :param workers: 同时运行的项目数
+    :param options: 传给每个项目的选项（resume / rounds / pipeline）
+    :param rate_state: 共享限速状态文件
+    :param rpm: 所有进程合计的每分钟请求数上限
+    :param burst: 令牌桶容量
+    :param max_concurrency: 所有进程合计的在途请求上限
+    :return: 每个项目的运行结果
+    """
+    for root in roots:
+        ProjectPaths(root).validate()
+
+    # 子进程通过环境变量找到共享限速器
+    os.environ["LLM_RATE_LIMIT_PATH"] = os.path.abspath(rate_state)
+    os.environ["LLM_RATE_LIMIT_RPM"] = str(rpm)
+    os.environ["LLM_RATE_LIMIT_BURST"] = str(burst)
+    os.environ["LLM_RATE_LIMIT_CONCURRENCY"] = str(max_concurrency)
+    limiter = rate_limit.get_shared_limiter()
+    limiter.reset()
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=context, max_tasks_per_child=1) as executor:
+        futures = {executor.submit(_run_project, root, options): root for root in roots}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # 工作进程异常退出
+                result = {"root": futures[future], "status": "失败", "error": str(e)}
+            results.append(result)
+            print(f"[批量] {len(results)}/{len(roots)} {result['root']}: {result['status']} "
+                  f"{result.get('elapsed', '')}s {result.get('error', '')}")
+            print(f"[限速] {limiter.stats()}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量生成多部小说，共享全局限速")
+    parser.add_argument("roots", nargs="+", help="项目根目录（每个包含 resources/）")
+    parser.add_argument("--workers", type=int, default=4, help="同时运行的项目数")
+    parser.add_argument("--rpm", type=float, default=rate_limit.RATE_LIMIT_RPM, help="所有项目合计的每分钟请求数")
+    parser.add_argument("--burst", type=float, default=rate_limit.RATE_LIMIT_BURST, help="令牌桶容量")
+    parser.add_argument("--max-concurrency", type=int, default=rate_limit.RATE_LIMIT_CONCURRENCY,
+                        help="所有项目合计的在途请求上限")
+    parser.add_argument("--rate-state", default=DEFAULT_RATE_STATE, help="共享限速状态文件")
+    parser.add_argument("--rounds", type=int, default=3, help="每次迭代的决策轮数")
+    parser.add_argument("--pipeline", action="store_true", help="章节生成与下一次迭代重叠")
+    parser.add_argument("--resume", action="store_true", help="项目已有运行时从最近一次运行继续")
+    args = parser.parse_args()
+
+    batch_results = run_batch(
+        args.roots, args.workers,
+        {"resume": args.resume, "rounds": args.rounds, "pipeline": args.pipeline},
+        args.rate_state, args.rpm, args.burst, args.max_concurrency,
+    )
+    failed = [r for r in batch_results if r["status"] != "完成"]
+    print(f"[批量] 完成 {len(batch_results) - len(failed)} 部，失败 {len(failed)} 部")
+    sys.exit(1 if failed else 0)
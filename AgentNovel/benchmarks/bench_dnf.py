@@ -0,0 +1,68 @@
+"""
+DNF 前向计算微基准。
+
+对比：
+  - RuleBasedDNF.forward_loop（逐规则、逐特征的原始实现）
+  - RuleBasedDNF.forward（编译后的向量化 torch 实现）
+  - CompiledDNF（纯 NumPy 实现）
+  - DNFModel（可训练的软逻辑 DNF）
+
+用法（在 AgentNovel 目录下）：
+    python -m benchmarks.bench_dnf --sizes 1 100 10000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from LLM_DNF_Novel.mark import (
+    SCORING_CONJUNCTIONS, SCORING_NUM_CLASSES, SCORING_NUM_FEATURES, get_rule_scorer
+)
+from LLM_DNF_Novel.models.dnf_model import DNFModel
+
+
+def _timeit(fn, repeat: int) -> float:
+    """
+    运行 repeat 次，返回最快一次的耗时（秒）。
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(sizes, repeat: int = 5, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    torch_model = get_rule_scorer("torch", torch.device("cpu"))
+    numpy_model = get_rule_scorer("numpy")
+    dnf_model = DNFModel(SCORING_NUM_FEATURES, len(SCORING_CONJUNCTIONS), SCORING_NUM_CLASSES).eval()
+
+    print(f"rules: {torch_model.get_rules()}")
+    print(f"{'B':>8} {'loop(ms)':>10} {'torch(ms)':>10} {'numpy(ms)':>10} {'DNFModel(ms)':>13} {'speedup':>8}")
+    for batch in sizes:
+        x_np = rng.integers(0, 2, size=(batch, SCORING_NUM_FEATURES)).astype(np.float32)
+        x = torch.from_numpy(x_np)
+
+        with torch.no_grad():
+            expected = torch_model.forward_loop(x)
+            np.testing.assert_allclose(torch_model(x).numpy(), expected.numpy(), atol=1e-6)
+            np.testing.assert_allclose(numpy_model(x_np), expected.numpy(), atol=1e-6)
+
+            t_loop = _timeit(lambda: torch_model.forward_loop(x), repeat)
+            t_torch = _timeit(lambda: torch_model(x), repeat)
+            t_dnf = _timeit(lambda: dnf_model(x), repeat)
+        t_numpy = _timeit(lambda: numpy_model(x_np), repeat)
+
+        speedup = t_loop / min(t_torch, t_numpy)
+        print(f"{batch:>8} {t_loop * 1e3:>10.3f} {t_torch * 1e3:>10.3f} {t_numpy * 1e3:>10.3f} {t_dnf * 1e3:>13.3f} {speedup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DNF 前向计算微基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 3, 100, 1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
@@ -0,0 +1,75 @@
+"""
+启动耗时检查：用 `python -X importtime` 导入主流程模块，汇总各模块的累计导入耗时，
+并确认 torch / sklearn / openai / pypinyin 等重依赖没有在导入阶段被加载。
+
+用法（在 AgentNovel 目录下）：
+    python -m benchmarks.bench_import_time --budget 1.0
+
+超出时间预算或重依赖被提前导入时以非零状态码退出，可直接用于 CI 检查。
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# 主流程入口模块
+ENTRY_MODULES = ["main", "interact", "decision", "environment", "write", "agents.tools.memory"]
+# 这些依赖只应在首次使用时导入
+HEAVY_MODULES = ["torch", "sklearn", "openai", "httpx", "pypinyin"]
+
+AGENT_NOVEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(modules):
+    """
+    在子进程中导入 modules，返回 ({模块名: 累计耗时(微秒)}, 总耗时(微秒), 已加载的重依赖列表)。
+    """
+    code = (
+        f"import sys\n"
+        f"for m in {modules!r}: __import__(m)\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=AGENT_NOVEL_DIR, capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        # 格式：import time: self [us] | cumulative | imported package（名称缩进表示嵌套层级）
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, raw_name = line[len("import time:"):].split("|")
+        name = raw_name.strip()
+        cumulative[name] = max(cumulative.get(name, 0), int(cumulative_us))
+        if len(raw_name) - len(raw_name.lstrip()) == 1:
+            total_us += int(cumulative_us)
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return cumulative, total_us, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="主流程模块导入耗时检查")
+    parser.add_argument("--budget", type=float, default=1.0, help="允许的总导入耗时（秒）")
+    parser.add_argument("--top", type=int, default=15, help="展示累计耗时最高的模块数量")
+    args = parser.parse_args()
+
+    cumulative, total_us, loaded = measure(ENTRY_MODULES)
+
+    print(f"{'cumulative(ms)':>15}  module")
+    for name, us in sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{us / 1000:>15.1f}  {name}")
+    print(f"\n总导入耗时: {total_us / 1e6:.3f}s（预算 {args.budget:.3f}s）")
+
+    failed = False
+    if loaded:
+        print(f"错误：导入阶段加载了重依赖: {', '.join(loaded)}")
+        failed = True
+    if total_us / 1e6 > args.budget:
+        print("错误：导入耗时超出预算")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+端到端离线基准：在本地桩服务（benchmarks/stub_server.py）上运行完整的 main.py 主循环，
+统计每个规模下的 API 调用数、token 数、耗时和峰值内存。
+
+每个用例在临时目录中生成一个合成项目（cast 个角色、已有 scenes 个场景文件），
+在独立子进程中运行 iterations 次迭代，互不影响，也不访问真实接口。
+
+用法（在 AgentNovel 目录下）：
+    python -m benchmarks.bench_pipeline --casts 3 10 50 --scenes 10 100 1000 --iterations 3
+    python -m benchmarks.bench_pipeline --latency 0.05 --jitter 0.02 --error-rate 0.01 --pipeline
+    python -m benchmarks.bench_pipeline --malformed-rate 0.2
+    python -m benchmarks.bench_pipeline --latency 0.05 --stall-rate 0.02 --stall-time 3 --hedge
+    python -m benchmarks.bench_pipeline --token-latency 0.002 --routes llm_routes.json
+    python -m benchmarks.bench_pipeline --scoring lazy
+    python -m benchmarks.bench_pipeline --save baseline.json
+    python -m benchmarks.bench_pipeline --baseline baseline.json --tolerance 0.2
+
+给出 --baseline 时，调用数或 token 数增加、耗时或峰值内存超出容差的用例视为回归，以非零状态码退出。
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.stub_server import StubConfig, StubServer
+from llm_trace import format_table
+
+AGENT_NOVEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_OUTLINE = os.path.join(AGENT_NOVEL_DIR, "resources", "outline", "outline.json")
+
+# 对比基线时参与比较的指标：(名称, 是否允许容差)
+REGRESSION_METRICS = [("api_calls", False), ("prompt_tokens", True), ("wall_s", True), ("peak_rss_mb", True)]
+
+
+def make_project(root: str, cast: int, scenes: int) -> List[str]:
+    """
+    生成合成项目：cast 个角色文件、scene_001 至 scene_{scenes} 的场景文件和大纲。
+    :return: 角色名列表
+    """
+    paths = {name: os.path.join(root, "resources", name) for name in ("character", "environment", "outline")}
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+
+    names = [f"角色{i:02d}" for i in range(1, cast + 1)]
+    for i, name in enumerate(names, start=1):
+        character = {
+            "name": name,
+            "personality": "冷静、谨慎",
+            "role": "幸存者",
+            "profession": "医生" if i % 2 else "工程师",
+            "health_status": "健康",
+            "memory": [f"{name}记得邮轮沉没前的最后一次晚餐。", f"{name}曾在岛上找到淡水。"],
+            "goals": [],
+            "knowledge": {},
+            "environment": None,
+        }
+        with open(os.path.join(paths["character"], f"character_{i:02d}.json"), "w", encoding="utf-8") as f:
+            json.dump(character, f, ensure_ascii=False, indent=4)
+
+    for i in range(1, scenes + 1):
+        scene_id = f"scene_{i:03d}"
+        scene = {
+            "scene_id": scene_id,
+            "location": f"荒岛第 {i} 处营地",
+            "event": f"第 {i} 天，众人在营地附近发现新的线索",
+            "weather": "阴",
+            "atmosphere": "紧张",
+            "writing_style": "克制的心理描写",
+            "recent_events": [f"第 {i} 天发现线索", "同伴之间产生分歧"],
+            "involved_characters": names,
+            "long_term_goal": {"description": "逃离荒岛", "status": "未完成"},
+            "current_interaction_goal": {name: "保护同伴" for name in names},
+            "environment_goal": {"description": "查清线索的来源", "status": "未完成"},
+        }
+        with open(os.path.join(paths["environment"], f"{scene_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(scene, f, ensure_ascii=False, indent=4)
+
+    with open(TEMPLATE_OUTLINE, "r", encoding="utf-8") as f:
+        outline = json.load(f)
+    outline["main characters"] = [
+        {"name": name, "personality": "冷静、谨慎", "role": "幸存者", "profession": "医生",
+         "health_status": "健康", "relationships": {}}
+        for name in names
+    ]
+    with open(os.path.join(paths["outline"], "outline.json"), "w", encoding="utf-8") as f:
+        json.dump(outline, f, ensure_ascii=False, indent=2)
+    return names
+
+
+def _child(options: Dict) -> None:
+    """
+    子进程入口：在当前目录（合成项目根目录）运行主循环，最后一行输出统计 JSON。
+    """
+    from llm import get_call_stats
+    from llm_router import get_route_stats, route_totals
+    from main import start_novel
+    from project import ProjectPaths
+    from structured_output import get_structured_stats
+
+    start = time.perf_counter()
+    state = start_novel(ProjectPaths("."), num_rounds=options["rounds"], pipeline=options["pipeline"],
+                        scoring=options.get("scoring"))
+    result = {
+        "wall_s": round(time.perf_counter() - start, 2),
+        "iterations": state["iteration"],
+        "chapters": len(state.get("chapters", [])),
+        **get_call_stats(),
+        "json_repaired": get_structured_stats()["repaired"],
+        "json_fixed": get_structured_stats()["fixed"],
+        "json_failed": get_structured_stats()["failed"],
+        "cost_usd": route_totals(get_route_stats()).get("cost_usd", 0.0),
+        "routes": get_route_stats(),
+    }
+    try:
+        import resource
+        # Linux 上 ru_maxrss 的单位为 KB
+        result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:
+        result["peak_rss_mb"] = None
+    print(json.dumps(result))
+
+
+def run_case(cast: int, scenes: int, iterations: int, rounds: int, pipeline: bool, config: StubConfig,
+             keep: bool = False, hedge: bool = False, routes: Optional[str] = None,
+             scoring: Optional[str] = None) -> Dict:
+    """
+    运行一个用例，返回统计结果。hedge 为 True 时子进程对短调用启用对冲请求；
+    routes 为子进程使用的路由配置文件（默认不加载任何配置文件，使用内置路由）；
+    scoring 为谓词提取方式（默认同 main.py）。
+    """
+    if iterations < 2:
+        # 第一次迭代不检查结局，至少需要两次迭代才能结束
+        raise ValueError(f"迭代次数至少为 2: {iterations}")
+    root = tempfile.mkdtemp(prefix=f"bench-c{cast}-s{scenes}-")
+    make_project(root, cast, scenes)
+    config.ending_after = iterations - 1
+
+    with StubServer(config) as server:
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(filter(None, [AGENT_NOVEL_DIR, os.environ.get("PYTHONPATH")])),
+            LLM_BASE_URL=server.url,
+            DEEPSEEK_API_KEY="stub",
+            LLM_CACHE_PATH=os.path.join(root, ".llm_cache", "responses.sqlite"),
+            LLM_TRACE_PATH=os.path.join(root, "logs", "llm_trace.jsonl"),
+            LLM_RATE_LIMIT_PATH="",
+            LLM_HEDGE="1" if hedge else "0",
+            LLM_ROUTES_PATH=os.path.abspath(routes) if routes else "",
+        )
+        options = {"rounds": rounds, "pipeline": pipeline, "scoring": scoring}
+        log_path = os.path.join(root, "bench.log")
+        with open(log_path, "w", encoding="utf-8") as log:
+            proc = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_pipeline", "--child", json.dumps(options)],
+                cwd=root, env=env, stdout=subprocess.PIPE, stderr=log, text=True,
+            )
+        with open(log_path, "a", encoding="utf-8") as log:
+            log.write(proc.stdout)
+        stub = server.stats()
+
+    result = {"cast": cast, "scenes": scenes, "root": root}
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        result.update(status="失败", error=f"退出码 {proc.returncode}，日志 {log_path}")
+        return result
+    result.update(json.loads(lines[-1]))
+    result.update(status="完成", requests=stub["requests"], errors=sum(stub["errors"].values()), stalls=stub["stalls"],
+                  prompt_tokens=stub["prompt_tokens"], cached_tokens=stub["cached_tokens"],
+                  completion_tokens=stub["completion_tokens"])
+    if not keep:
+        shutil.rmtree(root, ignore_errors=True)
+        result.pop("root")
+    return result
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """
+    与基线逐用例比较，返回回归描述列表。
+    """
+    previous = {(r["cast"], r["scenes"]): r for r in baseline if r.get("status") == "完成"}
+    regressions = []
+    for result in results:
+        old = previous.get((result["cast"], result["scenes"]))
+        if old is None or result.get("status") != "完成":
+            continue
+        for metric, tolerant in REGRESSION_METRICS:
+            new_value, old_value = result.get(metric), old.get(metric)
+            if new_value is None or old_value is None:
+                continue
+            limit = old_value * (1 + tolerance) if tolerant else old_value
+            if new_value > limit:
+                regressions.append(f"cast={result['cast']} scenes={result['scenes']} {metric}: "
+                                   f"{old_value} -> {new_value}")
+    return regressions
+
+
+def _json_column(result: Dict) -> str:
+    # 本地修复 / 修正请求 / 最终失败的结构化输出次数
+    return f"{result.get('json_repaired', 0)}/{result.get('json_fixed', 0)}/{result.get('json_failed', 0)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基于本地桩服务的端到端离线基准")
+    parser.add_argument("--casts", type=int, nargs="+", default=[3, 10, 50], help="角色数")
+    parser.add_argument("--scenes", type=int, nargs="+", default=[10, 100, 1000], help="已有场景文件数")
+    parser.add_argument("--iterations", type=int, default=3, help="每个用例的迭代次数（至少 2）")
+    parser.add_argument("--rounds", type=int, default=3, help="每次迭代的决策轮数")
+    parser.add_argument("--pipeline", action="store_true", help="章节生成与下一次迭代重叠")
+    parser.add_argument("--scoring", choices=("batch", "lazy", "full"), help="谓词提取方式")
+    parser.add_argument("--latency", type=float, default=0.0, help="桩服务平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="桩服务延迟标准差（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="桩服务返回 500 的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="桩服务返回 429 的概率")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="桩服务 JSON 类回答被改坏的概率")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="桩服务请求卡住的概率")
+    parser.add_argument("--stall-time", type=float, default=5.0, help="卡住的请求额外等待的时间（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="桩服务每个输出 token 额外的延迟（秒）")
+    parser.add_argument("--hedge", action="store_true", help="对短调用启用对冲请求（LLM_HEDGE=1）")
+    parser.add_argument("--routes", metavar="PATH", help="模型路由配置文件（见 llm_router.py）")
+    parser.add_argument("--show-routes", action="store_true", help="打印每个用例各路由的统计")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="保留合成项目目录（含日志与调用追踪）")
+    parser.add_argument("--save", metavar="PATH", help="把结果保存为 JSON，可作为之后的基线")
+    parser.add_argument("--baseline", metavar="PATH", help="与基线结果比较")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="耗时、token 和内存允许的相对增幅")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(json.loads(args.child))
+        return
+
+    results = []
+    header = f"{'cast':>5} {'scenes':>6} {'calls':>6} {'stream':>6} {'errors':>6} " \
+             f"{'tok_in':>9} {'cached':>9} {'tok_out':>8} {'json':>9} {'retry':>5} {'hedge':>7} {'cost($)':>9} {'wall(s)':>8} {'peak(MB)':>9}  status"
+    print(header)
+    for cast in args.casts:
+        for scenes in args.scenes:
+            config = StubConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                rate_limit_rate=args.rate_limit_rate, malformed_rate=args.malformed_rate,
+                                stall_rate=args.stall_rate, stall_time=args.stall_time,
+                                token_latency=args.token_latency, seed=args.seed)
+            result = run_case(cast, scenes, args.iterations, args.rounds, args.pipeline, config, args.keep,
+                              args.hedge, args.routes, args.scoring)
+            results.append(result)
+            if result["status"] != "完成":
+                print(f"{cast:>5} {scenes:>6}  {result['status']}: {result['error']}")
+                continue
+            print(f"{cast:>5} {scenes:>6} {result['api_calls']:>6} {result['stream_calls']:>6} "
+                  f"{result['errors']:>6} {result['prompt_tokens']:>9} {result['cached_tokens']:>9} "
+                  f"{result['completion_tokens']:>8} "
+                  f"{_json_column(result):>9} {result.get('retries', 0):>5} "
+                  f"{result.get('hedge_wins', 0):>3}/{result.get('hedged', 0):<3} "
+                  f"{result.get('cost_usd', 0.0):>9.4f} "
+                  f"{result['wall_s']:>8.2f} {result['peak_rss_mb'] or 0:>9.1f}  {result['status']}"
+                  + (f"  {result['root']}" if args.keep else ""))
+            if args.show_routes:
+                print(format_table(result.get("routes", [])))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.save}")
+
+    failed = any(r["status"] != "完成" for r in results)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"回归: {line}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,529 @@
+"""
+本地 OpenAI 兼容桩服务：实现 /v1/chat/completions（含流式），按提示类型返回格式正确的脚本化回答，
+可配置延迟、抖动、卡住的请求、错误率和 429 比例，供离线基准测试和调试使用，不访问真实接口。
+
+识别的提示类型：goal / plan / merge / predicate / predicate-batch / env-gen / env-check /
+ending-check / character-update / character-update-batch / chapter / chapter-resume / story-summary /
+json-fix。
+
+请求带 max_tokens 时按该上限截断回答并返回 finish_reason "length"；token_latency > 0 时
+延迟随输出 token 数增加，用于观察限制判断类调用输出长度的效果。
+
+malformed_rate > 0 时，按该概率把 JSON 类回答改坏（加代码块和说明、多余逗号、截断或整段不是 JSON），
+随后的 json-fix 修正请求返回改坏之前的原文，用于验证本地修复与修正请求。
+
+用法（在 AgentNovel 目录下）：
+    python -m benchmarks.stub_server --port 8765 --latency 0.05 --jitter 0.02 --error-rate 0.01
+    LLM_BASE_URL=http://127.0.0.1:8765 DEEPSEEK_API_KEY=stub python main.py
+
+返回的 usage 模拟服务端前缀缓存：按 PREFIX_BLOCK_CHARS 字符分块，与之前请求相同的开头部分
+计为 prompt_cache_hit_tokens（DeepSeek 字段）和 prompt_tokens_details.cached_tokens（OpenAI 字段）。
+
+GET /stats 返回各类型的请求数，POST /reset 清零计数。
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from context_builder import count_tokens, truncate_to_tokens
+
+# 模拟前缀缓存的分块大小（字符）
+PREFIX_BLOCK_CHARS = 64
+# 回答为 JSON、可被 malformed_rate 改坏的提示类型
+JSON_TYPES = ("env-gen", "character-update", "character-update-batch", "merge", "predicate-batch")
+# json-fix 请求中按改坏回答的前若干字符查找原文
+FIX_MATCH_CHARS = 4000
+
+# (类型, 提示中的标志文本)，按顺序匹配
+PROMPT_TYPES = [
+    ("json-fix", "JSON 修正助手"),
+    ("story-summary", "维护一部长篇小说的故事梗概"),
+    ("env-gen", "小说环境生成助手"),
+    ("env-check", "环境目标判断助手"),
+    ("ending-check", "小说大纲分析助手"),
+    ("character-update-batch", "以下是多个小说角色的原始信息"),
+    ("character-update", "小说角色管理助手"),
+    ("merge", "请将它们合并为一条"),
+    ("predicate-batch", "Respond with only a JSON array of"),
+    ("predicate", "Please respond with only 'true' or 'false'"),
+    ("chapter-resume", "请从断开处直接续写"),
+    ("chapter", "小说创作大师"),
+    ("goal", "此刻最合理的目标"),
+    ("plan", "输出格式"),
+]
+
+
+class StubConfig:
+    """
+    桩服务的行为配置。
+
+    :param latency: 每次请求的平均延迟（秒）；流式请求分摊到各片段
+    :param jitter: 延迟的标准差（秒）
+    :param error_rate: 返回 500 的概率
+    :param rate_limit_rate: 返回 429（带 Retry-After）的概率
+    :param retry_after: 429 响应的 Retry-After（秒）
+    :param chapter_chars: 章节正文的字数
+    :param stream_chunks: 流式章节的片段数
+    :param ending_after: 第几次结局检查返回"已完成"（None 表示始终"未完成"）
+    :param true_rate: 谓词回答为 true 的比例（按提示哈希确定，重复请求结果一致）
+    :param malformed_rate: JSON 类回答被改坏的概率
+    :param stall_rate: 请求"卡住"的概率，卡住的请求额外等待 stall_time 秒（模拟长尾延迟）
+    :param stall_time: 卡住的请求额外等待的时间（秒）
+    :param token_latency: 每个输出 token 额外的延迟（秒），模拟生成耗时
+    :param seed: 延迟与错误注入的随机种子
+    """
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0, chapter_chars: int = 3200,
+                 stream_chunks: int = 16, ending_after: Optional[int] = None, true_rate: float = 0.5,
+                 malformed_rate: float = 0.0, stall_rate: float = 0.0, stall_time: float = 5.0,
+                 token_latency: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.chapter_chars = chapter_chars
+        self.stream_chunks = max(1, stream_chunks)
+        self.ending_after = ending_after
+        self.true_rate = true_rate
+        self.malformed_rate = malformed_rate
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+        self.token_latency = token_latency
+        self.seed = seed
+
+
+def classify(prompt: str) -> str:
+    for kind, marker in PROMPT_TYPES:
+        if marker in prompt:
+            return kind
+    return "other"
+
+
+def _stable_fraction(text: str) -> float:
+    # 同一提示总是得到同一个值，便于缓存命中与结果复现
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+
+
+def _json_block(prompt: str, start: str, end: str):
+    """
+    取出提示中 start 与 end 之间的 JSON；解析失败返回 None。
+    """
+    begin = prompt.find(start)
+    stop = prompt.find(end, begin + len(start))
+    if begin < 0 or stop < 0:
+        return None
+    try:
+        return json.loads(prompt[begin + len(start):stop].strip())
+    except json.JSONDecodeError:
+        return None
+
+
+class StubResponder:
+    """
+    按提示类型生成回答，并统计请求数。线程安全。
+    """
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        self._random = random.Random(config.seed)
+        self.counts: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.stalls = 0
+        self._prefix_blocks = set()
+        # 改坏后的回答 -> 原文，供 json-fix 返回
+        self._malformed = {}
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts.clear()
+            self.errors.clear()
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.cached_tokens = 0
+            self.stalls = 0
+            self._prefix_blocks.clear()
+            self._malformed.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": sum(self.counts.values()),
+                "by_type": dict(self.counts),
+                "errors": dict(self.errors),
+                "malformed": len(self._malformed),
+                "stalls": self.stalls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cached_tokens": self.cached_tokens,
+            }
+
+    def delay(self, completion_tokens: int = 0) -> float:
+        with self._lock:
+            delay = max(0.0, self._random.gauss(self.config.latency, self.config.jitter))
+            delay += completion_tokens * self.config.token_latency
+            if self._random.random() < self.config.stall_rate:
+                self.stalls += 1
+                delay += self.config.stall_time
+            return delay
+
+    def inject_error(self, kind: str) -> Optional[int]:
+        """
+        按配置的概率决定本次请求是否失败，返回 HTTP 状态码或 None。
+        """
+        with self._lock:
+            roll = self._random.random()
+            status = None
+            if roll < self.config.rate_limit_rate:
+                status = 429
+            elif roll < self.config.rate_limit_rate + self.config.error_rate:
+                status = 500
+            if status is not None:
+                self.errors[f"{kind}:{status}"] += 1
+            return status
+
+    def _cached_prefix(self, prompt: str) -> str:
+        """
+        返回 prompt 开头与之前请求相同的部分（按块比较），并记录本次请求的各块。
+        """
+        digest = hashlib.md5()
+        cached_chars = 0
+        hit = True
+        blocks = []
+        for start in range(0, len(prompt) - PREFIX_BLOCK_CHARS + 1, PREFIX_BLOCK_CHARS):
+            digest.update(prompt[start:start + PREFIX_BLOCK_CHARS].encode("utf-8"))
+            blocks.append(digest.hexdigest())
+        with self._lock:
+            for i, block in enumerate(blocks):
+                if hit and block in self._prefix_blocks:
+                    cached_chars = (i + 1) * PREFIX_BLOCK_CHARS
+                else:
+                    hit = False
+                    self._prefix_blocks.add(block)
+        return prompt[:cached_chars]
+
+    def record(self, kind: str, prompt: str, content: str) -> dict:
+        prompt_tokens = count_tokens(prompt)
+        cached = count_tokens(self._cached_prefix(prompt))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": count_tokens(content),
+            "prompt_cache_hit_tokens": cached,
+            "prompt_cache_miss_tokens": prompt_tokens - cached,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        with self._lock:
+            self.counts[kind] += 1
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.completion_tokens += usage["completion_tokens"]
+            self.cached_tokens += cached
+        return usage
+
+    def respond(self, kind: str, prompt: str) -> str:
+        handler = getattr(self, "_" + kind.replace("-", "_"), None)
+        content = handler(prompt) if handler is not None else "好的。"
+        if kind in JSON_TYPES:
+            content = self._maybe_malform(content)
+        return content
+
+    def _maybe_malform(self, content: str) -> str:
+        """
+        按 malformed_rate 把 JSON 回答改坏：前两种可在本地修复，后两种通常需要修正请求。
+        """
+        with self._lock:
+            if self._random.random() >= self.config.malformed_rate:
+                return content
+            mode = self._random.choice(["fence", "trailing-comma", "truncate", "prose"])
+            if mode == "fence":
+                broken = f"好的，结果如下：\n```json\n{content}\n```\n以上内容可直接使用。"
+            elif mode == "trailing-comma":
+                broken = content[:-1] + ",\n" + content[-1]
+            elif mode == "truncate":
+                broken = content[:max(1, len(content) * 2 // 3)]
+            else:
+                broken = "抱歉，我需要先确认一下：" + content.replace('"', "")
+            self._malformed[broken] = content
+            return broken
+
+    def _json_fix(self, prompt: str) -> str:
+        with self._lock:
+            for broken, original in self._malformed.items():
+                if broken[:FIX_MATCH_CHARS] in prompt:
+                    return original
+        return "{}"
+
+    def _goal(self, prompt: str) -> str:
+        return f"查清异常的来源并保护同伴（{_stable_fraction(prompt):.4f}）"
+
+    def _plan(self, prompt: str) -> str:
+        return ("思考：\n- 当前环境危险，需要先确认安全\n- 同伴状态不佳，需要分工\n"
+                "计划：\n- 第一步：观察周围环境\n- 第二步：与同伴商量分工\n- 第三步：按计划行动并互相照应")
+
+    def _merge(self, prompt: str) -> str:
+        return json.dumps({"goal": "众人协作查清异常的来源",
+                           "plan": "沈砚负责观察，韩越负责探路，江澈负责记录，三人约定信号后分头行动。"},
+                          ensure_ascii=False)
+
+    def _predicate(self, prompt: str) -> str:
+        return "true" if _stable_fraction(prompt) < self.config.true_rate else "false"
+
+    def _predicate_batch(self, prompt: str) -> str:
+        count = int(re.search(r"JSON array of (\d+) objects", prompt).group(1))
+        shared = re.search(r"each with the keys (.+?) and boolean values", prompt)
+        # 各决策的谓词不同时，每条决策后有一行 "Keys: ..."
+        key_lists = [shared.group(1).split(", ")] * count if shared else \
+            [line.split(", ") for line in re.findall(r"^Keys: (.+)$", prompt, re.M)]
+        return json.dumps([
+            {key: _stable_fraction(f"{prompt}|{i}|{key}") < self.config.true_rate for key in keys}
+            for i, keys in enumerate(key_lists)
+        ])
+
+    def _env_gen(self, prompt: str) -> str:
+        scene_id = re.search(r"场景 ID 为 (\w+)", prompt).group(1)
+        match = re.search(r'"?involved_characters"?\s*:\s*\[(.*?)\]', prompt, re.S)
+        names: List[str] = re.findall(r'"([^"]+)"', match.group(1)) if match else []
+        return json.dumps({
+            "scene_id": scene_id,
+            "location": f"{scene_id} 的海岸",
+            "event": "众人在新的地点发现了更多线索",
+            "weather": "阴",
+            "atmosphere": "紧张",
+            "writing_style": "克制的心理描写",
+            "recent_events": ["发现新的线索", "同伴之间产生分歧"],
+            "involved_characters": names,
+            "long_term_goal": {"description": "逃离荒岛", "status": "未完成"},
+            "current_interaction_goal": {name: "保护同伴" for name in names},
+            "environment_goal": {"description": "查清线索的来源", "status": "未完成"},
+        }, ensure_ascii=False)
+
+    def _env_check(self, prompt: str) -> str:
+        return "未完成"
+
+    def _ending_check(self, prompt: str) -> str:
+        with self._lock:
+            checks = self.counts["ending-check"] + 1
+        ending_after = self.config.ending_after
+        return "已完成" if ending_after is not None and checks >= ending_after else "未完成"
+
+    def _character_update(self, prompt: str) -> str:
+        character = _json_block(prompt, "原始角色信息如下：", "新的剧情内容如下") or {}
+        return json.dumps(_updated_character(character), ensure_ascii=False)
+
+    def _character_update_batch(self, prompt: str) -> str:
+        characters = _json_block(prompt, "原始角色信息如下（键为角色名）：", "新的剧情内容如下") or {}
+        return json.dumps({name: _updated_character(data) for name, data in characters.items()},
+                          ensure_ascii=False)
+
+    def _chapter(self, prompt: str) -> str:
+        sentence = "潮水退去，礁石上留下新的痕迹，众人沉默地望着远处的灯光。"
+        return (sentence * (self.config.chapter_chars // len(sentence) + 1))[:self.config.chapter_chars]
+
+    def _story_summary(self, prompt: str) -> str:
+        match = re.search(r"截至上一章的梗概：\n(.*?)\n\n第 (\d+) 章正文", prompt, re.S)
+        previous = match.group(1) if match and not match.group(1).startswith("（") else ""
+        number = match.group(2) if match else "?"
+        return (previous + f"第{number}章：众人在新的地点发现线索，彼此的信任有所加深。")[-1200:]
+
+    def _chapter_resume(self, prompt: str) -> str:
+        return self._chapter(prompt)[:self.config.chapter_chars // 2]
+
+
+def _updated_character(character: dict) -> dict:
+    # 追加一条记忆，只保留最近几条，模拟模型对 memory 的归并
+    memory = list(character.get("memory", []) or [])
+    memory.append("经历了一段新的剧情")
+    return {**character, "memory": memory[-5:]}
+
+
+def _make_handler(responder: StubResponder):
+    config = responder.config
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # 头部和正文分两次写出，关闭 Nagle 避免与延迟确认叠加出约 40ms 的额外延迟
+        disable_nagle_algorithm = True
+
+        def handle(self):
+            # 客户端超时或取消对冲请求时会提前断开连接，不视为错误
+            try:
+                super().handle()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None) -> None:
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send_json(200, responder.stats())
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path.rstrip("/").endswith("/reset"):
+                responder.reset()
+                self._send_json(200, {"ok": True})
+                return
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            # 各消息依次拼接：system 前缀在前，与服务端前缀缓存的比较方式一致
+            prompt = "\n".join(f"{m.get('role')}: {m.get('content')}" for m in body["messages"])
+            kind = classify(prompt)
+            status = responder.inject_error(kind)
+            if status == 429:
+                self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit"}},
+                                {"Retry-After": str(config.retry_after)})
+                return
+            if status is not None:
+                self._send_json(status, {"error": {"message": "injected error", "type": "server_error"}})
+                return
+
+            content = responder.respond(kind, prompt)
+            finish_reason = "stop"
+            max_tokens = body.get("max_tokens")
+            if max_tokens is not None and count_tokens(content) > max_tokens:
+                content = truncate_to_tokens(content, max_tokens)
+                finish_reason = "length"
+            usage = responder.record(kind, prompt, content)
+            model = body.get("model", "stub")
+            if body.get("stream"):
+                self._stream(model, content, usage, bool((body.get("stream_options") or {}).get("include_usage")),
+                             finish_reason)
+                return
+            time.sleep(responder.delay(usage["completion_tokens"]))
+            self._send_json(200, {
+                "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+
+        def _stream(self, model: str, content: str, usage: dict, include_usage: bool,
+                    finish_reason: str = "stop") -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            size = max(1, -(-len(content) // config.stream_chunks))
+            pause = responder.delay(usage["completion_tokens"]) / config.stream_chunks
+
+            def event(choices, extra=None):
+                chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model, "choices": choices, **(extra or {})}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            for start in range(0, len(content), size):
+                time.sleep(pause)
+                event([{"index": 0, "delta": {"content": content[start:start + size]}, "finish_reason": None}])
+            event([{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+            if include_usage:
+                event([], {"usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+class StubServer:
+    """
+    在后台线程中运行的桩服务。port=0 时自动选择空闲端口。
+
+    用法：
+        with StubServer(StubConfig(latency=0.05)) as server:
+            os.environ["LLM_BASE_URL"] = server.url
+    """
+    def __init__(self, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.responder = StubResponder(config or StubConfig())
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self.responder))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="llm-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        # 在当前线程中运行（命令行模式）
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> dict:
+        return self.responder.stats()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟标准差（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--chapter-chars", type=int, default=3200, help="章节字数")
+    parser.add_argument("--ending-after", type=int, help="第几次结局检查返回已完成")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="JSON 类回答被改坏的概率")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="请求卡住的概率")
+    parser.add_argument("--stall-time", type=float, default=5.0, help="卡住的请求额外等待的时间（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="每个输出 token 额外的延迟（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate, chapter_chars=args.chapter_chars,
+                        ending_after=args.ending_after, malformed_rate=args.malformed_rate,
+                        stall_rate=args.stall_rate, stall_time=args.stall_time,
+                        token_latency=args.token_latency, seed=args.seed)
+    server = StubServer(config, args.host, args.port)
+    print(f"桩服务已启动: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Optional
+
+import scene_store
+from fileio import atomic_write_json
+from story_summary import summary_path
+
+# 检查点根目录，每次运行一个子目录
+CHECKPOINT_DIR = "resources/checkpoints"
+RUN_META_NAME = "run.json"
+
+# 主循环每次迭代的步骤，按执行顺序排列
+STEPS = ("start", "round", "scored", "chapter", "characters", "environment", "ending")
+
+
+def new_run_id() -> str:
+    return time.strftime("run-%Y%m%d-%H%M%S")
+
+
+def snapshot_resources(character_dir: str, environment_dir: str, *scene_ids: str) -> dict:
+    """
+    记录检查点对应的磁盘状态：所有角色文件和给定场景文件的内容。
+    恢复或分支时据此还原，保证后续步骤看到与原始运行一致的输入。
+    """
+    characters = {}
+    for filename in sorted(os.listdir(character_dir)):
+        if filename.endswith(".json"):
+            with open(os.path.join(character_dir, filename), "r", encoding="utf-8") as f:
+                characters[filename] = json.load(f)
+    store = scene_store.get_store(environment_dir)
+    scenes = {scene_id: store.load_data(scene_id) for scene_id in scene_ids if scene_id}
+    return {"characters": characters, "scene": scenes}
+
+
+def restore_resources(snapshot: dict, character_dir: str, environment_dir: str) -> None:
+    """
+    把角色文件和场景文件还原为快照内容，只改写内容不一致的文件。
+    场景通过场景存储写回，被覆盖的版本保留在历史目录中。
+    """
+    for filename, data in snapshot.get("characters", {}).items():
+        path = os.path.join(character_dir, filename)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                if json.load(f) == data:
+                    continue
+        atomic_write_json(path, data)
+        print(f"[检查点] 已还原角色文件 {path}")
+
+    store = scene_store.get_store(environment_dir)
+    for scene_id, data in snapshot.get("scene", {}).items():
+        try:
+            if store.load_data(scene_id) == data:
+                continue
+        except FileNotFoundError:
+            pass
+        store.save(scene_id, data)
+        print(f"[检查点] 已还原场景 {scene_id}")
+
+
+class CheckpointStore:
+    """
+    单次运行的检查点：每个步骤完成后写入一个 {序号}.json（原子写入），
+    内容为主循环状态和对应的磁盘快照。run.json 记录运行的元信息（分支来源、章节目录）。
+    """
+    def __init__(self, run_id: str, root: str = CHECKPOINT_DIR):
+        self.run_id = run_id
+        self.root = root
+        self.run_dir = os.path.join(root, run_id)
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.run_dir, RUN_META_NAME)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.meta_path)
+
+    def create(self, novel_dir: str, parent: Optional[str] = None, forked_at: Optional[int] = None) -> dict:
+        meta = {"run_id": self.run_id, "novel_dir": novel_dir, "parent": parent,
+                "forked_at": forked_at, "created": time.time()}
+        os.makedirs(self.run_dir, exist_ok=True)
+        atomic_write_json(self.meta_path, meta)
+        return meta
+
+    def meta(self) -> dict:
+        if not self.exists():
+            raise FileNotFoundError(f"运行不存在: {self.run_dir}")
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.run_dir, f"{seq:04d}.json")
+
+    def sequences(self) -> List[int]:
+        if not os.path.isdir(self.run_dir):
+            return []
+        return sorted(int(f[:-5]) for f in os.listdir(self.run_dir) if f.endswith(".json") and f[:-5].isdigit())
+
+    def save(self, step: str, state: dict, snapshot: dict) -> int:
+        """
+        写入新的检查点。
+        :return: 检查点序号
+        """
+        if step not in STEPS:
+            raise ValueError(f"未知的检查点步骤: {step}")
+        seqs = self.sequences()
+        seq = seqs[-1] + 1 if seqs else 1
+        state = dict(state, step=step)
+        atomic_write_json(self._path(seq), {
+            "seq": seq,
+            "run_id": self.run_id,
+            "step": step,
+            "iteration": state.get("iteration"),
+            "time": time.time(),
+            "state": state,
+            "snapshot": snapshot,
+        })
+        print(f"[检查点] {self.run_id}#{seq}: 第 {state.get('iteration')} 次迭代 {step}")
+        return seq
+
+    def load(self, seq: Optional[int] = None) -> dict:
+        """
+        读取指定序号的检查点，默认读取最新的检查点。
+        """
+        seqs = self.sequences()
+        if not seqs:
+            raise FileNotFoundError(f"运行 {self.run_id} 没有检查点")
+        seq = seqs[-1] if seq is None else seq
+        if seq not in seqs:
+            raise FileNotFoundError(f"运行 {self.run_id} 不存在检查点 {seq}")
+        with open(self._path(seq), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def summary(self) -> List[Dict[str, object]]:
+        """
+        列出所有检查点的序号、迭代、步骤和时间。
+        """
+        result = []
+        for seq in self.sequences():
+            checkpoint = self.load(seq)
+            result.append({k: checkpoint[k] for k in ("seq", "iteration", "step", "time")})
+        return result
+
+    def fork(self, seq: int, new_run_id: str, novel_dir: str) -> "CheckpointStore":
+        """
+        从检查点 seq 分出新运行：复制 1..seq 的检查点（共享前缀无需重新计算），
+        把已生成的章节复制到新运行的章节目录中，并以一个新检查点作为分支起点。
+        """
+        source = self.load(seq)
+        branch = CheckpointStore(new_run_id, self.root)
+        if branch.exists():
+            raise ValueError(f"运行已存在: {branch.run_dir}")
+        branch.create(novel_dir, parent=self.run_id, forked_at=seq)
+        for s in self.sequences():
+            if s <= seq:
+                shutil.copy2(self._path(s), branch._path(s))
+
+        os.makedirs(novel_dir, exist_ok=True)
+        chapters = []
+        for chapter in source["state"].get("chapters", []):
+            target = os.path.join(novel_dir, os.path.basename(chapter))
+            if os.path.exists(chapter) and os.path.abspath(chapter) != os.path.abspath(target):
+                shutil.copy2(chapter, target)
+                # 该章之后的故事梗概一并复制，分支从同一梗概继续
+                if os.path.exists(summary_path(chapter)):
+                    os.makedirs(os.path.dirname(summary_path(target)), exist_ok=True)
+                    shutil.copy2(summary_path(chapter), summary_path(target))
+            chapters.append(target)
+        # 章节路径改为新目录，写入新的检查点作为分支起点
+        def relocate(path):
+            return os.path.join(novel_dir, os.path.basename(path)) if path else path
+        state = dict(source["state"], chapters=chapters)
+        state["pending_chapters"] = [dict(item, chapter_path=relocate(item["chapter_path"]))
+                                     for item in state.get("pending_chapters", [])]
+        state["last_chapter_path"] = relocate(state.get("last_chapter_path"))
+        if not state.get("chapter_scheduled"):
+            # 尚未调度的章节在新目录中重新分配编号
+            state.pop("chapter_path", None)
+        branch.save(source["step"], state, source["snapshot"])
+        print(f"[检查点] 已从 {self.run_id}#{seq} 分出新运行 {new_run_id}")
+        return branch
+
+
+def list_runs(root: str = CHECKPOINT_DIR) -> List[str]:
+    if not os.path.isdir(root):
+        return []
+    return sorted(d for d in os.listdir(root) if os.path.exists(os.path.join(root, d, RUN_META_NAME)))
+
+
+def latest_run(root: str = CHECKPOINT_DIR) -> str:
+    """
+    返回最近创建的运行 ID。
+    """
+    runs = list_runs(root)
+    if not runs:
+        raise FileNotFoundError(f"没有可恢复的运行: {root}")
+    return max(runs, key=lambda run_id: CheckpointStore(run_id, root).meta()["created"])
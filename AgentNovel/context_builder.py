@@ -0,0 +1,186 @@
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Tuple
+
+# 各调用点的提示上下文 token 预算（不含提示中的固定说明文字）
+CONTEXT_BUDGETS = {
+    "env-gen": 3000,
+    "env-check": 2000,
+    "ending-check": 1500,
+    "chapter": 4000,
+}
+DEFAULT_BUDGET = 3000
+# 环境中保留的最近事件条数
+RECENT_EVENTS_KEEP = 5
+# 大纲摘要中单个字段的最大字符数
+OUTLINE_FIELD_MAX_CHARS = 300
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+_TRUNCATED_MARK = "…（已截断）"
+
+_outline_cache: Dict[str, Tuple[float, dict]] = {}
+_stats: Dict[str, Dict[str, int]] = {}
+_lock = threading.Lock()
+
+
+def compact_json(data: Any) -> str:
+    """
+    不带缩进、不转义中文的紧凑 JSON。
+    """
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def count_tokens(text: str) -> int:
+    """
+    离线估算 token 数：中文字符约 0.6 token / 字，其余字符约 4 字符 / token。
+    只用于预算控制和日志，不要求与服务端计数完全一致。
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return int(cjk * 0.6 + (len(text) - cjk) / 4) + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    保留文本开头，截断到 max_tokens 以内。
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) + count_tokens(_TRUNCATED_MARK) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + _TRUNCATED_MARK
+
+
+def trim_environment(environment: Any, keep_events: int = RECENT_EVENTS_KEEP) -> dict:
+    """
+    返回环境字典的副本，只保留最近 keep_events 条 recent_events。
+    :param environment: 环境字典或 Environment 对象
+    """
+    data = dict(environment if isinstance(environment, dict) else vars(environment))
+    events = data.get("recent_events")
+    if isinstance(events, list) and len(events) > keep_events:
+        data["recent_events"] = events[-keep_events:]
+    return data
+
+
+def _shorten(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > OUTLINE_FIELD_MAX_CHARS:
+        return value[:OUTLINE_FIELD_MAX_CHARS] + _TRUNCATED_MARK
+    if isinstance(value, dict):
+        return {k: _shorten(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_shorten(v) for v in value]
+    return value
+
+
+def outline_digest(outline_path: str) -> dict:
+    """
+    读取大纲并生成摘要：保留标题、类型、风格、世界观、主题、背景、主要角色概要（含人物关系）与结局，
+    过长字段截断。按文件 mtime 缓存，大纲未修改时不重复读取。
+    """
+    mtime = os.path.getmtime(outline_path)
+    with _lock:
+        cached = _outline_cache.get(outline_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+    with open(outline_path, "r", encoding="utf-8") as f:
+        outline = json.load(f)
+    characters = []
+    for c in outline.get("main characters", []):
+        character = {k: c.get(k) for k in ("name", "personality", "role") if k in c}
+        # 人物关系决定角色之间的互动和冲突，与背景一样截断保留
+        if c.get("relationships"):
+            character["relationships"] = _shorten(c["relationships"])
+        characters.append(character)
+    digest = {
+        "title": outline.get("title"),
+        "genre": outline.get("genre"),
+        "style": outline.get("style"),
+        # 世界观约束环境生成和结局判断（时代、社会设定），摘要是这些调用看到的唯一大纲内容
+        "worldview": _shorten(outline.get("worldview")),
+        "theme": outline.get("theme"),
+        "background": _shorten(outline.get("background")),
+        "main characters": characters,
+        # 结局是判断和生成的核心依据，不截断
+        "ending": outline.get("ending"),
+    }
+    digest = {k: v for k, v in digest.items() if v}
+    with _lock:
+        _outline_cache[outline_path] = (mtime, digest)
+    return digest
+
+
+def novel_prefix(outline_path: str) -> str:
+    """
+    整部小说共用的 system 前缀：大纲摘要。大纲不变时逐字节相同，
+    环境生成、环境目标判断和结局判断共享同一段服务端前缀缓存。
+    """
+    return (
+        "你是一个协助创作长篇小说的助手。以下是这部小说的大纲摘要：\n"
+        f"{compact_json(outline_digest(outline_path))}"
+    )
+
+
+def character_prefix(agent: Any) -> str:
+    """
+    单个角色的 system 前缀：只包含不随剧情变化的设定（姓名、性格、职业）。
+    健康状态、扮演的角色、记忆等会被角色更新改写，放在用户消息中。
+    """
+    return (
+        f"你是小说中的角色「{agent.name}」，性格：{agent.personality}，职业：{agent.profession}。"
+        "请始终以该角色的身份思考和回答。"
+    )
+
+
+def render_sections(call_site: str, sections: List[Tuple[str, Any]]) -> Dict[str, str]:
+    """
+    把各段上下文渲染为紧凑文本，并按调用点预算截断。
+    sections 按重要性从高到低排列，超出预算时从最后一段开始截断。
+
+    :param call_site: 调用点名称，对应 CONTEXT_BUDGETS 中的键
+    :param sections: [(段名, 内容)]，内容为字符串或可序列化对象
+    :return: {段名: 渲染后的文本}
+    """
+    budget = CONTEXT_BUDGETS.get(call_site, DEFAULT_BUDGET)
+    rendered = [(name, value if isinstance(value, str) else compact_json(value)) for name, value in sections]
+    tokens = [count_tokens(text) for _, text in rendered]
+    overflow = sum(tokens) - budget
+    for i in range(len(rendered) - 1, -1, -1):
+        if overflow <= 0:
+            break
+        name, text = rendered[i]
+        # 每段至少保留 1/8 预算，避免整段被清空
+        keep = max(tokens[i] - overflow, budget // 8)
+        if keep < tokens[i]:
+            rendered[i] = (name, truncate_to_tokens(text, keep))
+            overflow -= tokens[i] - count_tokens(rendered[i][1])
+    return dict(rendered)
+
+
+def log_prompt_size(call_site: str, prompt: str) -> int:
+    """
+    记录并打印提示大小，返回估算的 token 数。
+    """
+    tokens = count_tokens(prompt)
+    with _lock:
+        stat = _stats.setdefault(call_site, {"calls": 0, "tokens": 0, "max_tokens": 0})
+        stat["calls"] += 1
+        stat["tokens"] += tokens
+        stat["max_tokens"] = max(stat["max_tokens"], tokens)
+    print(f"[上下文] {call_site}: 约 {tokens} tokens（{len(prompt)} 字符）")
+    return tokens
+
+
+def prompt_size_stats() -> Dict[str, Dict[str, int]]:
+    """
+    返回各调用点的提示大小统计。
+    """
+    with _lock:
+        return {k: dict(v) for k, v in _stats.items()}
@@ -1,28 +1,120 @@
-import torch
-from LLM_DNF_Novel.mark import score_goal_and_plan, load_trained_model
-from LLM_DNF_Novel.models import llm_extractor
+import os
+from concurrent.futures import ThreadPoolExecutor
+from LLM_DNF_Novel import mark
+from LLM_DNF_Novel.mark import (
+    score_goal_and_plan, score_logic_atoms_batch, load_trained_model,
+    get_scoring_rules, scoring_features, SCORE_CLASS
+)
+from LLM_DNF_Novel.models import llm_extractor as llm_extractor_module
+from LLM_DNF_Novel.models.lazy_evaluator import LazyPredicateEvaluator, PredicateStats, PREDICATE_STATS_PATH
+from LLM_DNF_Novel.utils import dataset
+from llm_trace import submit_with_context
 
-def evaluate_decisions(decisions, llm_extractor,background):
+GOAL_PREDICATE_SET = ["p1","p2","p3","p4","p5"]
+PLAN_PREDICATE_SET = ["p6","p7","p8","p9","p10"]
+# 谓词提取方式（见 evaluate_decisions），可由环境变量或 main.py 的 --scoring 指定
+SCORING_STRATEGIES = ("batch", "lazy", "full")
+SCORING_STRATEGY = os.environ.get("DNF_SCORING_STRATEGY", "batch")
+
+def _scoring_device():
     """
-    对一组决策进行评分，并选出评分最高的决策。
-    
-    :param decisions: 决策列表，每个决策包含 "goal" 和 "plan"。
-    :param llm_extractor: LLM 提取器实例。
-    :param predicate_set: 谓词集合，用于特征转换。
-    :param model: 训练过的 DNF 模型。
-    :param device: 设备（CPU 或 GPU）。
-    :return: 包含每条决策评分的列表，以及评分最高的决策和分数。
+    只有选用 torch 评分后端时才导入 torch 并选择设备，numpy 后端不需要设备。
+    """
+    if mark.SCORER_BACKEND != "torch":
+        return None
+    import torch
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+def _evaluate_lazily(decisions, llm_extractor, digest):
+    """
+    按 DNF 规则结构惰性询问谓词，各候选决策并发评估。
     """
+    stats = PredicateStats(PREDICATE_STATS_PATH)
+    conjunctions, disjunctions = get_scoring_rules()
+    evaluator = LazyPredicateEvaluator(
+        llm_extractor, conjunctions, disjunctions,
+        GOAL_PREDICATE_SET + PLAN_PREDICATE_SET, target_classes=(SCORE_CLASS,), stats=stats
+    )
+    with ThreadPoolExecutor(max_workers=max(1, len(decisions))) as executor:
+        futures = [submit_with_context(executor, evaluator.evaluate, d["goal"], d["plan"], digest) for d in decisions]
+        results = [f.result() for f in futures]
+    stats.save()
+    print(f"惰性谓词评估合计：LLM 调用 {evaluator.llm_calls} 次，本地判断 {evaluator.local} 次，"
+          f"跳过 {evaluator.skipped} 次")
+    return [(goal_atoms, plan_atoms) for goal_atoms, plan_atoms, _ in results]
+
+def _atoms_to_vector(goal_atoms, plan_atoms):
+    # 评分数据集中的谓词向量：未询问或请求失败的谓词记为 None（训练时跳过该样本，
+    # 完整样本来自未使用训练规则时的评分和 dataset.EXPLORE_RATE 抽样）
+    answers = {**goal_atoms, **plan_atoms}
+    return [{"true": 1, "false": 0}.get(answers.get(key)) for key in GOAL_PREDICATE_SET + PLAN_PREDICATE_SET]
+
+def _score_decisions(decisions, llm_extractor, background, strategy=None):
+    """
+    对一组决策评分，返回 [(决策, 评分)]。strategy 的含义见 evaluate_decisions，默认为 SCORING_STRATEGY。
+    """
+    strategy = strategy or SCORING_STRATEGY
     decision_scores = []
-    for decision in decisions:
-        goal = decision["goal"]
-        plan = decision["plan"]
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        goal_predicate_set = ["p1","p2","p3","p4","p5"]  
-        plan_predicate_set = ["p6","p7","p8","p9","p10"]
-        score = score_goal_and_plan(goal, plan, llm_extractor, goal_predicate_set, plan_predicate_set, device,background)
-        decision_scores.append((decision, score))
+    device = _scoring_device()
+    if strategy in ("batch", "lazy"):
+        # 背景摘要每轮只生成一次
+        digest = llm_extractor_module.build_background_digest(background)
+        # 按 dataset.EXPLORE_RATE 抽取的决策询问全部谓词，保证之后的样本仍可用于重新训练
+        explore = [dataset.should_explore(d) for d in decisions]
+        if strategy == "batch":
+            # 只询问评分规则中出现的谓词（训练剪枝后的谓词不再请求）
+            predicates = GOAL_PREDICATE_SET + PLAN_PREDICATE_SET
+            keys = [predicates[f] for f in scoring_features()]
+            atoms = llm_extractor.extract_decisions_batch(
+                decisions, digest, decision_keys=[None if e else keys for e in explore])
+        else:
+            # 惰性评估会提前停止，抽中的决策改用批量请求询问全部谓词
+            atoms = [None] * len(decisions)
+            lazy = [i for i, e in enumerate(explore) if not e]
+            full = [i for i, e in enumerate(explore) if e]
+            if lazy:
+                for i, a in zip(lazy, _evaluate_lazily([decisions[i] for i in lazy], llm_extractor, digest)):
+                    atoms[i] = a
+            if full:
+                for i, a in zip(full, llm_extractor.extract_decisions_batch([decisions[i] for i in full], digest)):
+                    atoms[i] = a
+        # 记录谓词向量，补充结果标签后可用于训练评分规则（见 LLM_DNF_Novel/train_model.py）
+        dataset.log_vectors(decisions, [_atoms_to_vector(g, p) for g, p in atoms],
+                            GOAL_PREDICATE_SET + PLAN_PREDICATE_SET)
+        # 所有候选决策一次前向计算完成评分
+        scores = score_logic_atoms_batch(atoms, GOAL_PREDICATE_SET, PLAN_PREDICATE_SET, device)
+        decision_scores = list(zip(decisions, scores))
+    elif strategy == "full":
+        for decision in decisions:
+            goal = decision["goal"]
+            plan = decision["plan"]
+            score = score_goal_and_plan(goal, plan, llm_extractor, GOAL_PREDICATE_SET, PLAN_PREDICATE_SET, device,background)
+            decision_scores.append((decision, score))
+    else:
+        raise ValueError(f"未知的谓词提取方式: {strategy}")
+    return decision_scores
+
+def score_decision(decision, llm_extractor, background, strategy=None):
+    """
+    对单条决策评分（自适应轮数时每轮合并决策生成后立即评分）。
+
+    :param decision: 包含 "goal" 和 "plan" 的决策。
+    :param llm_extractor: LLM 提取器实例。
+    :param background: 背景信息（环境与角色信息）。
+    :param strategy: 谓词提取方式，同 evaluate_decisions。
+    :return: 评分
+    """
+    score = _score_decisions([decision], llm_extractor, background, strategy)[0][1]
+    print(f"Decision: {decision}, Score: {score}")
+    return score
 
+def select_best(decision_scores):
+    """
+    输出每条决策的评分并选出评分最高的决策。
+
+    :param decision_scores: [(决策, 评分)]
+    :return: 评分最高的决策和分数。
+    """
     # 输出每条决策的评分
     for i, (decision, score) in enumerate(decision_scores):
         print(f"Decision {i + 1}: {decision}, Score: {score}")
@@ -30,7 +122,24 @@ def evaluate_decisions(decisions, llm_extractor,background):
     # 选出评分最高的决策
     best_decision, best_score = max(decision_scores, key=lambda x: x[1])
     print(f"\nBest Decision: {best_decision}, Score: {best_score}")
+    return best_decision, best_score
 
+def evaluate_decisions(decisions, llm_extractor,background, strategy=None):
+    """
+    对一组决策进行评分，并选出评分最高的决策。
+    
+    :param decisions: 决策列表，每个决策包含 "goal" 和 "plan"。
+    :param llm_extractor: LLM 提取器实例。
+    :param background: 背景信息（环境与角色信息）。
+    :param strategy: 谓词提取方式：
+        "batch" 用一次请求判断所有候选决策的全部谓词；
+        "lazy" 按规则结构逐个询问，类别输出确定后即停止；
+        "full" 对每个谓词单独请求。
+        默认为 SCORING_STRATEGY。
+    :return: 包含每条决策评分的列表，以及评分最高的决策和分数。
+    """
+    decision_scores = _score_decisions(decisions, llm_extractor, background, strategy)
+    best_decision, best_score = select_best(decision_scores)
     return decision_scores, best_decision, best_score
 
 
@@ -6,6 +6,31 @@ from typing import Dict, List
 from agents.roles.BaseCharacter import CharacterAgent
 from agents.roles.character_registry import get_all_characters
 from llm import get_response_from_llm
+from structured_output import request_json
+import context_builder
+import scene_store
+
+# 新场景（env-gen 返回内容）的结构
+ENVIRONMENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "scene_id": {"type": "string"},
+        "location": {"type": "string"},
+        "event": {"type": "string"},
+        "weather": {"type": "string"},
+        "atmosphere": {"type": "string"},
+        "writing_style": {"type": "string"},
+        "recent_events": {"type": "array", "items": {"type": "string"}},
+        "involved_characters": {"type": "array", "items": {"type": "string"}},
+        "long_term_goal": {"type": ["object", "string"]},
+        "current_interaction_goal": {"type": "object"},
+        "environment_goal": {"type": "object"},
+    },
+    "required": [
+        "scene_id", "location", "event", "weather", "atmosphere", "writing_style", "recent_events",
+        "involved_characters", "long_term_goal", "current_interaction_goal", "environment_goal",
+    ],
+}
 
 class Environment:
     def __init__(
@@ -48,13 +73,10 @@ class Environment:
 
 
 def load_environment_by_scene_id(scene_id: str, base_path: str = "resources/environment") -> Environment:
-    filename = f"{scene_id}.json"
-    filepath = os.path.join(base_path, filename)
-    if not os.path.exists(filepath):
-        raise FileNotFoundError(f"环境文件不存在: {filepath}")
-    return Environment.from_json_file(filepath)
+    # 场景存储按文件 mtime 缓存解析结果，每次返回独立的 Environment 对象
+    return Environment(**scene_store.get_store(base_path).load_data(scene_id))
 
-def update_environment_by_scene_id(scene_id: str, environment: Environment, base_path: str = "resources/environment", outline_path: str = "resources/outline/outline.json") -> None:
+def update_environment_by_scene_id(scene_id: str, environment: Environment, base_path: str = "resources/environment", outline_path: str = "resources/outline/outline.json", story_so_far: str = "") -> str:
     """
     更新环境文件，并生成一个新的环境文件，ID 比当前最大的序号大 1。
     
@@ -63,21 +85,31 @@ def update_environment_by_scene_id(scene_id: str, environment: Environment, base
         environment: 当前环境对象。
         base_path: 环境文件存储路径。
         outline_path: 大纲文件路径。
+        story_so_far: 此前章节的故事梗概（见 story_summary），为空时不加入提示。
+    返回:
+        新场景 ID。
     """
-    filename = f"{scene_id}.json"
-    filepath = os.path.join(base_path, filename)
-    if not os.path.exists(filepath):
-        raise FileNotFoundError(f"环境文件不存在: {filepath}")
-    
+    store = scene_store.get_store(base_path)
+
     # 加载最新结束环境文件
-    with open(filepath, "r", encoding="utf-8") as f:
-        latest_environment_data = json.load(f)
+    latest_environment_data = store.load_data(scene_id)
     
-    # 加载大纲文件
+    # 加载大纲摘要（按文件修改时间缓存）
     if not os.path.exists(outline_path):
         raise FileNotFoundError(f"大纲文件不存在: {outline_path}")
-    with open(outline_path, "r", encoding="utf-8") as f:
-        outline_data = json.load(f)
+    # 大纲摘要作为稳定的 system 前缀，不参与预算截断
+    system = context_builder.novel_prefix(outline_path)
+
+    # 按预算渲染上下文：最新环境最重要，其次是决策和故事梗概
+    context = context_builder.render_sections("env-gen", [
+        ("environment", context_builder.trim_environment(latest_environment_data)),
+        ("decision", context_builder.trim_environment(environment)),
+        ("story_so_far", story_so_far),
+    ])
+    story_section = f"""
+    此前章节的故事梗概如下：
+    {context["story_so_far"]}
+""" if story_so_far else ""
     
     # 提取 scene_id 的数字部分并递增
     match = re.search(r'\d+', scene_id)
@@ -86,9 +118,9 @@ def update_environment_by_scene_id(scene_id: str, environment: Environment, base
     new_scene_number = int(match.group()) + 1
     new_scene_id = f"scene_{new_scene_number:03d}"
 
-    # 构造 LLM 提示
+    # 构造 LLM 提示：固定说明在前，最新环境、决策和新场景 ID 在后
     prompt = f"""
-    你是一个小说环境生成助手。以下是当前最新结束的环境信息、大纲信息和最佳决策，请根据这些信息生成一个新的环境。
+    你是一个小说环境生成助手。以下是当前最新结束的环境信息和最佳决策，请结合上文的大纲生成一个新的环境。
     新的环境要满足以下目标：
     1. 满足 小说的逻辑发展。
     2. 满足 小说的情节发展。
@@ -98,38 +130,32 @@ def update_environment_by_scene_id(scene_id: str, environment: Environment, base
     6. 新环境要满足文学传作需求，即要有一定的文学性和情感深度。
     7. 新环境要有一定的悬念和冲突，以吸引读者的注意力。
     需要你完成以下任务：
-    1. 根据最新环境信息，生成一个新的场景，场景 ID 为 {new_scene_id}。
+    1. 根据最新环境信息，生成一个新的场景，场景 ID 在最后给出。
     2. 新的场景需要在逻辑上与最新环境和最佳决策对最新环境造成的影响保持一致。
     3. 请确保生成的 JSON 格式与以下环境格式一致。
     返回内容仅包含如下部分（json格式）：
     scene_id、location、event、weather、atmosphere、writing_style、recent_events、involved_characters、long_term_goal、current_interaction_goal、environment_goal 
+    {story_section}
     最新环境信息如下：
-    {json.dumps(latest_environment_data, ensure_ascii=False, indent=2)}
-
-    大纲信息如下：
-    {json.dumps(outline_data, ensure_ascii=False, indent=2)}
+    {context["environment"]}
 
     最佳决策如下：
-    {json.dumps(environment.__dict__, ensure_ascii=False, indent=2)}
+    {context["decision"]}
+
+    新场景的场景 ID 为 {new_scene_id}。
 """
+    context_builder.log_prompt_size("env-gen", prompt)
 
     # 调用大模型生成新环境
-    llm_response = get_response_from_llm(prompt)
-    llm_response_clean = llm_response.strip()
-    if llm_response_clean.startswith("```json"):
-        llm_response_clean = llm_response_clean.strip("```json").strip("```").strip()
-
-    try:
-        new_environment_data = json.loads(llm_response_clean)
-    except json.JSONDecodeError:
-        raise ValueError("大模型返回的内容无法解析为 JSON 格式，请检查提示或返回内容。")
+    # JSON 模式请求，本地修复常见格式问题，仍不合格时请求修正；最终失败抛出 ValueError
+    new_environment_data = request_json(prompt, ENVIRONMENT_SCHEMA, call_site="env-gen", system=system)
+    new_environment_data["scene_id"] = new_scene_id
     
     # 保存新的环境文件
-    new_filepath = os.path.join(base_path, f"{new_scene_id}.json")
-    with open(new_filepath, "w", encoding="utf-8") as f:
-        json.dump(new_environment_data, f, ensure_ascii=False, indent=4)
+    new_filepath = store.save(new_scene_id, new_environment_data)
     
     print(f"新的环境文件已生成: {new_filepath}")
+    return new_scene_id
 
 def broadcast_to_characters(self, agents: Dict[str, CharacterAgent]) -> None:
     """
@@ -160,15 +186,17 @@ def check_environment_goal_completion(best: dict, environment: dict, outline_pat
     """
     if not os.path.exists(outline_path):
         raise FileNotFoundError(f"大纲文件不存在: {outline_path}")
-    with open(outline_path, "r", encoding="utf-8") as f:
-        outline_data = json.load(f)
+    context = context_builder.render_sections("env-check", [
+        ("best", best),
+        ("environment", context_builder.trim_environment(environment)),
+    ])
     
     # 构造 LLM 提示
     prompt = f"""
     你是一个小说环境目标判断助手，负责基于小说当前进展判断环境目标是否已经完成。
 
     请你完成以下任务：
-    1. 阅读当前环境的环境目标（environment_goal），结合角色的最佳决策（即他们对当前环境的行为计划）与整部小说的大纲（包含主线目标与发展逻辑），判断该环境目标是否已经实现。
+    1. 阅读当前环境的环境目标（environment_goal），结合角色的最佳决策（即他们对当前环境的行为计划）与上文整部小说的大纲（包含主线目标与发展逻辑），判断该环境目标是否已经实现。
     2. 若当前环境目标已实现（即角色的行为已促成环境目标达成），请返回字符串："已完成"。
     3. 若尚未实现，请返回字符串："未完成"。
     4. 请只返回判断结果，不要解释说明。
@@ -180,17 +208,16 @@ def check_environment_goal_completion(best: dict, environment: dict, outline_pat
     - 你可以参考大纲中的主线目标和发展逻辑来辅助判断。  
 
     角色的最佳决策如下：
-    {json.dumps(best, ensure_ascii=False, indent=2)}
+    {context["best"]}
 
     当前环境信息如下：
-    {json.dumps(environment, ensure_ascii=False, indent=2)}
-
-    小说大纲如下：
-    {json.dumps(outline_data, ensure_ascii=False, indent=2)}
+    {context["environment"]}
     """
+    context_builder.log_prompt_size("env-check", prompt)
 
     # 调用大模型
-    llm_response = get_response_from_llm(prompt)
+    llm_response = get_response_from_llm(prompt, cache=True, call_site="env-check",
+                                         system=context_builder.novel_prefix(outline_path))
     result = llm_response.strip()  
 
     # 验证返回结果是否符合预期
@@ -0,0 +1,37 @@
+import json
+import os
+import tempfile
+
+
+def atomic_write_text(path: str, text: str) -> None:
+    """
+    先写入同目录下的临时文件，再原子替换目标文件，避免中断时留下半个文件。
+
+    :param path: 目标文件路径
+    :param text: 文件内容
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    # 临时文件以 .tmp 结尾，不会被按 .json / .txt 扫描目录的代码误读
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path: str, data, indent: int = 4) -> None:
+    """
+    以原子方式写入 JSON 文件。
+
+    :param path: 目标文件路径
+    :param data: 可序列化的数据
+    :param indent: 缩进
+    """
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=indent))
@@ -1,32 +1,252 @@
-import re
 from LLM_DNF_Novel.models import llm_extractor
 from agents.tools.memory import update_character_info
-from decision import evaluate_decisions
+from decision import evaluate_decisions, score_decision, select_best
 import environment as env_module
 import agents.roles.character_registry as character_registry
 import json
 import os
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
 from agents.roles.BaseCharacter import CharacterAgent
-from llm import get_response_from_llm
+from llm import LLMError, get_response_from_llm, get_call_stats
+from llm_trace import submit_with_context, trace_context
 from agents.tools.merge import merge_decisions
 from write import generate_novel_from_decision  #合并决策的工具函数
+from scene_store import get_latest_scene_file
 
-def get_latest_scene_file(directory: str) -> str:
+# 自适应轮数的默认配置
+# 最佳决策评分达到该值即停止（当前评分规则的输出为 0 或 1）
+ADAPTIVE_SCORE_THRESHOLD = 1.0
+# 最佳评分低于该值时视为质量不足，可以超出目标轮数继续（仅在设置了调用预算 max_calls 时生效，
+# 否则评分始终为 0 的迭代会一直跑到 max_rounds）
+ADAPTIVE_MIN_SCORE = 0.5
+# 评分连续多少轮没有提升即停止
+ADAPTIVE_PATIENCE = 1
+# 最多轮数，以及决策阶段（含评分）的 API 调用预算（None 表示不限）
+ADAPTIVE_MAX_ROUNDS = 6
+ADAPTIVE_MAX_CALLS = None
+
+def _initial_decision(name: str, agent: CharacterAgent, environment) -> Dict[str, str]:
+    """
+    单个角色的首轮决策：生成目标后基于该目标制定计划。
+    """
+    goal = agent.generate_goal_with_cot(agent, environment.__dict__)
+    agent.goal.append(goal)  # 将生成的目标添加到 agent 的 goal 属性中
+
+    plan = agent.plan_with_cot(agent, environment.__dict__)
+    return {
+        "agent_name": name,
+        "goal": goal,
+        "plan": plan
+    }
+
+
+def _next_decision(name: str, agent: CharacterAgent, environment, merged_decision: Dict[str, str]) -> Dict[str, str]:
+    """
+    单个角色的后续轮决策：结合 agent 自身、environment 和上一轮的决策内容进行新一轮决策。
+    """
+    context = {
+        "environment": environment.__dict__,  # 包含环境信息
+        "previous_decision": merged_decision  # 上一轮的合并决策
+    }
+    new_goal = agent.generate_goal_with_cot(agent, context)
+    agent.goal = [new_goal]  # 将新目标覆盖原来的 agent 的 goal 属性
+
+    new_plan = agent.plan_with_cot_next(agent, environment.__dict__, merged_decision)
+    return {
+        "agent_name": name,
+        "goal": new_goal,
+        "plan": new_plan
+    }
+
+
+def _fan_out(executor: ThreadPoolExecutor, fn, agents: Dict[str, CharacterAgent], *args) -> List[Dict[str, str]]:
+    """
+    同一轮内各角色互不依赖，并发执行决策；结果按 agents 的顺序返回。
+    个别角色的 LLM 调用失败时本轮跳过该角色，全部失败时抛出最后一个错误。
+    """
+    def run(name: str, agent: CharacterAgent):
+        with trace_context(agent=name):
+            return fn(name, agent, *args)
+
+    futures = [(name, submit_with_context(executor, run, name, agent)) for name, agent in agents.items()]
+    results, error = [], None
+    for name, future in futures:
+        try:
+            results.append(future.result())
+        except LLMError as e:
+            error = e
+            print(f"角色 {name} 本轮决策失败，跳过: {e}")
+    if not results and error is not None:
+        raise error
+    return results
+
+
+def load_scene(environment_dir: str, character_dir: str, scene_id: Optional[str] = None):
+    """
+    加载场景环境和所有角色，并向角色广播环境信息。
+
+    参数:
+        environment_dir: str，环境文件存储路径。
+        character_dir: str，角色文件存储路径。
+        scene_id: str，场景 ID，默认为最新场景。
+    返回:
+        (environment, agents)
+    """
+    if scene_id is None:
+        # 获取最新的环境文件
+        latest_scene_file = get_latest_scene_file(environment_dir)
+        scene_id = os.path.splitext(os.path.basename(latest_scene_file))[0]
+    environment = env_module.load_environment_by_scene_id(scene_id, environment_dir)
+
+    # 获取所有角色
+    agents = character_registry.get_all_characters(character_dir)
+    env_module.broadcast_to_characters(environment, agents)
+    return environment, agents
+
+
+def _next_round(executor: ThreadPoolExecutor, environment, agents: Dict[str, CharacterAgent],
+                decisions: List[Dict[str, str]]) -> Dict[str, str]:
+    """
+    进行一轮决策并返回合并决策；decisions 为已完成轮次的合并决策。
     """
-    从指定目录中获取命名中数字最大的 JSON 文件。
-    :param directory: 文件所在目录
-    :return: 数字最大的 JSON 文件路径
+    with trace_context(round=len(decisions) + 1):
+        if not decisions:
+            # 初始决策
+            return merge_decisions(_fan_out(executor, _initial_decision, agents, environment))
+        # 后续多轮决策
+        print(f"\n=== Round {len(decisions) + 1} ===")
+        return merge_decisions(_fan_out(executor, _next_decision, agents, environment, decisions[-1]))
+
+
+def run_rounds(environment, agents: Dict[str, CharacterAgent], num_rounds: int = 3, max_workers: int = 4,
+               decisions: Optional[List[Dict[str, str]]] = None,
+               on_round: Optional[Callable[[List[Dict[str, str]]], None]] = None) -> List[Dict[str, str]]:
+    """
+    进行多轮决策，返回每轮的合并决策。
+
+    参数:
+        environment: 当前环境对象。
+        agents: 角色字典。
+        num_rounds: int，决策轮数。
+        max_workers: int，每轮并发生成角色决策的最大线程数。
+        decisions: 已完成轮次的合并决策（从检查点恢复时），从下一轮继续。
+        on_round: 每轮结束后的回调，参数为截至该轮的合并决策列表。
+    """
+    decisions = list(decisions or [])
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while len(decisions) < num_rounds:
+            decisions.append(_next_round(executor, environment, agents, decisions))
+            if on_round is not None:
+                on_round(decisions)
+    return decisions
+
+
+class RoundBudget:
     """
-    files = [f for f in os.listdir(directory) if f.endswith(".json")]
-    # 提取文件名中的数字并排序
-    files_with_numbers = [(f, int(re.search(r'\d+', f).group())) for f in files if re.search(r'\d+', f)]
-    latest_file = max(files_with_numbers, key=lambda x: x[1])[0]
-    return os.path.join(directory, latest_file)
+    自适应决策轮数：每轮合并决策生成后立即评分，按以下顺序判断是否停止：
+
+      1. 最佳评分达到 threshold，停止；
+      2. 达到 max_rounds 轮，或按平均每轮调用数估计下一轮会超出 max_calls，停止；
+      3. 设置了 max_calls 且最佳评分低于 min_score（质量不足），继续，可以超出 target_rounds；
+      4. 连续 patience 轮评分没有提升，停止；
+      5. 达到 target_rounds 轮，停止。
+    """
+    def __init__(self, target_rounds: int = 3, threshold: float = ADAPTIVE_SCORE_THRESHOLD,
+                 min_score: float = ADAPTIVE_MIN_SCORE, patience: int = ADAPTIVE_PATIENCE,
+                 max_rounds: int = ADAPTIVE_MAX_ROUNDS, max_calls: Optional[int] = ADAPTIVE_MAX_CALLS):
+        if max_rounds < 1:
+            raise ValueError(f"max_rounds 至少为 1: {max_rounds}")
+        self.target_rounds = target_rounds
+        self.threshold = threshold
+        self.min_score = min_score
+        self.patience = patience
+        self.max_rounds = max_rounds
+        self.max_calls = max_calls
+
+    def stop_reason(self, scores: List[float], calls_used: int = 0) -> Optional[str]:
+        """
+        根据已完成轮次的评分和已用调用数判断是否停止。
+        :return: 停止原因；继续时返回 None
+        """
+        rounds = len(scores)
+        if rounds == 0:
+            return None
+        best = max(scores)
+        if best >= self.threshold:
+            return f"最佳评分 {best} 达到阈值 {self.threshold}"
+        if rounds >= self.max_rounds:
+            return f"达到最大轮数 {self.max_rounds}"
+        if self.max_calls is not None and calls_used + calls_used / rounds > self.max_calls:
+            return f"调用预算不足（已用 {calls_used}，上限 {self.max_calls}）"
+        if self.max_calls is not None and best < self.min_score:
+            return None
+        best_round = scores.index(best) + 1
+        if rounds - best_round >= self.patience:
+            return f"连续 {rounds - best_round} 轮评分没有提升"
+        if rounds >= self.target_rounds:
+            return f"达到目标轮数 {self.target_rounds}"
+        return None
+
+
+def run_rounds_adaptive(environment, agents: Dict[str, CharacterAgent], scorer: Callable[[Dict[str, str]], float],
+                        budget: RoundBudget, max_workers: int = 4,
+                        decisions: Optional[List[Dict[str, str]]] = None, scores: Optional[List[float]] = None,
+                        calls_used: int = 0,
+                        on_round: Optional[Callable[[List[Dict[str, str]], List[float], int], None]] = None):
+    """
+    按 RoundBudget 自适应地进行多轮决策，每轮合并决策生成后立即评分。
+
+    参数:
+        environment: 当前环境对象。
+        agents: 角色字典。
+        scorer: 对单条合并决策评分的函数。
+        budget: 轮数预算。
+        max_workers: int，每轮并发生成角色决策的最大线程数。
+        decisions / scores / calls_used: 已完成轮次的合并决策、评分和 API 调用数（从检查点恢复时）。
+        on_round: 每轮评分后的回调，参数为 (合并决策列表, 评分列表, 已用调用数)。
+    返回:
+        (decisions, scores)
+    """
+    decisions = list(decisions or [])
+    scores = list(scores or [])
+    # 恢复时补齐尚未评分的决策
+    for round_index in range(len(scores), len(decisions)):
+        with trace_context(round=round_index + 1):
+            scores.append(scorer(decisions[round_index]))
+    start_calls = get_call_stats()["api_calls"]
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while True:
+            used = calls_used + get_call_stats()["api_calls"] - start_calls
+            reason = budget.stop_reason(scores, used)
+            if reason:
+                print(f"[自适应轮数] {len(scores)} 轮后停止：{reason}；各轮评分 {scores}")
+                return decisions, scores
+            decisions.append(_next_round(executor, environment, agents, decisions))
+            with trace_context(round=len(decisions)):
+                scores.append(scorer(decisions[-1]))
+            if on_round is not None:
+                on_round(decisions, scores, calls_used + get_call_stats()["api_calls"] - start_calls)
+
+
+def build_background(environment, agents: Dict[str, CharacterAgent]) -> dict:
+    """
+    构造评分和章节创作使用的背景信息。
+    角色的 environment 属性与 "environment" 重复且无法序列化，不放入 personal_info。
+    """
+    return {
+        "environment": environment.__dict__,
+        "personal_info": {
+            name: {k: v for k, v in agent.__dict__.items() if k != "environment"}
+            for name, agent in agents.items()
+        }
+    }
 
 
 #创建环境
-def run_simulation(environment_dir: str, character_dir: str, outline_path: str, num_rounds: int = 3):
+def run_simulation(environment_dir: str, character_dir: str, outline_path: str, num_rounds: int = 3, max_workers: int = 4,
+                   budget: Optional[RoundBudget] = None, strategy: Optional[str] = None):
     """
     运行模拟环境，进行多轮决策并生成小说内容。
 
@@ -35,66 +255,30 @@ def run_simulation(environment_dir: str, character_dir: str, outline_path: str,
         character_dir: str，角色文件存储路径。
         outline_path: str，大纲文件路径。
         num_rounds: int，决策轮数，默认为 3。
+        max_workers: int，每轮并发生成角色决策的最大线程数，默认为 4。
+        budget: RoundBudget，给出时按评分自适应决定轮数（num_rounds 不再使用）。
+        strategy: str，谓词提取方式（"batch" / "lazy" / "full"），默认为 decision.SCORING_STRATEGY。
     """
-    decisions = []
-    tmp = []
-
-    # 获取最新的环境文件
-    latest_scene_file = get_latest_scene_file(environment_dir)
-    scene_id = os.path.splitext(os.path.basename(latest_scene_file))[0]
-    environment = env_module.load_environment_by_scene_id(scene_id)
+    environment, agents = load_scene(environment_dir, character_dir)
+    llm_extractor_instance = llm_extractor.LLMExtractor()
 
-    # 获取所有角色
-    agents = character_registry.get_all_characters(character_registry.CHARACTER_DIR)
-    env_module.broadcast_to_characters(environment, agents)
+    if budget is not None:
+        def scorer(d):
+            return score_decision(d, llm_extractor_instance, build_background(environment, agents), strategy)
+        decisions, scores = run_rounds_adaptive(environment, agents, scorer, budget, max_workers)
+        backgound = build_background(environment, agents)
+        # 每轮已经评分，直接选出最佳决策
+        decision = select_best(list(zip(decisions, scores)))[0]
+        return decision, environment, agents, backgound
 
-    # 初始决策
-    for name, agent in agents.items():
-        goal = agent.generate_goal_with_cot(agent, environment.__dict__)
-        agent.goal.append(goal)  # 将生成的目标添加到 agent 的 goal 属性中
-
-        plan = agent.plan_with_cot(agent, environment.__dict__)
-        tmp.append({
-            "agent_name": name,
-            "goal": goal,
-            "plan": plan
-        })
-    merged_decision = merge_decisions(tmp)
-    decisions.append(merged_decision)
-
-    # 后续多轮决策
-    for round_num in range(2, num_rounds + 1):
-        print(f"\n=== Round {round_num} ===")
-        tmp_next_round = []
-        for name, agent in agents.items():
-            # 结合 agent 自身、environment 和上一轮的决策内容进行新一轮决策
-            context = {
-                "environment": environment.__dict__,  # 包含环境信息
-                "previous_decision": merged_decision  # 上一轮的合并决策
-            }
-            new_goal = agent.generate_goal_with_cot(agent, context)
-            agent.goal = [new_goal]  # 将新目标覆盖原来的 agent 的 goal 属性
-
-            new_plan = agent.plan_with_cot_next(agent, environment.__dict__, merged_decision)
-            tmp_next_round.append({
-                "agent_name": name,
-                "goal": new_goal,
-                "plan": new_plan
-            })
-
-        merged_decision = merge_decisions(tmp_next_round)
-        decisions.append(merged_decision)
+    decisions = run_rounds(environment, agents, num_rounds, max_workers)
 
     # 背景信息
-    backgound = {
-        "environment": environment.__dict__,
-        "personal_info": {name: agent.__dict__ for name, agent in agents.items()}
-    }
+    backgound = build_background(environment, agents)
 
     # 提取最佳决策
-    llm_extractor_instance = llm_extractor.LLMExtractor()
-    best = evaluate_decisions(decisions, llm_extractor_instance, backgound)
+    best = evaluate_decisions(decisions, llm_extractor_instance, backgound, strategy)
     decision = best[1]
 
     # 返回结果
-    return decision, environment, agents, backgound
\ No newline at end of file
+    return decision, environment, agents, backgound
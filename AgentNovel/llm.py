@@ -1,34 +1,822 @@
-from openai import OpenAI
+import asyncio
+import atexit
+import contextlib
+import contextvars
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Iterable, Iterator, List, Optional, Union
 
-# 初始化 OpenAI 客户端
-client = OpenAI(api_key="", base_url="https://api.deepseek.com")
+import llm_cache
+import llm_router
+import llm_trace
+import rate_limit
 
-def get_response_from_llm(prompt: str) -> str:
+# 接口配置
+API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
+BASE_URL = os.environ.get("LLM_BASE_URL", "https://api.deepseek.com")
+# 默认模型；各调用点实际使用的模型和采样参数见 llm_router
+MODEL = llm_router.DEFAULT_MODEL
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+# 全局同时在途请求上限，以及连接池大小
+MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+KEEPALIVE_EXPIRY = 60.0
+
+# 单次请求的超时（秒），按调用点名称前缀匹配（最长前缀优先），未列出的使用 DEFAULT_TIMEOUT
+CALL_SITE_TIMEOUTS = {
+    "predicate": 30.0,
+    "env-check": 30.0,
+    "ending-check": 30.0,
+    "goal": 60.0,
+    "plan": 90.0,
+    "merge": 90.0,
+    "env-gen": 120.0,
+    "character-update": 120.0,
+    "story-summary": 120.0,
+    "chapter": 300.0,
+}
+DEFAULT_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "120"))
+# 流式请求两个片段之间的最长等待（秒）
+STREAM_IDLE_TIMEOUT = 60.0
+# 超时、5xx、连接错误和 429 的最大重试次数；指数退避的基数和上限（秒）
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+# 熔断：连续失败（超时、5xx、连接错误）达到阈值后，冷却期内的请求直接失败
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN = 30.0
+# 对冲请求：短调用在途时间超过该调用点近期的 p95 延迟后，再发一份相同请求，取先返回者
+HEDGE_ENABLED = os.environ.get("LLM_HEDGE", "0") == "1"
+# 调用点前缀 -> 延迟统计分组。输出很短的判断类调用延迟相近，共用一组样本，
+# 否则每次迭代只调用一次的 env-check / ending-check 很难积累到足够的样本
+HEDGE_CALL_SITES = {
+    "predicate-batch": "predicate-batch",
+    "predicate-p": "short",
+    "predicate-fallback": "short",
+    "env-check": "short",
+    "ending-check": "short",
+}
+HEDGE_PERCENTILE = 0.95
+# 分组样本数达到 HEDGE_MIN_SAMPLES 后按 p95 对冲，之前按 HEDGE_COLD_DELAYS 的固定等待时间（秒）对冲；
+# 每组保留最近 LATENCY_WINDOW 次的延迟（只在进程内统计）
+HEDGE_MIN_SAMPLES = 5
+HEDGE_COLD_DELAYS = {"short": 3.0, "predicate-batch": 10.0}
+LATENCY_WINDOW = 200
+
+
+class LLMError(RuntimeError):
     """
-    调用 LLM 接口，传入 prompt，返回模型的回答。
+    LLM 调用失败。call_site 为调用点，attempts 为已尝试的次数。
+    """
+    def __init__(self, message: str, call_site: Optional[str] = None, attempts: int = 1,
+                 status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.call_site = call_site
+        self.attempts = attempts
+        self.status_code = status_code
+        self.retry_after = retry_after
 
-    :param prompt: 用户输入的提示文本
-    :return: 模型生成的回答
+
+class LLMTimeoutError(LLMError):
+    """单次请求超过调用点的超时时间。"""
+
+
+class LLMDeadlineExceeded(LLMTimeoutError):
+    """超过调用方设定的截止时间（见 deadline），不再重试。"""
+
+
+class LLMRateLimitError(LLMError):
+    """被限流（429）。"""
+
+
+class LLMServerError(LLMError):
+    """服务端错误（5xx）或连接失败。"""
+
+
+class LLMCircuitOpenError(LLMError):
+    """熔断期间请求直接失败。"""
+
+
+class LLMResponseError(LLMError):
+    """请求被拒绝（其余 4xx）或返回结果无效，重试无益。"""
+
+
+def is_retryable(error: BaseException) -> bool:
     """
+    超时（截止时间除外）、限流、服务端和连接错误可以重试。
+    """
+    return (isinstance(error, (LLMTimeoutError, LLMRateLimitError, LLMServerError))
+            and not isinstance(error, LLMDeadlineExceeded))
+
+
+def retry_delay(error: BaseException, attempt: int) -> float:
+    """
+    第 attempt 次重试（从 0 开始）前的等待时间：指数退避加完全抖动，429 时不短于 Retry-After。
+    """
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    retry_after = getattr(error, "retry_after", None)
+    return max(delay, retry_after) if retry_after else delay
+
+
+def _site_timeout(call_site: Optional[str]) -> float:
+    matches = [site for site in CALL_SITE_TIMEOUTS if call_site and call_site.startswith(site)]
+    return CALL_SITE_TIMEOUTS[max(matches, key=len)] if matches else DEFAULT_TIMEOUT
+
+
+def _hedge_group(call_site: Optional[str]) -> Optional[str]:
+    matches = [site for site in HEDGE_CALL_SITES if call_site and call_site.startswith(site)]
+    return HEDGE_CALL_SITES[max(matches, key=len)] if matches else None
+
+
+# 当前上下文的截止时间（time.monotonic() 时刻），None 表示不限
+_deadline: contextvars.ContextVar = contextvars.ContextVar("llm_deadline", default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds: Optional[float], inherit: bool = True):
+    """
+    为当前上下文中发起的 LLM 调用设置截止时间（从现在起 seconds 秒）。
+    超过后调用抛出 LLMDeadlineExceeded，重试和退避也不会越过截止时间。
+    嵌套时取较早者；inherit=False 时忽略外层的截止时间，seconds 为 None 表示不限。
+    截止时间随 contextvars 传递，线程池任务需通过 llm_trace.submit_with_context 提交。
+    """
+    at = None if seconds is None else time.monotonic() + seconds
+    outer = _deadline.get()
+    if inherit and outer is not None:
+        at = outer if at is None else min(at, outer)
+    token = _deadline.set(at)
     try:
-        # 调用 OpenAI 接口生成回答
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt},
-            ],
-            stream=False
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _time_limit(call_site: Optional[str], deadline_at: Optional[float], timeout: Optional[float] = None):
+    """
+    本次请求可用的时间：调用点超时与截止时间中较早者。
+    :return: (秒数, 是否受截止时间限制)
+    """
+    timeout = _site_timeout(call_site) if timeout is None else timeout
+    if deadline_at is None:
+        return timeout, False
+    remaining = deadline_at - time.monotonic()
+    if remaining <= 0:
+        raise LLMDeadlineExceeded("已超过截止时间", call_site)
+    return min(timeout, remaining), remaining < timeout
+
+
+def _as_llm_error(error: BaseException, call_site: Optional[str], by_deadline: bool = False) -> Optional[LLMError]:
+    """
+    把客户端异常转换为 LLMError 的子类；不是请求错误（如程序错误）时返回 None。
+    """
+    if isinstance(error, LLMError):
+        return error
+    import openai
+    message = f"{type(error).__name__}: {error}"
+    if isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError)):
+        message = "已超过截止时间" if by_deadline else f"请求超时（{_site_timeout(call_site):.0f}s）"
+        return (LLMDeadlineExceeded if by_deadline else LLMTimeoutError)(message, call_site)
+    if isinstance(error, openai.APIConnectionError):
+        return LLMServerError(message, call_site)
+    if isinstance(error, openai.APIStatusError):
+        status = error.status_code
+        if status == 429:
+            return LLMRateLimitError(message, call_site, status_code=status,
+                                     retry_after=rate_limit.retry_after_seconds(error))
+        cls = LLMServerError if status >= 500 or status == 408 else LLMResponseError
+        return cls(message, call_site, status_code=status)
+    return None
+
+
+class _CircuitBreaker:
+    """
+    连续失败达到阈值后熔断，冷却期内请求直接失败；冷却结束后放行一个探测请求，成功则恢复。
+    只在后台事件循环中使用。
+    """
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_at: Optional[float] = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.cooldown:
+            return False
+        # 半开：同一时间只放行一个探测请求（探测被取消时，冷却期过后再放行下一个）
+        if self.probe_at is not None and now - self.probe_at < self.cooldown:
+            return False
+        self.probe_at = now
+        return True
+
+    def record(self, ok: bool) -> None:
+        if ok:
+            if self.opened_at is not None:
+                print("[熔断] 探测请求成功，恢复调用")
+            self.failures = 0
+            self.opened_at = self.probe_at = None
+            return
+        self.failures += 1
+        if self.probe_at is not None or (self.opened_at is None and self.failures >= self.threshold):
+            print(f"[熔断] 连续 {self.failures} 次请求失败，{self.cooldown:.0f}s 内暂停调用")
+            self.opened_at = time.monotonic()
+            self.probe_at = None
+
+
+class _LatencyTracker:
+    """
+    按调用点记录最近的请求延迟，用于决定对冲时机。只在后台事件循环中使用。
+    """
+    def __init__(self, window: int):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+
+    def add(self, group: str, seconds: float) -> None:
+        self._samples[group].append(seconds)
+
+    def percentile(self, group: str, q: float, min_samples: int) -> Optional[float]:
+        samples = self._samples.get(group)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _ConcurrencyLimiter:
+    """
+    可调整上限的异步信号量，只在后台事件循环中使用。
+    """
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    async def set_limit(self, limit: int):
+        async with self._cond:
+            self.limit = max(1, limit)
+            self._cond.notify_all()
+
+
+class _LLMRuntime:
+    """
+    在独立线程中运行一个事件循环，持有复用连接池的异步客户端。
+    同步调用方和任意事件循环中的异步调用方都把请求提交到这里执行。
+    """
+    def __init__(self, max_concurrency: int):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="llm-runtime", daemon=True)
+        self._thread.start()
+        self.client, self.limiter = self.submit(self._setup(max_concurrency)).result()
+        # 跨进程共享的限速器（批量运行多部小说时启用）
+        self.shared_limiter = rate_limit.get_shared_limiter()
+        # 缓存键 -> 在途请求，相同请求并发时只访问一次 API
+        self.inflight = {}
+        self.breaker = _CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN)
+        self.latency = _LatencyTracker(LATENCY_WINDOW)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _setup(self, max_concurrency: int):
+        # httpx / openai 导入较慢，首次请求时才加载
+        import httpx
+        from openai import AsyncOpenAI
+
+        # 连接池大小与并发上限一致，keep-alive 连接在多次调用间复用
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(600.0, connect=10.0),
         )
+        # 重试、退避和 429 由 _call_api 统一处理，不使用客户端内置的重试
+        client = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL, http_client=http_client, max_retries=0)
+        return client, _ConcurrencyLimiter(max_concurrency)
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        try:
+            self.submit(self.client.close()).result(timeout=5)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+        self.loop.close()
+
+
+_runtime: Optional[_LLMRuntime] = None
+_runtime_lock = threading.Lock()
+# 实际发往 API 的请求数（不含缓存命中和合并的请求），只在后台事件循环中修改
+# 请求数，以及接口返回的输入 token 数和其中命中服务端前缀缓存的 token 数；
+# 重试次数、最终失败的调用数、发出的对冲请求数和其中先返回的次数
+_call_stats = {"api_calls": 0, "stream_calls": 0, "prompt_tokens": 0, "cached_tokens": 0,
+               "retries": 0, "failed": 0, "hedged": 0, "hedge_wins": 0}
+
+
+def _get_runtime() -> _LLMRuntime:
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                _runtime = _LLMRuntime(MAX_CONCURRENCY)
+                atexit.register(_runtime.close)
+    return _runtime
+
+
+def set_max_concurrency(limit: int) -> None:
+    """
+    调整全局同时在途的 LLM 请求数量上限。
+
+    :param limit: 新的并发上限（至少为 1）
+    """
+    global MAX_CONCURRENCY
+    MAX_CONCURRENCY = max(1, int(limit))
+    if _runtime is not None:
+        _runtime.submit(_runtime.limiter.set_limit(MAX_CONCURRENCY)).result()
+
+
+@contextlib.asynccontextmanager
+async def _request_slot(runtime: _LLMRuntime):
+    """
+    占用一个请求名额：进程内并发上限，以及（启用时）跨进程的令牌桶和并发预算。
+    """
+    async with runtime.limiter:
+        if runtime.shared_limiter is None:
+            yield
+        else:
+            async with runtime.shared_limiter.slot():
+                yield
+
+
+async def _on_failure(runtime: _LLMRuntime, error: LLMError) -> None:
+    # 超时和服务端错误计入熔断；429 时通知共享限速器降速（文件锁和状态读写放到线程池，不阻塞事件循环）
+    if isinstance(error, (LLMTimeoutError, LLMServerError)) and not isinstance(error, LLMDeadlineExceeded):
+        runtime.breaker.record(False)
+    if isinstance(error, LLMRateLimitError) and runtime.shared_limiter is not None:
+        await asyncio.to_thread(runtime.shared_limiter.on_throttled, error.retry_after)
+
+
+async def _send(runtime: _LLMRuntime, messages: list, request: dict, call_site: Optional[str],
+                deadline_at: Optional[float], trace: Optional[llm_trace.CallTrace]):
+    """
+    发出一次请求（不重试），受熔断、并发上限、调用点超时和截止时间约束，失败时抛出 LLMError。
+    """
+    if not runtime.breaker.allow():
+        raise LLMCircuitOpenError("熔断中：近期请求连续失败，暂停调用", call_site)
+    async with _request_slot(runtime):
+        limit, by_deadline = _time_limit(call_site, deadline_at)
+        _call_stats["api_calls"] += 1
+        if trace is not None and "queue_ms" not in trace.entry:
+            trace.started()
+        start = time.monotonic()
+        try:
+            # 调用 OpenAI 接口生成回答
+            response = await asyncio.wait_for(runtime.client.chat.completions.create(
+                messages=messages,
+                stream=False,
+                **request
+            ), limit)
+        except Exception as e:
+            error = _as_llm_error(e, call_site, by_deadline)
+            if error is None:
+                raise
+            await _on_failure(runtime, error)
+            raise error from e
+    runtime.breaker.record(True)
+    group = _hedge_group(call_site)
+    if group is not None:
+        runtime.latency.add(group, time.monotonic() - start)
+    return response
+
+
+async def _send_hedged(runtime: _LLMRuntime, send, call_site: Optional[str],
+                       trace: Optional[llm_trace.CallTrace]):
+    """
+    对冲调用点的请求在途时间超过近期 p95（样本不足时为 HEDGE_COLD_DELAYS）后，再发一份相同请求，
+    返回先成功的结果并取消另一份。
+    """
+    group = _hedge_group(call_site)
+    delay = None
+    if HEDGE_ENABLED and group is not None:
+        delay = runtime.latency.percentile(group, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+        if delay is None:
+            delay = HEDGE_COLD_DELAYS.get(group)
+    if delay is None:
+        return await send()
+
+    first = asyncio.ensure_future(send())
+    pending = {first}
+    error = None
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return first.result()
+        _call_stats["hedged"] += 1
+        if trace is not None:
+            trace.entry["hedged"] = True
+        second = asyncio.ensure_future(send())
+        pending = {first, second}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        _call_stats["hedge_wins"] += 1
+                        if trace is not None:
+                            trace.entry["hedge_won"] = True
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _request_params(route: llm_router.Route, json_mode: bool) -> dict:
+    # 路由决定的模型和采样参数；JSON 模式另加 response_format
+    params = {"model": route.model, **route.params()}
+    if json_mode:
+        params["response_format"] = {"type": "json_object"}
+    return params
+
+
+async def _call_api(messages: list, trace: Optional[llm_trace.CallTrace] = None,
+                    json_mode: bool = False, deadline_at: Optional[float] = None,
+                    route: Optional[llm_router.Route] = None) -> str:
+    """
+    在后台事件循环中执行请求，受全局并发上限约束，失败时抛出 LLMError 的子类。
+    超时、5xx、连接错误和 429 按指数退避（带抖动，429 时不短于 Retry-After）重试，
+    全部耗时不超过 deadline_at（time.monotonic() 时刻）；熔断期间直接失败。
+    模型和采样参数由 route（默认按调用点选择）决定，调用结果计入该路由的统计。
+    trace 给出时记录排队时间、耗时、token 用量和结果。
+    json_mode=True 时要求接口只返回合法的 JSON 对象。
+    """
+    runtime = _get_runtime()
+    call_site = trace.entry.get("call_site") if trace is not None else None
+    router = llm_router.get_router()
+    route = route or router.route(call_site)
+    request = _request_params(route, json_mode)
+    start = time.perf_counter()
+    attempt = 0
+    try:
+        while True:
+            try:
+                response = await _send_hedged(
+                    runtime, lambda: _send(runtime, messages, request, call_site, deadline_at, trace),
+                    call_site, trace)
+                break
+            except LLMError as error:
+                error.attempts = attempt + 1
+                # 共享限速器已按 Retry-After 暂停所有进程，不再额外等待
+                delay = 0.0 if isinstance(error, LLMRateLimitError) and runtime.shared_limiter is not None \
+                    else retry_delay(error, attempt)
+                if not is_retryable(error) or attempt >= MAX_RETRIES:
+                    raise
+                if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+                    raise LLMDeadlineExceeded(f"重试前已超过截止时间（{error}）", call_site,
+                                              attempts=attempt + 1) from error
+                attempt += 1
+                _call_stats["retries"] += 1
+                await asyncio.sleep(delay)
 
         # 检查返回结果是否有效
         if not response or not hasattr(response, "choices") or not response.choices:
-            return "请求失败: 返回结果无效"
+            raise LLMResponseError("返回结果无效", call_site, attempts=attempt + 1)
 
         # 返回模型的回答
-        return response.choices[0].message.content
+        content = response.choices[0].message.content or ""
+        usage = _record_usage(getattr(response, "usage", None))
+        # 输出达到路由的 max_tokens 上限
+        truncated = getattr(response.choices[0], "finish_reason", None) == "length"
+        router.record(route, True, time.perf_counter() - start, truncated=truncated,
+                      **{k: v or 0 for k, v in usage.items()})
+        if trace is not None:
+            trace.finish("ok", attempts=attempt + 1, response_chars=len(content), truncated=truncated, **usage)
+        return content
+
+    except Exception as e:
+        _call_stats["failed"] += 1
+        router.record(route, False, time.perf_counter() - start)
+        if trace is not None:
+            trace.finish("error", error=f"{type(e).__name__}: {e}", error_type=type(e).__name__,
+                         attempts=attempt + 1)
+        raise
+
+
+def _record_usage(usage) -> dict:
+    """
+    累计 token 用量（在后台事件循环中调用，无需加锁），返回写入调用追踪的字段。
+    """
+    fields = llm_trace.usage_fields(usage)
+    _call_stats["prompt_tokens"] += fields.get("prompt_tokens") or 0
+    _call_stats["cached_tokens"] += fields.get("cached_tokens") or 0
+    return fields
+
+
+def _build_messages(prompt: str, system: Optional[str] = None) -> list:
+    """
+    system 为不随调用变化的稳定前缀（大纲、角色设定、判断说明等），prompt 为可变部分。
+    服务端按消息开头的相同前缀复用缓存，因此稳定内容放在 system 中，可变内容放在最后。
+    """
+    return [
+        {"role": "system", "content": system or SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _prompt_chars(messages: list) -> int:
+    return sum(len(m["content"]) for m in messages)
+
+
+async def _request(prompt: str, cache: bool = False, tags: Optional[dict] = None,
+                   system: Optional[str] = None, json_mode: bool = False,
+                   deadline_at: Optional[float] = None) -> str:
+    """
+    组装消息并发起请求；cache=True 时先查持久化缓存，并合并相同的在途请求。
+    tags 为调用方上下文中的追踪标签（call_site、iteration、round 等），
+    deadline_at 为调用方上下文中的截止时间。
+    """
+    messages = _build_messages(prompt, system)
+    route = llm_router.get_router().route((tags or {}).get("call_site"))
+    trace = llm_trace.CallTrace(dict(tags or {}, prompt_chars=_prompt_chars(messages), route=route.name),
+                                route.model)
+    if json_mode:
+        trace.entry["json_mode"] = True
+    if not cache:
+        trace.entry["cache"] = "off"
+        return await _call_api(messages, trace, json_mode, deadline_at, route)
+
+    runtime = _get_runtime()
+    # SQLite 读写在线程池中执行，不阻塞承载所有在途请求的事件循环
+    store = await asyncio.to_thread(llm_cache.get_cache)
+    # 模型和采样参数都参与缓存键，调整路由后不会命中其他参数下的回答
+    request = _request_params(route, json_mode)
+    key = store.make_key(request.pop("model"), messages, request or None)
+
+    pending = runtime.inflight.get(key)
+    if pending is not None:
+        store.record_coalesced()
+        trace.entry["cache"] = "coalesced"
+        try:
+            result = await asyncio.shield(pending)
+        except Exception as e:
+            trace.finish("error", error=f"{type(e).__name__}: {e}", error_type=type(e).__name__)
+            raise
+        trace.finish("ok")
+        return result
+
+    # 先登记在途请求再查缓存，查询期间到达的相同请求合并到这里
+    future = runtime.loop.create_future()
+    runtime.inflight[key] = future
+    try:
+        cached = await asyncio.to_thread(store.get, key)
+        if cached is not None:
+            trace.entry["cache"] = "hit"
+            trace.finish("ok")
+            future.set_result(cached)
+            return cached
+
+        trace.entry["cache"] = "miss"
+        result = await _call_api(messages, trace, json_mode, deadline_at, route)
+        future.set_result(result)
+        # 写入失败只打印警告（ResponseCache.put），回答照常返回
+        await asyncio.to_thread(store.put, key, result)
+        return result
+    except BaseException as e:
+        # 失败不写入缓存；合并到该请求的调用方收到同一异常
+        if not future.done():
+            future.set_exception(e)
+            future.exception()
+        raise
+    finally:
+        runtime.inflight.pop(key, None)
+
 
+async def aget_response_from_llm(prompt: str, cache: bool = False, call_site: Optional[str] = None,
+                                 system: Optional[str] = None, json_mode: bool = False) -> str:
+    """
+    get_response_from_llm 的异步版本，可在任意事件循环中 await。
+
+    :param prompt: 用户输入的提示文本
+    :param cache: 是否使用持久化缓存（适合判断类调用，不适合创作类调用）
+    :param call_site: 调用点名称，写入调用追踪
+    :param system: 稳定的 system 前缀，默认为通用 system 提示
+    :param json_mode: 是否要求只返回 JSON 对象（结构化调用见 structured_output.request_json）
+    :return: 模型生成的回答
+    :raises LLMError: 重试后仍失败、超过截止时间或熔断中
+    """
+    runtime = _get_runtime()
+    tags = llm_trace.current_tags(call_site=call_site)
+    return await asyncio.wrap_future(
+        runtime.submit(_request(prompt, cache, tags, system, json_mode, _deadline.get())))
+
+
+def get_response_from_llm(prompt: str, cache: bool = False, call_site: Optional[str] = None,
+                          system: Optional[str] = None, json_mode: bool = False) -> str:
+    """
+    调用 LLM 接口，传入 prompt，返回模型的回答。
+    同步调用，可在多个线程中同时使用，实际请求在共享连接池上并发执行。
+
+    :param prompt: 用户输入的提示文本（可变部分）
+    :param cache: 是否使用持久化缓存（适合判断类调用，不适合创作类调用）
+    :param call_site: 调用点名称（如 "goal"、"env-gen"），写入调用追踪
+    :param system: 稳定的 system 前缀（见 context_builder 中的 *_prefix），默认为通用 system 提示
+    :param json_mode: 是否要求只返回 JSON 对象（结构化调用见 structured_output.request_json）
+    :return: 模型生成的回答
+    :raises LLMError: 重试后仍失败、超过截止时间（见 deadline）或熔断中，按原因细分为各子类
+    """
+    tags = llm_trace.current_tags(call_site=call_site)
+    return _get_runtime().submit(_request(prompt, cache, tags, system, json_mode, _deadline.get())).result()
+
+
+async def agather_responses(prompts: Iterable[str], cache: bool = False,
+                            call_site: Optional[str] = None, system: Optional[str] = None,
+                            return_exceptions: bool = False) -> List[Union[str, LLMError]]:
+    """
+    并发提交多条 prompt，按输入顺序返回回答。
+
+    :param prompts: prompt 列表
+    :param cache: 是否使用持久化缓存
+    :param call_site: 调用点名称，写入调用追踪
+    :param system: 所有 prompt 共用的 system 前缀
+    :param return_exceptions: 为 True 时失败的调用在对应位置返回 LLMError，而不是抛出
+    :return: 与 prompts 一一对应的回答列表
+    """
+    results = await asyncio.gather(*(aget_response_from_llm(p, cache, call_site, system) for p in prompts),
+                                   return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException) and not (return_exceptions and isinstance(result, LLMError)):
+            raise result
+    return list(results)
+
+
+def gather_responses(prompts: Iterable[str], cache: bool = False, call_site: Optional[str] = None,
+                     system: Optional[str] = None, return_exceptions: bool = False) -> List[Union[str, LLMError]]:
+    """
+    agather_responses 的同步版本，供非异步代码一次性提交多条 prompt。
+
+    :param prompts: prompt 列表
+    :param cache: 是否使用持久化缓存
+    :param call_site: 调用点名称，写入调用追踪
+    :param system: 所有 prompt 共用的 system 前缀
+    :param return_exceptions: 为 True 时失败的调用在对应位置返回 LLMError，而不是抛出
+    :return: 与 prompts 一一对应的回答列表
+    """
+    runtime = _get_runtime()
+    tags = llm_trace.current_tags(call_site=call_site)
+    deadline_at = _deadline.get()
+    futures = [runtime.submit(_request(p, cache, tags, system, False, deadline_at)) for p in prompts]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except LLMError as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
+
+
+def get_cache_stats() -> dict:
+    """
+    返回本进程的 LLM 缓存命中统计。
+    """
+    return llm_cache.cache_stats()
+
+
+def get_call_stats() -> dict:
+    """
+    返回本进程实际发往 API 的请求数：{"api_calls": 普通请求, "stream_calls": 流式请求}，
+    以及接口返回的输入 token 数 prompt_tokens 和其中命中服务端前缀缓存的 cached_tokens，
+    重试次数 retries、最终失败的调用数 failed、对冲请求数 hedged 和其中先返回的次数 hedge_wins。
+    """
+    return dict(_call_stats)
+
+
+# 流式结束标记
+_STREAM_END = object()
+
+
+async def _stream_api(messages: list, chunks: "queue.Queue", trace: llm_trace.CallTrace,
+                      deadline_at: Optional[float] = None) -> None:
+    """
+    在后台事件循环中执行流式请求，把每个文本增量放入 chunks 队列。
+    建立连接受调用点超时约束，之后两个片段之间最多等待 STREAM_IDLE_TIMEOUT 秒，均不超过截止时间。
+    结束时放入 _STREAM_END；出错时放入 LLMError（流式请求不在这里重试，由调用方续写）。
+    """
+    runtime = _get_runtime()
+    call_site = trace.entry.get("call_site")
+    router = llm_router.get_router()
+    route = router.route(call_site)
+    start = time.perf_counter()
+    usage = None
+    received = 0
+    finish_reason = None
+    try:
+        if not runtime.breaker.allow():
+            raise LLMCircuitOpenError("熔断中：近期请求连续失败，暂停调用", call_site)
+        async with _request_slot(runtime):
+            _call_stats["stream_calls"] += 1
+            trace.started()
+            limit, by_deadline = _time_limit(call_site, deadline_at)
+            stream = None
+            try:
+                stream = await asyncio.wait_for(runtime.client.chat.completions.create(
+                    messages=messages,
+                    stream=True,
+                    **_request_params(route, False),
+                    # 最后一个事件携带 token 用量
+                    stream_options={"include_usage": True},
+                ), limit)
+                events = stream.__aiter__()
+                while True:
+                    limit, by_deadline = _time_limit(call_site, deadline_at, STREAM_IDLE_TIMEOUT)
+                    try:
+                        event = await asyncio.wait_for(events.__anext__(), limit)
+                    except StopAsyncIteration:
+                        break
+                    if getattr(event, "usage", None) is not None:
+                        usage = event.usage
+                    if not event.choices:
+                        continue
+                    finish_reason = getattr(event.choices[0], "finish_reason", None) or finish_reason
+                    delta = event.choices[0].delta.content
+                    if delta:
+                        if received == 0:
+                            trace.entry["first_chunk_ms"] = round((time.time() - trace.entry["start"]) * 1000, 1)
+                        received += len(delta)
+                        chunks.put(delta)
+            except Exception as e:
+                if stream is not None:
+                    # 超时或中断时关闭连接，不再读取剩余内容
+                    with contextlib.suppress(Exception):
+                        await stream.close()
+                error = _as_llm_error(e, call_site, by_deadline)
+                if error is None:
+                    raise
+                await _on_failure(runtime, error)
+                raise error from e
+        runtime.breaker.record(True)
+        tokens = _record_usage(usage)
+        truncated = finish_reason == "length"
+        router.record(route, True, time.perf_counter() - start, truncated=truncated,
+                      **{k: v or 0 for k, v in tokens.items()})
+        trace.finish("ok", response_chars=received, truncated=truncated, **tokens)
+        chunks.put(_STREAM_END)
     except Exception as e:
-        # 捕获异常并返回错误信息
-        return f"请求失败: {e}"
+        _call_stats["failed"] += 1
+        router.record(route, False, time.perf_counter() - start)
+        trace.finish("error", error=f"{type(e).__name__}: {e}", error_type=type(e).__name__,
+                     response_chars=received)
+        chunks.put(e)
 
+
+def stream_response_from_llm(prompt: str, call_site: Optional[str] = None,
+                             system: Optional[str] = None) -> Iterator[str]:
+    """
+    流式调用 LLM，边生成边返回文本片段。
+    与 get_response_from_llm 不同，流中断时不重试、直接抛出 LLMError，便于调用方基于已收到的部分续写
+    （可用 is_retryable / retry_delay 决定是否续写以及等待多久）。
+
+    :param prompt: 用户输入的提示文本
+    :param call_site: 调用点名称，写入调用追踪
+    :param system: 稳定的 system 前缀
+    :return: 文本片段迭代器
+    """
+    chunks: "queue.Queue" = queue.Queue()
+    messages = _build_messages(prompt, system)
+    tags = llm_trace.current_tags(call_site=call_site)
+    route = llm_router.get_router().route(call_site)
+    trace = llm_trace.CallTrace(dict(tags, prompt_chars=_prompt_chars(messages), cache="off", route=route.name),
+                                route.model, stream=True)
+    _get_runtime().submit(_stream_api(messages, chunks, trace, _deadline.get()))
+    while True:
+        item = chunks.get()
+        if item is _STREAM_END:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
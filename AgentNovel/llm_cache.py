@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+# 缓存文件位置与淘汰策略，可通过环境变量覆盖
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join(".llm_cache", "responses.sqlite"))
+CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "50000"))
+CACHE_MAX_AGE = float(os.environ.get("LLM_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+# 数据库被其他进程锁住时的等待时间（秒）
+CACHE_TIMEOUT = float(os.environ.get("LLM_CACHE_TIMEOUT", "10"))
+
+# 每写入多少条执行一次淘汰
+_EVICT_EVERY = 200
+# 命中时的访问时间先记在内存中，累计到该数量（或写入、淘汰时）再批量写回
+_TOUCH_BATCH = 100
+
+
+class ResponseCache:
+    """
+    基于 SQLite 的 LLM 回答缓存，以 (模型, 消息, 采样参数) 的哈希为键。
+
+    淘汰策略：
+      1. 超过 max_age 秒未写入的条目直接删除。
+      2. 条目数超过 max_entries 时，按最近访问时间删除最旧的条目。
+
+    数据库使用 WAL 模式，可由多个进程共享。读写失败（例如 "database is locked"）只打印警告：
+    读取失败按未命中处理，写入失败丢弃该条缓存，不影响调用方拿到的回答。
+    """
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = CACHE_MAX_ENTRIES, max_age: float = CACHE_MAX_AGE):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stores = 0
+        self.errors = 0
+        self._touched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=CACHE_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], params: Optional[dict] = None) -> str:
+        """
+        计算请求的内容哈希。
+
+        :param model: 模型名称
+        :param messages: 发送的消息列表
+        :param params: 其余采样参数（temperature、max_tokens 等）
+        :return: sha256 十六进制字符串
+        """
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params or {}},
+            ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _warn(self, action: str, error: sqlite3.Error) -> None:
+        # 调用时已持有 self._lock
+        self.errors += 1
+        print(f"[LLM 缓存] {action}失败: {error}")
+
+    def _flush_touched(self) -> None:
+        # 把内存中的访问时间批量写回；调用时已持有 self._lock
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, {}
+        self._conn.executemany("UPDATE responses SET last_access = ? WHERE key = ?",
+                               [(t, k) for k, t in touched.items()])
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        查询缓存。访问时间批量写回；数据库出错时按未命中处理。
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT response, created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.max_age:
+                    self._touched[key] = now
+                    if len(self._touched) >= _TOUCH_BATCH:
+                        self._flush_touched()
+            except sqlite3.Error as e:
+                self._warn("读取", e)
+                row = None
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """
+        写入缓存（尽力而为，数据库出错时只打印警告）。
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                self._touched.pop(key, None)
+                self._flush_touched()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created, last_access) VALUES (?, ?, ?, ?)",
+                    (key, response, now, now),
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._warn("写入", e)
+                return
+            self.stores += 1
+            need_evict = self.stores % _EVICT_EVERY == 0
+        if need_evict:
+            self.evict()
+
+    def record_coalesced(self) -> None:
+        """
+        记录一次被合并到在途请求上的调用（未访问 API）。
+        """
+        with self._lock:
+            self.coalesced += 1
+
+    def evict(self) -> None:
+        """
+        按过期时间和容量上限清理缓存（尽力而为，数据库出错时只打印警告）。
+        """
+        with self._lock:
+            try:
+                self._flush_touched()
+                self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+                count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                overflow = count - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                        (overflow,),
+                    )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._warn("淘汰", e)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._touched.clear()
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        返回命中统计：hits 为缓存命中，coalesced 为合并到在途请求的调用，
+        misses 为未命中、真正发往 API 的请求数，errors 为数据库读写失败次数。
+        """
+        with self._lock:
+            try:
+                entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            except sqlite3.Error:
+                entries = -1
+            return {
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "stores": self.stores,
+                "errors": self.errors,
+                "entries": entries,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            try:
+                self._flush_touched()
+            except sqlite3.Error as e:
+                self._warn("写入访问时间", e)
+            self._conn.close()
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """
+    获取进程内共享的缓存实例（首次使用时打开数据库）。
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def cache_stats() -> Dict[str, int]:
+    """
+    返回当前进程的缓存统计；缓存未被使用时返回全零。
+    """
+    if _cache is None:
+        return {"hits": 0, "coalesced": 0, "misses": 0, "stores": 0, "errors": 0, "entries": 0}
+    return _cache.stats()
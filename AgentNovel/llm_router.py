@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+# 创作类调用使用的模型，以及判断类调用（谓词、已完成 / 未完成检查）使用的快速模型
+DEFAULT_MODEL = os.environ.get("LLM_MODEL", "deepseek-chat")
+FAST_MODEL = os.environ.get("LLM_FAST_MODEL", DEFAULT_MODEL)
+# 路由配置文件（JSON），存在时覆盖或补充 DEFAULT_ROUTES 与 MODEL_PRICES：
+#     {"routes": {"predicate": {"model": "...", "max_tokens": 4}}, "prices": {"...": {...}}}
+ROUTES_PATH = os.environ.get("LLM_ROUTES_PATH", "llm_routes.json")
+
+# 调用点名称前缀 -> 路由参数（最长前缀优先，未匹配的使用 "default"）。
+# max_tokens / temperature 缺省时使用接口默认值；判断类调用只需要一两个词，限制输出并固定温度
+DEFAULT_ROUTES = {
+    "default": {"model": DEFAULT_MODEL},
+    "predicate": {"model": FAST_MODEL, "max_tokens": 8, "temperature": 0.0},
+    # 一次判断多条决策的全部谓词，输出为 JSON 数组
+    "predicate-batch": {"model": FAST_MODEL, "max_tokens": 2048, "temperature": 0.0},
+    "env-check": {"model": FAST_MODEL, "max_tokens": 8, "temperature": 0.0},
+    "ending-check": {"model": FAST_MODEL, "max_tokens": 8, "temperature": 0.0},
+    "chapter": {"model": DEFAULT_MODEL},
+}
+ROUTE_KEYS = ("model", "max_tokens", "temperature")
+
+# 每百万 token 的价格（美元）：输入（未命中缓存）、输入（命中缓存）、输出
+MODEL_PRICES = {
+    "deepseek-chat": {"input": 0.27, "cached_input": 0.07, "output": 1.10},
+    "deepseek-reasoner": {"input": 0.55, "cached_input": 0.14, "output": 2.19},
+}
+# 每条路由保留最近若干次调用的延迟，用于计算分位数
+LATENCY_WINDOW = 1000
+
+
+class Route:
+    """
+    一条路由：调用点使用的模型和采样参数。
+    """
+    def __init__(self, name: str, model: str, max_tokens: Optional[int] = None,
+                 temperature: Optional[float] = None):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+
+    def params(self) -> dict:
+        """
+        传给接口的采样参数（只含已设置的项），也参与响应缓存的键。
+        """
+        params = {}
+        if self.max_tokens is not None:
+            params["max_tokens"] = self.max_tokens
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        return params
+
+    def __repr__(self) -> str:
+        return f"Route({self.name!r}, {self.model!r}, {self.params()})"
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, cached_tokens: int, completion_tokens: int,
+                  prices: Optional[Dict[str, dict]] = None) -> float:
+    """
+    按 MODEL_PRICES 估算一次或多次调用的费用（美元）；未知模型返回 0。
+    """
+    price = (prices or MODEL_PRICES).get(model or "")
+    if not price:
+        return 0.0
+    missed = max(0, prompt_tokens - cached_tokens)
+    return (missed * price["input"] + cached_tokens * price.get("cached_input", price["input"])
+            + completion_tokens * price["output"]) / 1e6
+
+
+class _RouteStats:
+    def __init__(self, model: str):
+        self.model = model
+        self.calls = 0
+        self.errors = 0
+        self.truncated = 0
+        self.total_s = 0.0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+
+class Router:
+    """
+    按调用点选择路由，并统计每条路由的调用数、失败数、延迟分位数、token 数和估算费用。线程安全。
+    """
+    def __init__(self, routes: Optional[Dict[str, dict]] = None, prices: Optional[Dict[str, dict]] = None):
+        routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        routes.setdefault("default", {"model": DEFAULT_MODEL})
+        self.routes = {}
+        for name, config in routes.items():
+            unknown = set(config) - set(ROUTE_KEYS)
+            if unknown or "model" not in config:
+                raise ValueError(f"路由 {name} 的配置无效（需要 model，可选 max_tokens、temperature）: {config}")
+            self.routes[name] = Route(name, **config)
+        self.prices = {**MODEL_PRICES, **(prices or {})}
+        self._by_call_site: Dict[str, Route] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _RouteStats] = {}
+
+    def route(self, call_site: Optional[str]) -> Route:
+        """
+        返回调用点的路由：名称前缀匹配的最长路由，没有匹配时为 default。
+        """
+        key = call_site or ""
+        route = self._by_call_site.get(key)
+        if route is None:
+            matches = [name for name in self.routes if name != "default" and key.startswith(name)]
+            route = self.routes[max(matches, key=len)] if matches else self.routes["default"]
+            self._by_call_site[key] = route
+        return route
+
+    def record(self, route: Route, ok: bool, seconds: float, prompt_tokens: int = 0, cached_tokens: int = 0,
+               completion_tokens: int = 0, truncated: bool = False) -> None:
+        """
+        记录一次实际发往接口的调用（不含缓存命中）。
+        """
+        with self._lock:
+            stats = self._stats.get(route.name)
+            if stats is None:
+                stats = self._stats[route.name] = _RouteStats(route.model)
+            stats.calls += 1
+            stats.errors += 0 if ok else 1
+            stats.truncated += 1 if truncated else 0
+            stats.total_s += seconds
+            stats.latencies.append(seconds)
+            stats.prompt_tokens += prompt_tokens or 0
+            stats.cached_tokens += cached_tokens or 0
+            stats.completion_tokens += completion_tokens or 0
+
+    def stats(self) -> List[dict]:
+        """
+        每条路由的统计，按总耗时降序排列。
+        """
+        rows = []
+        with self._lock:
+            for name, s in self._stats.items():
+                latencies = sorted(s.latencies)
+
+                def percentile(q: float) -> float:
+                    return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1)
+
+                rows.append({
+                    "route": name,
+                    "model": s.model,
+                    "calls": s.calls,
+                    "errors": s.errors,
+                    "truncated": s.truncated,
+                    "total_s": round(s.total_s, 2),
+                    "p50_ms": percentile(0.5) if latencies else 0.0,
+                    "p95_ms": percentile(0.95) if latencies else 0.0,
+                    "prompt_tokens": s.prompt_tokens,
+                    "cached_tokens": s.cached_tokens,
+                    "completion_tokens": s.completion_tokens,
+                    "cost_usd": round(estimate_cost(s.model, s.prompt_tokens, s.cached_tokens,
+                                                    s.completion_tokens, self.prices), 6),
+                })
+        rows.sort(key=lambda row: row["total_s"], reverse=True)
+        return rows
+
+
+def load_router(path: str = ROUTES_PATH) -> Router:
+    """
+    读取路由配置文件，与默认路由合并；文件不存在时使用默认路由。
+    """
+    routes, prices = dict(DEFAULT_ROUTES), {}
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        routes.update(config.get("routes", {}))
+        prices = config.get("prices", {})
+        print(f"[路由] 已加载路由配置 {path}")
+    return Router(routes, prices)
+
+
+_router: Optional[Router] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> Router:
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = load_router(os.environ.get("LLM_ROUTES_PATH", ROUTES_PATH))
+    return _router
+
+
+def set_router(router: Router) -> None:
+    """
+    替换全局路由（例如在程序中按需调整路由，而不使用配置文件）。
+    """
+    global _router
+    with _router_lock:
+        _router = router
+
+
+def get_route_stats() -> List[dict]:
+    """
+    返回本进程每条路由的调用统计（见 Router.stats）。
+    """
+    return get_router().stats()
+
+
+def route_totals(rows: List[dict]) -> Dict[str, float]:
+    """
+    汇总各路由的调用数、总耗时和估算费用。
+    """
+    totals = defaultdict(float)
+    for row in rows:
+        for key in ("calls", "errors", "total_s", "cost_usd"):
+            totals[key] += row[key]
+    return {key: round(value, 6) for key, value in totals.items()}
@@ -0,0 +1,232 @@
+import argparse
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+import llm_router
+
+# 调用追踪文件（JSONL，每次调用一行）；设为空字符串时关闭追踪
+TRACE_PATH = os.environ.get("LLM_TRACE_PATH", os.path.join("logs", "llm_trace.jsonl"))
+
+# 当前上下文的追踪标签：call_site / iteration / round / agent / run_id 等
+_tags: contextvars.ContextVar = contextvars.ContextVar("llm_trace_tags", default={})
+
+_writer_lock = threading.Lock()
+_writer = {"path": None, "file": None}
+
+
+@contextlib.contextmanager
+def trace_context(**tags):
+    """
+    在当前上下文中附加追踪标签，期间发起的 LLM 调用都会带上这些标签。
+    例如 with trace_context(iteration=2, round=1): ...
+    """
+    token = _tags.set({**_tags.get(), **{k: v for k, v in tags.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def current_tags(**overrides) -> dict:
+    """
+    返回当前上下文的追踪标签；overrides 中非 None 的值覆盖同名标签。
+    """
+    return {**_tags.get(), **{k: v for k, v in overrides.items() if v is not None}}
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """
+    向线程池提交任务并携带当前上下文（线程池默认不继承 contextvars）。
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def usage_fields(usage) -> dict:
+    """
+    从接口返回的 usage 中提取 token 数；缓存命中 token 兼容 DeepSeek 与 OpenAI 两种字段。
+    """
+    if usage is None:
+        return {}
+    cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    if cached is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) if details is not None else None
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "cached_tokens": cached,
+    }
+
+
+def record(entry: dict) -> None:
+    """
+    追加一条调用记录。写入失败只打印警告，不影响调用本身。
+    """
+    path = os.environ.get("LLM_TRACE_PATH", TRACE_PATH)
+    if not path:
+        return
+    line = json.dumps(entry, ensure_ascii=False, default=str)
+    with _writer_lock:
+        try:
+            if _writer["path"] != path:
+                if _writer["file"] is not None:
+                    _writer["file"].close()
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                _writer["file"] = open(path, "a", encoding="utf-8")
+                _writer["path"] = path
+            _writer["file"].write(line + "\n")
+            _writer["file"].flush()
+        except OSError as e:
+            print(f"[追踪] 写入 {path} 失败：{e}")
+
+
+class CallTrace:
+    """
+    单次调用的计时与记录：创建时开始计时，started() 标记排队结束，finish() 时写出。
+    """
+    def __init__(self, tags: dict, model: str, stream: bool = False):
+        self.entry = {"pid": os.getpid(), "model": model, "stream": stream, **tags}
+        self._start = time.time()
+        self._perf = time.perf_counter()
+        self.entry["start"] = self._start
+
+    def started(self) -> None:
+        # 取得请求名额、真正发出请求的时间，之前为排队时间
+        self.entry["queue_ms"] = round((time.perf_counter() - self._perf) * 1000, 1)
+
+    def finish(self, outcome: str, **fields) -> None:
+        elapsed = time.perf_counter() - self._perf
+        self.entry.update(fields)
+        self.entry["outcome"] = outcome
+        self.entry["end"] = self._start + elapsed
+        self.entry["duration_ms"] = round(elapsed * 1000, 1)
+        record(self.entry)
+
+
+# ---------- 汇总与导出 ----------
+
+def load_trace(path: str = TRACE_PATH) -> List[dict]:
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _cost(r: dict) -> float:
+    return llm_router.estimate_cost(r.get("model"), r.get("prompt_tokens") or 0, r.get("cached_tokens") or 0,
+                                    r.get("completion_tokens") or 0)
+
+
+def summarize(records: Iterable[dict], by: Iterable[str] = ("call_site",)) -> List[dict]:
+    """
+    按给定标签分组，统计调用数、失败数、缓存命中、耗时（总计 / p50 / p95）、token 数和估算费用。
+    :return: 按总耗时降序排列的分组统计
+    """
+    by = list(by)
+    groups: Dict[tuple, List[dict]] = defaultdict(list)
+    for r in records:
+        groups[tuple(r.get(k) for k in by)].append(r)
+
+    rows = []
+    for key, items in groups.items():
+        durations = [r.get("duration_ms") or 0.0 for r in items]
+        rows.append({
+            **dict(zip(by, key)),
+            "calls": len(items),
+            "errors": sum(1 for r in items if r.get("outcome") != "ok"),
+            "cache_hits": sum(1 for r in items if r.get("cache") in ("hit", "coalesced")),
+            "total_s": round(sum(durations) / 1000, 2),
+            "p50_ms": round(_percentile(durations, 0.5), 1),
+            "p95_ms": round(_percentile(durations, 0.95), 1),
+            "prompt_tokens": sum(r.get("prompt_tokens") or 0 for r in items),
+            "completion_tokens": sum(r.get("completion_tokens") or 0 for r in items),
+            "cached_tokens": sum(r.get("cached_tokens") or 0 for r in items),
+            "cost_usd": round(sum(_cost(r) for r in items), 6),
+        })
+    rows.sort(key=lambda row: row["total_s"], reverse=True)
+    return rows
+
+
+def format_table(rows: List[dict]) -> str:
+    if not rows:
+        return "（无记录）"
+    columns = list(rows[0].keys())
+    cells = [[str(row.get(c, "")) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(cell[i]) for cell in cells)) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths))]
+    lines += ["  ".join(cell.ljust(w) for cell, w in zip(row, widths)) for row in cells]
+    return "\n".join(lines)
+
+
+def to_chrome_trace(records: Iterable[dict]) -> dict:
+    """
+    转换为 Chrome trace 格式（chrome://tracing 或 Perfetto 可直接打开）。
+    同一进程内时间重叠的调用分配到不同的行。
+    """
+    events = []
+    lanes: Dict[int, List[float]] = defaultdict(list)  # pid -> 每行最后一次调用的结束时间
+    for r in sorted(records, key=lambda r: r.get("start", 0)):
+        start, end = r.get("start"), r.get("end")
+        if start is None or end is None:
+            continue
+        pid = r.get("pid", 0)
+        lane_ends = lanes[pid]
+        lane = next((i for i, lane_end in enumerate(lane_ends) if lane_end <= start), None)
+        if lane is None:
+            lane = len(lane_ends)
+            lane_ends.append(end)
+        else:
+            lane_ends[lane] = end
+        args = {k: v for k, v in r.items() if k not in ("start", "end", "pid")}
+        events.append({
+            "name": r.get("call_site") or "unknown",
+            "cat": "llm" if r.get("outcome") == "ok" else "llm,error",
+            "ph": "X",
+            "ts": int(start * 1e6),
+            "dur": max(1, int((end - start) * 1e6)),
+            "pid": pid,
+            "tid": lane,
+            "args": args,
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM 调用追踪汇总")
+    parser.add_argument("path", nargs="?", default=TRACE_PATH, help="追踪文件（JSONL）")
+    parser.add_argument("--by", default="call_site",
+                        help="分组标签，逗号分隔，例如 call_site、route,model、iteration,round")
+    parser.add_argument("--run-id", help="只统计指定运行的记录")
+    parser.add_argument("--chrome", metavar="OUT", help="导出 Chrome trace JSON")
+    args = parser.parse_args()
+
+    trace = load_trace(args.path)
+    if args.run_id:
+        trace = [r for r in trace if r.get("run_id") == args.run_id]
+    print(format_table(summarize(trace, [k.strip() for k in args.by.split(",") if k.strip()])))
+    if args.chrome:
+        with open(args.chrome, "w", encoding="utf-8") as f:
+            json.dump(to_chrome_trace(trace), f, ensure_ascii=False)
+        print(f"已导出 Chrome trace: {args.chrome}")
@@ -1,17 +1,31 @@
-import re
 from LLM_DNF_Novel.models import llm_extractor
+from LLM_DNF_Novel.models.local_classifier import get_local_stats
 from agents.tools.memory import update_character_info
-from decision import evaluate_decisions
+from decision import evaluate_decisions, score_decision, select_best, SCORING_STRATEGIES, SCORING_STRATEGY
 import environment as env_module
 import agents.roles.character_registry as character_registry
+import argparse
 import json
 import os
-from typing import Dict, List
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+from typing import Dict, List, Optional
 from agents.roles.BaseCharacter import CharacterAgent
-from interact import run_simulation
-from llm import get_response_from_llm
+from interact import (load_scene, run_rounds, run_rounds_adaptive, build_background, RoundBudget,
+                      ADAPTIVE_SCORE_THRESHOLD, ADAPTIVE_MAX_ROUNDS, ADAPTIVE_MAX_CALLS)
+from llm import deadline, get_response_from_llm, get_cache_stats, get_call_stats
+import context_builder
 from agents.tools.merge import merge_decisions
-from write import generate_novel_from_decision  #合并决策的工具函数
+from write import generate_novel_from_decision, next_chapter_path, NOVEL_DIR  #合并决策的工具函数
+from scene_store import get_latest_scene_file
+from scheduler import TaskGraph
+import story_summary
+from llm_trace import format_table, submit_with_context, trace_context
+from llm_router import get_route_stats, route_totals
+from structured_output import get_structured_stats
+from project import ProjectPaths
+from checkpoint import (CheckpointStore, STEPS, latest_run, list_runs, new_run_id,
+                        restore_resources, snapshot_resources)
 
 def check_outline_completion(outline_path: str, environment: dict, decision: dict) -> str:
     """
@@ -21,28 +35,28 @@ def check_outline_completion(outline_path: str, environment: dict, decision: dic
     :param decision: 当前决策信息
     :return: "已完成" 或 "未完成"
     """
-    with open(outline_path, "r", encoding="utf-8") as f:
-        outline_data = json.load(f)
-    ending = outline_data["ending"]
-    ending_description = ending["description"]
+    ending_description = context_builder.outline_digest(outline_path)["ending"]["description"]
+    context = context_builder.render_sections("ending-check", [
+        ("decision", decision),
+        ("environment", context_builder.trim_environment(environment)),
+    ])
     
-    # 传入大纲中的ending的description，environment和decision
+    # 大纲作为 system 前缀；提示中固定内容（说明和 ending 的 description）在前，environment 和 decision 在后
     prompt = f"""
     你是一个小说大纲分析助手。以下是当前环境信息和决策信息，请根据这些信息判断大纲中的ending是否完成。
     需要你完成以下任务：
     1. 结合环境和当前决策判断大纲中的ending是否完成。
     2. 如果完成，返回“已完成”；如果未完成，返回“未完成”。
-    3.environment_dir: {environment_dir}
-    4.character_dir: {character_dir}
-    5.outline_path: {outline_path}
-    6.scene_id: {scene_id}
-    7.decision: {decision}
-    8.environment: {environment}
-    9.ending_description: {ending_description}
     如果你认为大纲中的ending已经完成，返回“已完成”；如果未完成，返回“未完成”。
+    ending_description: {ending_description}
+    scene_id: {getattr(environment, "scene_id", "")}
+    decision: {context["decision"]}
+    environment: {context["environment"]}
     """
+    context_builder.log_prompt_size("ending-check", prompt)
     
-    llm_response = get_response_from_llm(prompt)
+    llm_response = get_response_from_llm(prompt, cache=True, call_site="ending-check",
+                                         system=context_builder.novel_prefix(outline_path))
     
     result = llm_response.strip()  
 
@@ -52,58 +66,353 @@ def check_outline_completion(outline_path: str, environment: dict, decision: dic
 
     return result
 
-def get_latest_scene_file(directory: str) -> str:
+# 设置文件路径（默认项目为当前目录）
+DEFAULT_PATHS = ProjectPaths()
+ENVIRONMENT_DIR = DEFAULT_PATHS.environment_dir
+CHARACTER_DIR = DEFAULT_PATHS.character_dir
+OUTLINE_PATH = DEFAULT_PATHS.outline_path
+
+
+# 每次迭代中决策之后可以并发执行的步骤（章节另行调度）
+POST_DECISION_STEPS = ("characters", "environment", "ending")
+# 每次迭代（决策、评分、角色与环境更新、结局检查）中 LLM 调用的截止时间（秒），None 表示不限；
+# 章节生成不受该限制
+ITERATION_DEADLINE = None
+# 流水线模式下单个章节生成失败后的重试次数，超过后中止运行（可从检查点恢复）
+CHAPTER_RETRIES = 1
+
+
+def _new_iteration(iteration: int, scene_id: str, chapters: List[str],
+                   pending_chapters: Optional[List[dict]] = None, last_chapter_path: Optional[str] = None,
+                   scoring: str = SCORING_STRATEGY) -> dict:
+    return {"iteration": iteration, "scene_id": scene_id, "decisions": [], "goals": {}, "done": [],
+            "chapters": chapters, "pending_chapters": list(pending_chapters or []),
+            "last_chapter_path": last_chapter_path, "scoring": scoring}
+
+
+def _passed(state: dict, step: str) -> bool:
+    return STEPS.index(state.get("step", "start")) >= STEPS.index(step)
+
+
+def run_novel(checkpoints: CheckpointStore, state: dict, novel_dir: str = NOVEL_DIR, num_rounds: int = 3,
+              environment_dir: str = ENVIRONMENT_DIR, character_dir: str = CHARACTER_DIR,
+              outline_path: str = OUTLINE_PATH, pipeline: bool = False, max_workers: int = 4,
+              snapshot: Optional[dict] = None, budget: Optional[RoundBudget] = None,
+              iteration_deadline: Optional[float] = ITERATION_DEADLINE) -> dict:
     """
-    从指定目录中获取命名中数字最大的 JSON 文件。
-    :param directory: 文件所在目录
-    :return: 数字最大的 JSON 文件路径
+    小说生成主循环。每次迭代先进行多轮决策和评分，之后的章节创作、角色更新、环境更新、
+    结局检查互不依赖，由 TaskGraph 并发执行。每一步完成后写入检查点，
+    state 中已完成的步骤直接跳过，因此可以从任意检查点继续。
+
+    pipeline 为 True 时，下一次迭代只等待新场景、角色更新和结局检查，
+    上一章仍在生成时即开始下一轮决策；未写完的章节记录在 state["pending_chapters"] 中，
+    恢复时重新调度（基于 .part 文件续写）。
+
+    :param checkpoints: 本次运行的检查点存储
+    :param state: 主循环状态（新运行为 _new_iteration 的结果，恢复时为检查点中的状态）
+    :param novel_dir: 章节存储目录
+    :param num_rounds: 每次迭代的决策轮数
+    :param pipeline: 是否让章节生成与下一次迭代重叠
+    :param max_workers: 决策后步骤的并发线程数
+    :param snapshot: 恢复时检查点中的磁盘快照
+    :param budget: 给出时按评分自适应决定每次迭代的决策轮数（num_rounds 不再使用）
+    :param iteration_deadline: 每次迭代中 LLM 调用的截止时间（秒），超过后调用抛出 LLMDeadlineExceeded，
+                               可从检查点恢复
+    :return: 结束时的状态
+
+    评分使用的谓词提取方式记录在 state["scoring"] 中（见 decision.evaluate_decisions），恢复时沿用。
     """
-    files = [f for f in os.listdir(directory) if f.endswith(".json")]
-    # 提取文件名中的数字并排序
-    files_with_numbers = [(f, int(re.search(r'\d+', f).group())) for f in files if re.search(r'\d+', f)]
-    latest_file = max(files_with_numbers, key=lambda x: x[1])[0]
-    return os.path.join(directory, latest_file)
+    # 早于该字段的检查点按当时的默认方式评分
+    scoring = state.setdefault("scoring", "batch")
+    lock = threading.RLock()
+    # 角色更新完成前，检查点沿用评分时的角色快照，避免记录到更新了一半的角色文件
+    base = {"snapshot": snapshot}
+    chapter_futures: Dict[str, Future] = {}
+    chapter_failures: Dict[str, int] = {}
+
+    def save(step: str) -> None:
+        with lock:
+            if step not in POST_DECISION_STEPS + ("chapter",):
+                state["step"] = step
+            current = snapshot_resources(character_dir, environment_dir, state["scene_id"], state.get("next_scene_id"))
+            if _passed(state, "scored") and "characters" not in state["done"] and base["snapshot"]:
+                current["characters"] = base["snapshot"]["characters"]
+            if step == "scored":
+                base["snapshot"] = current
+            checkpoints.save(step, state, current)
+
+    def write_chapter(item: dict) -> str:
+        # 流水线模式下章节可能在下一次迭代期间写完，追踪标签沿用章节所属的迭代；
+        # 章节不继承迭代的截止时间（流式请求另有片段间超时）
+        with trace_context(iteration=item["iteration"]), deadline(None, inherit=False):
+            path = generate_novel_from_decision(item["decision"], item["background"], output_path=item["chapter_path"],
+                                                story_so_far=item.get("story_so_far", ""))
+            # 新章节并入滚动梗概（只读入这一章）；失败不影响章节本身，下一章写完时会补上
+            try:
+                with lock:
+                    pending = [p["chapter_path"] for p in state["pending_chapters"] if p["chapter_path"] != path]
+                story_summary.update_summary(os.path.dirname(path), pending)
+            except Exception as e:
+                print(f"[梗概] 更新失败: {e}")
+        with lock:
+            state["pending_chapters"] = [p for p in state["pending_chapters"] if p["chapter_path"] != path]
+            state["chapters"] = state["chapters"] + [path]
+            save("chapter")
+        return path
+
+    def schedule_chapters(executor: ThreadPoolExecutor) -> None:
+        with lock:
+            for item in state["pending_chapters"]:
+                if item["chapter_path"] not in chapter_futures:
+                    chapter_futures[item["chapter_path"]] = submit_with_context(executor, write_chapter, item)
+
+    def run_step(step: str, fn, *args, key: Optional[str] = None):
+        # 步骤在工作线程中执行；结果（key 不为 None 时写入 state[key]）与完成标记在锁内一起更新，
+        # 保证检查点复制 state 时不会与写入交错
+        result = fn(*args)
+        with lock:
+            if key is not None:
+                state[key] = result
+            state["done"] = state["done"] + [step]
+            save(step)
+        return result
+
+    def check_ending(environment, decision) -> bool:
+        # 第一次迭代之后，检查大纲的 ending 是否完成
+        return state["iteration"] > 1 and check_outline_completion(outline_path, environment, decision) == "已完成"
+
+    def update_environment(environment) -> str:
+        return env_module.update_environment_by_scene_id(
+            state["scene_id"], environment, environment_dir, outline_path,
+            story_so_far=story_summary.current_digest(novel_dir))
+
+    def check_chapters() -> None:
+        # 流水线模式下章节失败不会阻塞下一次迭代：发现失败后重新调度，
+        # 超过重试次数时写入检查点并抛出异常（未写完的章节保留在 pending_chapters 中，可恢复）
+        with lock:
+            failed = [(path, future) for path, future in chapter_futures.items()
+                      if future.done() and future.exception() is not None]
+            for path, future in failed:
+                del chapter_futures[path]
+                chapter_failures[path] = chapter_failures.get(path, 0) + 1
+                if chapter_failures[path] > CHAPTER_RETRIES:
+                    save("chapter")
+                    raise future.exception()
+                print(f"[章节] {path} 生成失败，重新调度（第 {chapter_failures[path]} 次）: {future.exception()}")
+
+    with trace_context(run_id=checkpoints.run_id), ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # 恢复时先调度上次未写完的章节
+        schedule_chapters(executor)
+        while True:
+            check_chapters()
+            schedule_chapters(executor)
+            if all(step in state["done"] for step in POST_DECISION_STEPS):
+                if state["ending_complete"]:
+                    # 等待剩余章节；失败的章节按 CHAPTER_RETRIES 重新调度
+                    while state["pending_chapters"]:
+                        wait_futures(list(chapter_futures.values()))
+                        check_chapters()
+                        schedule_chapters(executor)
+                    print("大纲的 ending 已完成，程序结束。")
+                    return state
+                with lock:
+                    state = _new_iteration(state["iteration"] + 1, state["next_scene_id"], state["chapters"],
+                                           state["pending_chapters"], state.get("last_chapter_path"), scoring)
+                base["snapshot"] = None
+
+            with trace_context(iteration=state["iteration"]), deadline(iteration_deadline):
+                # 加载本次迭代的场景和角色
+                environment, agents = load_scene(environment_dir, character_dir, state["scene_id"])
+                for name, goal in state["goals"].items():
+                    if name in agents:
+                        agents[name].goal = goal
+                print(environment)
+
+                # 多轮决策，每轮结束后写入检查点
+                extractor = llm_extractor.LLMExtractor()
+                if not _passed(state, "scored") and budget is not None:
+                    # 自适应轮数：每轮合并决策立即评分，按预算决定是否继续
+                    def on_round_scored(decisions, scores, calls_used):
+                        state["decisions"] = list(decisions)
+                        state["round_scores"] = [float(score) for score in scores]
+                        state["round_calls"] = calls_used
+                        state["goals"] = {name: agent.goal for name, agent in agents.items()}
+                        save("round")
+                    run_rounds_adaptive(
+                        environment, agents,
+                        lambda d: score_decision(d, extractor, build_background(environment, agents), scoring),
+                        budget, decisions=state["decisions"], scores=state.get("round_scores"),
+                        calls_used=state.get("round_calls", 0), on_round=on_round_scored)
+                elif not _passed(state, "scored") and len(state["decisions"]) < num_rounds:
+                    def on_round(decisions):
+                        state["decisions"] = list(decisions)
+                        state["goals"] = {name: agent.goal for name, agent in agents.items()}
+                        save("round")
+                    run_rounds(environment, agents, num_rounds, decisions=state["decisions"], on_round=on_round)
+                backgound = build_background(environment, agents)
+
+                # 提取最佳决策，同时预先分配章节路径（跳过仍在生成的章节），便于中断后续写同一章节
+                if not _passed(state, "scored"):
+                    if budget is not None:
+                        # 每轮已经评分，不再重复评估
+                        decision_scores = list(zip(state["decisions"], state["round_scores"]))
+                        best_decision = select_best(decision_scores)[0]
+                    else:
+                        decision_scores, best_decision, _ = evaluate_decisions(
+                            state["decisions"], extractor, backgound, scoring)
+                    state["scores"] = [[d, float(score)] for d, score in decision_scores]
+                    state["decision"] = best_decision
+                    state["chapter_path"] = next_chapter_path(novel_dir, after=state.get("last_chapter_path"))
+                    save("scored")
+                decision = state["decision"]
+
+                # 决策之后的步骤：章节、角色、环境、结局检查互不依赖，并发执行
+                with lock:
+                    if not state.get("chapter_scheduled"):
+                        chapter_path = state.get("chapter_path") or next_chapter_path(
+                            novel_dir, after=state.get("last_chapter_path"))
+                        state["pending_chapters"] = state["pending_chapters"] + [{
+                            "iteration": state["iteration"], "decision": decision,
+                            # 序列化后的副本：与恢复时从检查点读到的内容一致，续写时提示哈希不变
+                            "background": json.loads(json.dumps(backgound, ensure_ascii=False)),
+                            # 调度时的梗概（流水线模式下可能尚未包含上一章），同样固定在检查点中
+                            "story_so_far": story_summary.current_digest(novel_dir),
+                            "chapter_path": chapter_path,
+                        }]
+                        state["chapter_scheduled"] = True
+                        state["last_chapter_path"] = chapter_path
+                schedule_chapters(executor)
+
+                environment.complete_environment_goal()
+                graph = TaskGraph(executor, name=f"第 {state['iteration']} 次迭代 ")
+                if "characters" not in state["done"]:
+                    graph.add("characters", run_step, "characters", update_character_info,
+                              agents, decision, character_dir)
+                if "environment" not in state["done"]:
+                    graph.add("environment", run_step, "environment", update_environment, environment,
+                              key="next_scene_id")
+                if "ending" not in state["done"]:
+                    graph.add("ending", run_step, "ending", check_ending, environment, decision,
+                              key="ending_complete")
+                graph.wait()
+
+                # 不启用流水线时，等待本章写完再进入下一次迭代
+                if not pipeline:
+                    for future in list(chapter_futures.values()):
+                        future.result()
+
+                print(f"[LLM 缓存] {get_cache_stats()}")
+                print(f"[LLM 用量] {get_call_stats()}")
+                print(f"[结构化输出] {get_structured_stats()}")
+                print(f"[本地谓词] {get_local_stats()}")
+                route_stats = get_route_stats()
+                print(f"[模型路由] 累计 {route_totals(route_stats)}\n{format_table(route_stats)}")
+                print(f"[上下文] 提示大小统计: {context_builder.prompt_size_stats()}")
+
+
+def _parse_fork(value: str):
+    run_id, _, seq = value.partition(":")
+    return run_id, int(seq) if seq else None
+
+
+def start_novel(paths: ProjectPaths = DEFAULT_PATHS, run_id: Optional[str] = None, resume: Optional[str] = None,
+                fork: Optional[str] = None, pick: Optional[int] = None, num_rounds: int = 3,
+                pipeline: bool = False, budget: Optional[RoundBudget] = None,
+                iteration_deadline: Optional[float] = ITERATION_DEADLINE, scoring: Optional[str] = None) -> dict:
+    """
+    开始、恢复或分支一次运行。
+
+    :param paths: 项目目录布局
+    :param run_id: 新运行（或分支）的 ID，默认按时间生成
+    :param resume: 要恢复的运行 ID；空字符串表示最近一次运行，None 表示不恢复
+    :param fork: "RUN_ID[:SEQ]"，从该检查点分出新运行
+    :param pick: 分支时改用评分列表中第 pick 条决策
+    :param num_rounds: 每次迭代的决策轮数
+    :param pipeline: 是否让章节生成与下一次迭代重叠
+    :param budget: 自适应轮数预算，None 表示固定 num_rounds 轮
+    :param iteration_deadline: 每次迭代中 LLM 调用的截止时间（秒），None 表示不限
+    :param scoring: 谓词提取方式（"batch" / "lazy" / "full"）；新运行默认为 decision.SCORING_STRATEGY，
+                    恢复或分支时默认沿用检查点中的方式
+    :return: 结束时的状态
+    """
+    if scoring is not None and scoring not in SCORING_STRATEGIES:
+        raise ValueError(f"未知的谓词提取方式: {scoring}，可选 {SCORING_STRATEGIES}")
+    paths.validate()
+    run_kwargs = dict(num_rounds=num_rounds, environment_dir=paths.environment_dir,
+                      character_dir=paths.character_dir, outline_path=paths.outline_path, pipeline=pipeline,
+                      budget=budget, iteration_deadline=iteration_deadline)
+    if resume is None and not fork:
+        checkpoints = CheckpointStore(run_id or new_run_id(), paths.checkpoint_dir)
+        checkpoints.create(paths.novel_dir)
+        latest_scene_file = get_latest_scene_file(paths.environment_dir)
+        scene_id = os.path.splitext(os.path.basename(latest_scene_file))[0]
+        return run_novel(checkpoints, _new_iteration(1, scene_id, [], scoring=scoring or SCORING_STRATEGY),
+                         paths.novel_dir, **run_kwargs)
+
+    if fork:
+        source_id, seq = _parse_fork(fork)
+        source = CheckpointStore(source_id, paths.checkpoint_dir)
+        seq = seq if seq is not None else source.sequences()[-1]
+        run_id = run_id or new_run_id()
+        checkpoints = source.fork(seq, run_id, os.path.join(paths.branch_novel_dir, run_id))
+    else:
+        checkpoints = CheckpointStore(resume or latest_run(paths.checkpoint_dir), paths.checkpoint_dir)
+    checkpoint = checkpoints.load()
+    state = checkpoint["state"]
+    if scoring is not None and scoring != state.get("scoring", "batch"):
+        print(f"[检查点] 谓词提取方式改为 {scoring}（原为 {state.get('scoring', 'batch')}）")
+        state["scoring"] = scoring
+    if pick is not None:
+        if checkpoint["step"] != "scored":
+            raise ValueError(f"只能在 scored 检查点改选决策，当前为 {checkpoint['step']}")
+        state["decision"] = state["scores"][pick][0]
+        print(f"[检查点] 改用第 {pick} 条决策: {state['decision']}")
+        checkpoints.save("scored", state, checkpoint["snapshot"])
+    # 还原检查点时的角色和场景文件
+    restore_resources(checkpoint["snapshot"], paths.character_dir, paths.environment_dir)
+    return run_novel(checkpoints, state, checkpoints.meta()["novel_dir"],
+                     snapshot=checkpoint["snapshot"], **run_kwargs)
+
 
 if __name__ == "__main__":
-    # 设置文件路径
-    environment_dir = "resources/environment"
-    character_dir = "resources/character"
-    outline_path = "resources/outline/outline.json"
-
-    # 初始化变量
-    is_ending_complete = False  # 用于判断大纲的 ending 是否完成
-    first_round = True          # 标记是否是第一轮
-
-    while not is_ending_complete:
-        # 运行模拟环境
-        result = run_simulation(environment_dir, character_dir, outline_path, num_rounds=3)
-
-        # 获取最新的环境文件
-        decision = result[0]
-        environment = result[1]
-        print(environment)
-        agents = result[2]
-        backgound = result[3]
-        scene_id = os.path.splitext(os.path.basename(get_latest_scene_file(environment_dir)))[0]
-        latest_scene_file = get_latest_scene_file(environment_dir)
-
-        # 生成小说并保存为文件
-        generate_novel_from_decision(decision, backgound)
-
-        # 更新角色信息并保存到文件中
-        
-        update_character_info(agents, decision, character_dir)
-
-
-        environment.complete_environment_goal()
-        env_module.update_environment_by_scene_id(scene_id, environment, environment_dir, outline_path)
-
-        # 如果不是第一轮，检查大纲的 ending 是否完成
-        if not first_round:
-            is_ending_complete = check_outline_completion(outline_path, environment, decision) == "已完成"
-            if is_ending_complete:
-                print("大纲的 ending 已完成，程序结束。")
-                break
-        else:
-            first_round = False  # 第一轮结束后，将标记设为 False
-    
+    parser = argparse.ArgumentParser(description="多智能体小说生成")
+    parser.add_argument("--root", default=".", help="项目根目录（包含 resources/），默认为当前目录")
+    parser.add_argument("--run-id", help="新运行（或分支）的 ID，默认按时间生成")
+    parser.add_argument("--resume", nargs="?", const="", metavar="RUN_ID",
+                        help="从运行的最新检查点继续，省略 RUN_ID 时继续最近一次运行")
+    parser.add_argument("--fork", metavar="RUN_ID[:SEQ]",
+                        help="从运行的检查点 SEQ（默认最新）分出新运行")
+    parser.add_argument("--pick", type=int, metavar="N",
+                        help="分支时改用评分列表中第 N 条（从 0 开始）决策，需要从 scored 检查点分支")
+    parser.add_argument("--list", action="store_true", help="列出所有运行和检查点")
+    parser.add_argument("--rounds", type=int, default=3, help="每次迭代的决策轮数")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="新场景和角色就绪后立即开始下一次迭代，与上一章的生成重叠")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="每轮合并决策立即评分，按评分自适应决定轮数（--rounds 作为目标轮数）")
+    parser.add_argument("--score-threshold", type=float, default=ADAPTIVE_SCORE_THRESHOLD,
+                        help="自适应模式下最佳评分达到该值即停止")
+    parser.add_argument("--max-rounds", type=int, default=ADAPTIVE_MAX_ROUNDS, help="自适应模式下的最多轮数")
+    parser.add_argument("--max-calls", type=int, default=ADAPTIVE_MAX_CALLS,
+                        help="自适应模式下每次迭代决策阶段的 API 调用预算")
+    parser.add_argument("--scoring", choices=SCORING_STRATEGIES,
+                        help=f"谓词提取方式：batch 一次请求判断全部谓词，lazy 按规则惰性询问并跳过不影响结果的谓词，"
+                             f"full 逐个询问；新运行默认 {SCORING_STRATEGY}（环境变量 DNF_SCORING_STRATEGY），"
+                             f"恢复时默认沿用检查点中的方式")
+    parser.add_argument("--deadline", type=float, default=ITERATION_DEADLINE, metavar="SECONDS",
+                        help="每次迭代中 LLM 调用的截止时间（秒），超过后中止该迭代，可用 --resume 继续")
+    args = parser.parse_args()
+    project = ProjectPaths(args.root)
+
+    if args.list:
+        for run_id in list_runs(project.checkpoint_dir):
+            checkpoints = CheckpointStore(run_id, project.checkpoint_dir)
+            print(f"{run_id}: {checkpoints.meta()}")
+            for item in checkpoints.summary():
+                print(f"  #{item['seq']} 第 {item['iteration']} 次迭代 {item['step']}")
+    else:
+        round_budget = RoundBudget(target_rounds=args.rounds, threshold=args.score_threshold,
+                                   max_rounds=args.max_rounds, max_calls=args.max_calls) if args.adaptive else None
+        start_novel(project, run_id=args.run_id, resume=args.resume, fork=args.fork, pick=args.pick,
+                    num_rounds=args.rounds, pipeline=args.pipeline, budget=round_budget,
+                    iteration_deadline=args.deadline, scoring=args.scoring)
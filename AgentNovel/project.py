@@ -0,0 +1,54 @@
+import os
+
+
+class ProjectPaths:
+    """
+    一部小说的资源目录布局。所有路径都相对于项目根目录，默认根目录为当前目录：
+
+        resources/environment/        场景文件
+        resources/character/          角色文件
+        resources/outline/outline.json 大纲
+        resources/novel/              章节
+        resources/checkpoints/        检查点
+        logs/                         批量运行时的日志与 LLM 调用追踪
+        .llm_cache/                   批量运行时的 LLM 缓存、评分数据与谓词统计
+    """
+    def __init__(self, root: str = "."):
+        self.root = root
+        self.environment_dir = self._join("resources", "environment")
+        self.character_dir = self._join("resources", "character")
+        self.outline_path = self._join("resources", "outline", "outline.json")
+        self.novel_dir = self._join("resources", "novel")
+        # 分支运行的章节目录（每个分支一个子目录）
+        self.branch_novel_dir = os.path.join(self.novel_dir, "branches")
+        self.checkpoint_dir = self._join("resources", "checkpoints")
+        self.log_dir = self._join("logs")
+        self.cache_dir = self._join(".llm_cache")
+
+    def _join(self, *parts: str) -> str:
+        return os.path.normpath(os.path.join(self.root, *parts))
+
+    def state_environ(self) -> dict:
+        """
+        运行中会写入的缓存与日志文件放在项目目录下（对应模块按这些环境变量确定路径），
+        批量运行时各项目互不争用同一个 SQLite 数据库和 JSONL 文件。
+        训练得到的本地谓词模型和评分规则只读，仍按各自的环境变量共享。
+        """
+        return {
+            "LLM_CACHE_PATH": os.path.join(self.cache_dir, "responses.sqlite"),
+            "LLM_TRACE_PATH": os.path.join(self.log_dir, "llm_trace.jsonl"),
+            "DNF_DATA_PATH": os.path.join(self.cache_dir, "dnf_dataset.jsonl"),
+            "PREDICATE_LOG_PATH": os.path.join(self.cache_dir, "predicate_pairs.jsonl"),
+            "PREDICATE_STATS_PATH": os.path.join(self.cache_dir, "predicate_stats.json"),
+        }
+
+    def validate(self) -> None:
+        """
+        检查运行所需的目录和大纲是否存在。
+        """
+        for path in (self.environment_dir, self.character_dir, self.outline_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"项目 {self.root} 缺少 {path}")
+
+    def __repr__(self) -> str:
+        return f"ProjectPaths({self.root!r})"
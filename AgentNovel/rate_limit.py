@@ -0,0 +1,248 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 共享限速状态文件；未设置时不启用跨进程限速
+RATE_LIMIT_PATH = os.environ.get("LLM_RATE_LIMIT_PATH", "")
+# 每分钟请求数上限、令牌桶容量、所有进程合计的在途请求上限
+RATE_LIMIT_RPM = float(os.environ.get("LLM_RATE_LIMIT_RPM", "60"))
+RATE_LIMIT_BURST = float(os.environ.get("LLM_RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_CONCURRENCY = int(os.environ.get("LLM_RATE_LIMIT_CONCURRENCY", "16"))
+
+# 收到 429 后速率减半，最低降到上限的该比例；每次成功请求按上限的该比例恢复
+MIN_RATE_FRACTION = 0.1
+RECOVERY_FRACTION = 0.02
+# 进程异常退出时遗留的占用在该时间后失效（略长于单次请求超时）
+LEASE_TTL = 660.0
+# 等待令牌时的最长单次休眠
+MAX_POLL_INTERVAL = 1.0
+
+
+class _FileLock:
+    """
+    跨进程互斥锁（fcntl / msvcrt），同一进程内的线程另用 threading.Lock 互斥。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        self._file = open(self.path, "a+")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+            self._thread_lock.release()
+
+
+class SharedRateLimiter:
+    """
+    多个进程共享的令牌桶限速器和并发预算，状态保存在一个 JSON 文件中，每次读写都持有文件锁。
+
+      - 令牌按当前速率（每分钟请求数）补充，桶容量为 burst；
+      - 所有进程合计的在途请求不超过 max_concurrency；
+      - 收到 429 时速率减半并按 Retry-After 暂停所有进程，之后每次成功请求逐步恢复速率（AIMD）。
+    """
+    def __init__(self, path: str, rpm: float = RATE_LIMIT_RPM, burst: float = RATE_LIMIT_BURST,
+                 max_concurrency: int = RATE_LIMIT_CONCURRENCY):
+        if rpm <= 0:
+            raise ValueError(f"限速必须大于 0: {rpm}")
+        self.path = path
+        self.rpm = rpm
+        self.burst = max(1.0, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = _FileLock(path + ".lock")
+
+    def _initial_state(self, now: float) -> dict:
+        return {"rate": self.rpm, "tokens": self.burst, "updated": now,
+                "cooldown_until": 0.0, "leases": {}, "throttled": 0, "granted": 0}
+
+    def _transact(self, fn):
+        """
+        持有文件锁读取状态、调用 fn(state, now) 修改并写回，返回 fn 的结果。
+        """
+        with self._lock:
+            now = time.time()
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                state = self._initial_state(now)
+            # 配置以当前进程为准（同一批任务使用相同配置）
+            state["rate"] = min(state.get("rate", self.rpm), self.rpm)
+            state["leases"] = {k: t for k, t in state.get("leases", {}).items() if now - t < LEASE_TTL}
+            elapsed = max(0.0, now - state.get("updated", now))
+            state["tokens"] = min(self.burst, state.get("tokens", self.burst) + elapsed * state["rate"] / 60.0)
+            state["updated"] = now
+            result = fn(state, now)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+            return result
+
+    def reset(self) -> None:
+        """
+        重置共享状态（批量任务开始前调用）。
+        """
+        def reset(state, now):
+            state.clear()
+            state.update(self._initial_state(now))
+        self._transact(reset)
+
+    def try_acquire(self, lease_id: str) -> float:
+        """
+        尝试取得一个令牌和一个并发名额。
+        :return: 0 表示已取得；否则为建议等待的秒数
+        """
+        def acquire(state, now):
+            if now < state["cooldown_until"]:
+                return state["cooldown_until"] - now
+            if len(state["leases"]) >= self.max_concurrency:
+                return 0.05
+            if state["tokens"] < 1:
+                return (1 - state["tokens"]) * 60.0 / state["rate"]
+            state["tokens"] -= 1
+            state["leases"][lease_id] = now
+            state["granted"] = state.get("granted", 0) + 1
+            return 0.0
+        return self._transact(acquire)
+
+    def release(self, lease_id: str, success: bool = True) -> None:
+        def release(state, now):
+            state["leases"].pop(lease_id, None)
+            if success:
+                state["rate"] = min(self.rpm, state["rate"] + self.rpm * RECOVERY_FRACTION)
+        self._transact(release)
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> None:
+        """
+        服务端返回 429 时调用：速率减半、清空令牌，并让所有进程暂停 retry_after 秒。
+        """
+        def throttle(state, now):
+            state["rate"] = max(self.rpm * MIN_RATE_FRACTION, state["rate"] / 2)
+            state["tokens"] = 0.0
+            pause = retry_after if retry_after else 60.0 / state["rate"]
+            state["cooldown_until"] = max(state["cooldown_until"], now + pause)
+            state["throttled"] = state.get("throttled", 0) + 1
+            return state["rate"], pause
+        rate, pause = self._transact(throttle)
+        print(f"[限速] 收到 429，速率降为 {rate:.1f} 次/分钟，暂停 {pause:.1f}s")
+
+    async def acquire_async(self) -> str:
+        lease_id = uuid.uuid4().hex
+        while True:
+            # 文件锁和状态读写在线程池中执行，不阻塞事件循环
+            wait = await asyncio.to_thread(self.try_acquire, lease_id)
+            if wait <= 0:
+                return lease_id
+            await asyncio.sleep(min(wait, MAX_POLL_INTERVAL))
+
+    def acquire(self) -> str:
+        lease_id = uuid.uuid4().hex
+        while True:
+            wait = self.try_acquire(lease_id)
+            if wait <= 0:
+                return lease_id
+            time.sleep(min(wait, MAX_POLL_INTERVAL))
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        异步上下文：进入时等待令牌和并发名额，退出时归还名额（出错时不恢复速率）。
+        """
+        lease_id = await self.acquire_async()
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            await asyncio.to_thread(self.release, lease_id, success)
+
+    def stats(self) -> dict:
+        def read(state, now):
+            return {
+                "rate": round(state["rate"], 2),
+                "tokens": round(state["tokens"], 2),
+                "in_flight": len(state["leases"]),
+                "granted": state.get("granted", 0),
+                "throttled": state.get("throttled", 0),
+                "cooldown": round(max(0.0, state["cooldown_until"] - now), 1),
+            }
+        return self._transact(read)
+
+
+_shared: Optional[SharedRateLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_limiter() -> Optional[SharedRateLimiter]:
+    """
+    按环境变量 LLM_RATE_LIMIT_PATH 创建共享限速器；未设置时返回 None。
+    """
+    global _shared
+    path = os.environ.get("LLM_RATE_LIMIT_PATH", RATE_LIMIT_PATH)
+    if not path:
+        return None
+    with _shared_lock:
+        if _shared is None or _shared.path != path:
+            _shared = SharedRateLimiter(
+                path,
+                rpm=float(os.environ.get("LLM_RATE_LIMIT_RPM", RATE_LIMIT_RPM)),
+                burst=float(os.environ.get("LLM_RATE_LIMIT_BURST", RATE_LIMIT_BURST)),
+                max_concurrency=int(os.environ.get("LLM_RATE_LIMIT_CONCURRENCY", RATE_LIMIT_CONCURRENCY)),
+            )
+        return _shared
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    从异常携带的响应头中读取 Retry-After（秒）。
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
@@ -0,0 +1,208 @@
+import copy
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+from fileio import atomic_write_json
+
+# 追加写入的场景清单与历史版本目录（位于环境目录下，不以 .json 结尾，不会被当作场景文件）
+MANIFEST_NAME = "_manifest.jsonl"
+HISTORY_DIR = "_history"
+
+_SCENE_NUMBER_RE = re.compile(r"\d+")
+
+
+class SceneStore:
+    """
+    环境场景存储：
+
+      - 内存索引 {scene_id: 记录}，O(1) 获取最新场景和按 ID 查找；
+      - 追加写入的清单（_manifest.jsonl）记录每次保存，启动时据此恢复索引；
+      - 覆盖已有场景前，把旧版本保存到 _history/ 中，保留全部历史；
+      - 解析后的场景数据按文件 mtime 缓存。
+
+    目录被外部修改（例如手动放入新的场景文件）时，按目录 mtime 检测并增量补录。
+    """
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self.manifest_path = os.path.join(base_path, MANIFEST_NAME)
+        self.history_path = os.path.join(base_path, HISTORY_DIR)
+        self._records: Dict[str, dict] = {}
+        self._history: Dict[str, List[dict]] = {}
+        self._latest: Optional[str] = None
+        self._data_cache: Dict[str, tuple] = {}
+        self._dir_mtime = None
+        self._lock = threading.RLock()
+        self._load_manifest()
+        self._refresh()
+
+    # ---------- 索引维护 ----------
+
+    def _index(self, record: dict) -> None:
+        scene_id = record["scene_id"]
+        self._records[scene_id] = record
+        if record.get("history_file"):
+            # 本次保存覆盖掉的旧版本
+            self._history.setdefault(scene_id, []).append({
+                "scene_id": scene_id,
+                "version": record["version"] - 1,
+                "file": os.path.join(HISTORY_DIR, record["history_file"]),
+                "time": record["time"],
+            })
+        latest = self._records.get(self._latest) if self._latest else None
+        if latest is None or record["number"] >= latest["number"]:
+            self._latest = scene_id
+
+    def _load_manifest(self) -> None:
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    self._index(json.loads(line))
+                except (json.JSONDecodeError, KeyError):
+                    # 中断时可能留下半行，忽略即可
+                    continue
+
+    def _append_manifest(self, record: dict) -> None:
+        os.makedirs(self.base_path, exist_ok=True)
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _refresh(self) -> None:
+        """
+        目录 mtime 变化时补录清单中没有的场景文件。
+        """
+        if not os.path.isdir(self.base_path):
+            return
+        mtime = os.stat(self.base_path).st_mtime_ns
+        if mtime == self._dir_mtime:
+            return
+        for filename in os.listdir(self.base_path):
+            if not filename.endswith(".json"):
+                continue
+            scene_id = os.path.splitext(filename)[0]
+            match = _SCENE_NUMBER_RE.search(filename)
+            if scene_id in self._records or not match:
+                continue
+            record = {"scene_id": scene_id, "number": int(match.group()), "version": 1,
+                      "file": filename, "time": time.time()}
+            self._index(record)
+            self._append_manifest(record)
+        self._dir_mtime = os.stat(self.base_path).st_mtime_ns
+
+    # ---------- 查询 ----------
+
+    def latest_scene_id(self) -> str:
+        with self._lock:
+            self._refresh()
+            # 最新场景文件被外部删除时，从索引中移除并重新选出最新场景
+            while self._latest is not None and not os.path.exists(self.scene_file(self._latest)):
+                self._records.pop(self._latest)
+                self._latest = max(self._records, key=lambda k: self._records[k]["number"], default=None)
+            if self._latest is None:
+                raise FileNotFoundError(f"目录中没有场景文件: {self.base_path}")
+            return self._latest
+
+    def latest_scene_file(self) -> str:
+        return self.scene_file(self.latest_scene_id())
+
+    def scene_file(self, scene_id: str) -> str:
+        return os.path.join(self.base_path, f"{scene_id}.json")
+
+    def load_data(self, scene_id: str) -> dict:
+        """
+        读取场景数据（按文件 mtime 缓存解析结果），返回副本，调用方可自由修改。
+        """
+        filepath = self.scene_file(scene_id)
+        if not os.path.exists(filepath):
+            raise FileNotFoundError(f"环境文件不存在: {filepath}")
+        mtime = os.stat(filepath).st_mtime_ns
+        with self._lock:
+            cached = self._data_cache.get(scene_id)
+            if cached is None or cached[0] != mtime:
+                with open(filepath, "r", encoding="utf-8") as f:
+                    cached = (mtime, json.load(f))
+                self._data_cache[scene_id] = cached
+            return copy.deepcopy(cached[1])
+
+    def history(self, scene_id: str) -> List[dict]:
+        """
+        返回场景被覆盖的历史版本 [{"version", "file", "time"}]（不含当前版本），按版本号排序。
+        """
+        with self._lock:
+            return sorted(self._history.get(scene_id, []), key=lambda r: r["version"])
+
+    def load_version(self, scene_id: str, version: int) -> dict:
+        """
+        读取场景的指定版本；当前版本直接读取场景文件。
+        """
+        with self._lock:
+            current = self._records.get(scene_id)
+            if current and current["version"] == version:
+                return self.load_data(scene_id)
+            for record in self._history.get(scene_id, []):
+                if record["version"] == version:
+                    with open(os.path.join(self.base_path, record["file"]), "r", encoding="utf-8") as f:
+                        return json.load(f)
+        raise FileNotFoundError(f"场景 {scene_id} 不存在版本 {version}")
+
+    # ---------- 写入 ----------
+
+    def save(self, scene_id: str, data: dict) -> str:
+        """
+        保存场景。已存在的场景先把旧版本移入历史目录，再原子写入新版本并追加清单记录。
+        :return: 场景文件路径
+        """
+        match = _SCENE_NUMBER_RE.search(scene_id)
+        if not match:
+            raise ValueError(f"无法从 scene_id 中提取数字: {scene_id}")
+        filepath = self.scene_file(scene_id)
+        with self._lock:
+            self._refresh()
+            previous = self._records.get(scene_id)
+            record = {"scene_id": scene_id, "number": int(match.group()), "version": 1,
+                      "file": os.path.basename(filepath), "time": time.time()}
+            if previous and os.path.exists(filepath):
+                os.makedirs(self.history_path, exist_ok=True)
+                history_file = f"{scene_id}.v{previous['version']}.json"
+                shutil.copy2(filepath, os.path.join(self.history_path, history_file))
+                record["version"] = previous["version"] + 1
+                record["history_file"] = history_file
+            atomic_write_json(filepath, data)
+            self._append_manifest(record)
+            self._index(record)
+            self._data_cache.pop(scene_id, None)
+            self._dir_mtime = os.stat(self.base_path).st_mtime_ns
+        return filepath
+
+
+_stores: Dict[str, SceneStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(base_path: str) -> SceneStore:
+    """
+    获取目录对应的场景存储（每个目录一个实例）。
+    """
+    key = os.path.abspath(base_path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = SceneStore(base_path)
+        return _stores[key]
+
+
+def get_latest_scene_file(directory: str) -> str:
+    """
+    从指定目录中获取命名中数字最大的 JSON 文件。
+    :param directory: 文件所在目录
+    :return: 数字最大的 JSON 文件路径
+    """
+    return get_store(directory).latest_scene_file()
@@ -0,0 +1,88 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class TaskGraph:
+    """
+    简单的依赖感知任务调度：每个任务在其依赖全部成功完成后提交到线程池执行。
+    依赖失败时，下游任务直接以同一异常结束，不再执行。
+
+    用法：
+        graph = TaskGraph(executor)
+        graph.add("environment", update_env)
+        graph.add("next", start_next, deps=("environment",))
+        graph.wait(["next"])
+    """
+    def __init__(self, executor: ThreadPoolExecutor, name: str = ""):
+        self.executor = executor
+        self.name = name
+        self.futures: Dict[str, Future] = {}
+        self.timings: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    def add(self, name: str, fn: Callable[..., Any], *args, deps: Iterable[str] = (), **kwargs) -> Future:
+        """
+        添加任务。deps 中的任务必须已经添加。
+        :return: 任务结果的 Future
+        """
+        deps = list(deps)
+        missing = [d for d in deps if d not in self.futures]
+        if missing:
+            raise ValueError(f"任务 {name} 的依赖尚未添加: {missing}")
+        if name in self.futures:
+            raise ValueError(f"任务已存在: {name}")
+        result: Future = Future()
+        self.futures[name] = result
+        pending = {"count": len(deps)}
+        # 任务在添加时的上下文中执行（保留追踪标签等 contextvars）
+        context = contextvars.copy_context()
+
+        def run():
+            start = time.perf_counter()
+            try:
+                value = fn(*args, **kwargs)
+            except BaseException as e:
+                print(f"[调度] {self.name}{name} 失败: {e}")
+                result.set_exception(e)
+                return
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.timings[name] = elapsed
+            print(f"[调度] {self.name}{name} 完成，用时 {elapsed:.1f}s")
+            result.set_result(value)
+
+        def on_dep_done(dep: Future):
+            if result.done():
+                return
+            error = dep.exception()
+            if error is not None:
+                # 依赖失败，下游任务不再执行
+                with self._lock:
+                    if result.done():
+                        return
+                    result.set_exception(error)
+                return
+            with self._lock:
+                pending["count"] -= 1
+                ready = pending["count"] == 0
+            if ready:
+                self.executor.submit(context.run, run)
+
+        if not deps:
+            self.executor.submit(context.run, run)
+        for d in deps:
+            self.futures[d].add_done_callback(on_dep_done)
+        return result
+
+    def wait(self, names: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        等待指定任务（默认全部任务）完成并返回结果；任一任务失败时抛出其异常。
+        """
+        names = list(self.futures) if names is None else list(names)
+        return {name: self.futures[name].result() for name in names}
+
+    def pending(self) -> List[str]:
+        return [name for name, future in self.futures.items() if not future.done()]
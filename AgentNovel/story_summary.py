@@ -0,0 +1,135 @@
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+from fileio import atomic_write_text
+from llm import get_response_from_llm
+
+# 梗概保存在章节目录下的该子目录中：<章节编号>.txt 为写完该章后的梗概
+SUMMARY_DIR_NAME = "_summary"
+# 梗概的最大字数；模型超出时只保留末尾（最近的剧情）
+SUMMARY_MAX_CHARS = 1200
+# 折叠单章时附带的正文最大字数
+CHAPTER_MAX_CHARS = 6000
+
+SUMMARY_SYSTEM_PROMPT = (
+    "你是一个小说编辑，负责维护一部长篇小说的故事梗概，供后续章节创作和场景生成保持情节连贯。\n"
+    "每次会给出截至上一章的梗概和新一章的正文。请把新一章的关键情节、人物状态和关系变化、"
+    "尚未解决的悬念并入梗概，压缩较早的细节，保留对后续情节仍有影响的内容。\n"
+    f"只输出更新后的梗概正文，不超过 {SUMMARY_MAX_CHARS} 字，不要添加标题或说明。"
+)
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(novel_dir: str) -> threading.Lock:
+    key = os.path.abspath(novel_dir)
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def _chapter_number(path: str) -> Optional[int]:
+    match = re.fullmatch(r"(\d+)\.txt", os.path.basename(path))
+    return int(match.group(1)) if match else None
+
+
+def summary_path(chapter_path: str) -> str:
+    """
+    写完 chapter_path 这一章之后的梗概文件路径。
+    """
+    directory, name = os.path.split(chapter_path)
+    return os.path.join(directory, SUMMARY_DIR_NAME, name)
+
+
+def _chapters(novel_dir: str) -> List[int]:
+    if not os.path.isdir(novel_dir):
+        return []
+    return sorted(n for n in (_chapter_number(f) for f in os.listdir(novel_dir)) if n is not None)
+
+
+def _pending_chapters(novel_dir: str) -> List[int]:
+    # 仍在生成的章节：流式写入中的 <编号>.txt.part
+    if not os.path.isdir(novel_dir):
+        return []
+    names = (f[:-len(".part")] for f in os.listdir(novel_dir) if f.endswith(".part"))
+    return sorted(n for n in (_chapter_number(name) for name in names) if n is not None)
+
+
+def _latest_summarized(novel_dir: str, chapters: List[int]) -> Optional[int]:
+    for number in reversed(chapters):
+        if os.path.exists(summary_path(os.path.join(novel_dir, f"{number}.txt"))):
+            return number
+    return None
+
+
+def current_digest(novel_dir: str) -> str:
+    """
+    返回截至最近一个已折叠章节的故事梗概；尚无梗概时返回空字符串。
+    """
+    latest = _latest_summarized(novel_dir, _chapters(novel_dir))
+    if latest is None:
+        return ""
+    with open(summary_path(os.path.join(novel_dir, f"{latest}.txt")), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _keep_tail(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    # 从句子边界截断，保留最近的剧情
+    tail = text[-max_chars:]
+    boundary = min((i for i in (tail.find("。"), tail.find("\n")) if i >= 0), default=-1)
+    return tail[boundary + 1:] if 0 <= boundary < max_chars // 4 else tail
+
+
+def fold_chapter(digest: str, chapter_text: str, chapter_number: int) -> str:
+    """
+    把新一章并入已有梗概，返回新的梗概（一次 LLM 调用，输入只有旧梗概和新一章）。
+    请求失败时抛出 LLMError。
+    """
+    if len(chapter_text) > CHAPTER_MAX_CHARS:
+        # 过长的章节保留首尾，中间省略
+        half = CHAPTER_MAX_CHARS // 2
+        chapter_text = chapter_text[:half] + "\n……\n" + chapter_text[-half:]
+    prompt = (
+        f"截至上一章的梗概：\n{digest or '（这是第一章，尚无梗概）'}\n\n"
+        f"第 {chapter_number} 章正文：\n{chapter_text}"
+    )
+    response = get_response_from_llm(prompt, call_site="story-summary", system=SUMMARY_SYSTEM_PROMPT)
+    return _keep_tail(response.strip(), SUMMARY_MAX_CHARS)
+
+
+def update_summary(novel_dir: str, pending: Optional[List[str]] = None) -> str:
+    """
+    把尚未折叠的已完成章节按编号顺序逐章并入梗概，返回最新梗概。
+    遇到编号不连续（前一章仍在生成）时停止，等该章写完后的下一次调用再继续，
+    保证梗概始终按章节顺序累积。同一目录的更新串行执行。
+
+    :param pending: 已分配但尚未写完的章节路径（例如等待重新调度、还没有 .part 文件的章节）；
+                    目录中的 .txt.part 文件同样视为未写完的章节
+    """
+    with _lock_for(novel_dir):
+        chapters = _chapters(novel_dir)
+        latest = _latest_summarized(novel_dir, chapters)
+        digest = current_digest(novel_dir)
+        if latest is not None:
+            expected = latest + 1
+        else:
+            # 尚无梗概时从编号最小的章节开始，包括仍在生成的章节（它写完之前不折叠后面的章节）
+            unfinished = _pending_chapters(novel_dir) + [
+                n for n in (_chapter_number(p) for p in pending or []) if n is not None]
+            expected = min(chapters + unfinished, default=None)
+        for number in chapters:
+            if latest is not None and number <= latest:
+                continue
+            if number != expected:
+                break
+            chapter_path = os.path.join(novel_dir, f"{number}.txt")
+            with open(chapter_path, "r", encoding="utf-8") as f:
+                digest = fold_chapter(digest, f.read(), number)
+            atomic_write_text(summary_path(chapter_path), digest)
+            print(f"[梗概] 已并入第 {number} 章，梗概 {len(digest)} 字")
+            expected = number + 1
+        return digest
@@ -0,0 +1,270 @@
+import json
+import re
+import threading
+from typing import Any, List, Optional, Tuple
+
+from llm import LLMError, get_response_from_llm
+
+# 本地修复失败或不符合结构时，最多追加的"修正 JSON"请求次数
+FIX_ATTEMPTS = 1
+# 修正请求中附带的原始输出最大字数
+FIX_MAX_CHARS = 12000
+# 截断修复时最多尝试回退的逗号位置数
+MAX_CUT_POINTS = 64
+
+JSON_FIX_SYSTEM_PROMPT = (
+    "你是一个 JSON 修正助手。会给出一段不合法或不符合结构要求的 JSON、发现的问题和要求的 JSON Schema。\n"
+    "请在尽量保留原有内容的前提下修正它，只输出修正后的完整 JSON 对象，不要添加代码块标记或任何说明。"
+)
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+_stats = {"parsed": 0, "repaired": 0, "fixed": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+
+class StructuredOutputError(ValueError):
+    """
+    模型输出无法解析为符合要求的 JSON。raw 为最后一次的原始输出。
+    """
+    def __init__(self, message: str, raw: Optional[str] = None):
+        super().__init__(message)
+        self.raw = raw
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_structured_stats() -> dict:
+    """
+    返回本进程结构化输出的统计：直接解析成功、本地修复成功、修正请求成功、最终失败的次数。
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+# ---------- 本地解析与修复 ----------
+
+def _strip_fence(text: str) -> str:
+    # 取出第一个代码块的内容；被截断、没有结束标记的代码块取到末尾
+    match = re.search(r"```[a-zA-Z]*\s*\n?(.*?)(?:```|$)", text, re.S)
+    return match.group(1) if match else text
+
+
+def _scan(text: str) -> Tuple[List[str], bool, List[int]]:
+    """
+    扫描 JSON 片段，返回末尾仍未闭合的括号栈、是否停在字符串内部，以及字符串外的逗号位置。
+    """
+    stack, commas = [], []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+        elif ch == ",":
+            commas.append(i)
+    return stack, in_string, commas
+
+
+def _remove_trailing_commas(text: str) -> str:
+    # 去掉字符串外、紧跟 } 或 ] 的逗号
+    out = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "," and re.match(r"\s*[}\]]", text[i + 1:]):
+            continue
+        out.append(ch)
+    return "".join(out)
+
+
+def _close(fragment: str) -> str:
+    """
+    补全被截断的 JSON：闭合字符串，去掉悬空的逗号，补上缺失的值和括号。
+    """
+    stack, in_string, _ = _scan(fragment)
+    if in_string:
+        # 去掉截断在转义符中间的反斜杠
+        if re.search(r"(?<!\\)(\\\\)*\\$", fragment):
+            fragment = fragment[:-1]
+        fragment += '"'
+    fragment = _remove_trailing_commas(fragment.rstrip().rstrip(","))
+    if fragment.rstrip().endswith(":"):
+        fragment += " null"
+    return fragment + "".join("}" if ch == "{" else "]" for ch in reversed(stack))
+
+
+def _decode_prefix(text: str):
+    # 解析开头的完整 JSON 值，忽略其后的说明文字
+    return json.JSONDecoder().raw_decode(text)[0]
+
+
+def parse_json(text: str, expect: str = "object") -> Tuple[Any, bool]:
+    """
+    从模型输出中解析 JSON，容忍常见缺陷：代码块标记、前后的说明文字、多余的逗号、被截断的结尾。
+
+    :param text: 模型原始输出
+    :param expect: 期望的顶层类型，"object" 或 "array"
+    :return: (解析结果, 是否经过修复)
+    :raises StructuredOutputError: 无法修复
+    """
+    if not text or not text.strip():
+        raise StructuredOutputError("模型输出为空", text)
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+
+    body = _strip_fence(text)
+    start = body.find("{" if expect == "object" else "[")
+    if start < 0:
+        raise StructuredOutputError("模型输出中没有 JSON", text)
+    body = body[start:].strip()
+
+    for candidate in (body, _remove_trailing_commas(body)):
+        try:
+            return _decode_prefix(candidate), True
+        except json.JSONDecodeError:
+            continue
+
+    # 视为被截断：先直接补全，不行再回退到之前的逗号处丢弃残缺的最后一项
+    _, _, commas = _scan(body)
+    for cut in [len(body)] + list(reversed(commas))[:MAX_CUT_POINTS]:
+        try:
+            return _decode_prefix(_close(body[:cut])), True
+        except json.JSONDecodeError:
+            continue
+    raise StructuredOutputError("模型输出的 JSON 无法修复", text)
+
+
+# ---------- 结构校验 ----------
+
+def validate(data: Any, schema: dict, path: str = "$") -> List[str]:
+    """
+    按 JSON Schema 的常用子集（type / properties / required / items / additionalProperties）校验数据。
+
+    :return: 问题描述列表，为空表示通过
+    """
+    errors = []
+    expected = schema.get("type")
+    if expected is not None:
+        types = expected if isinstance(expected, list) else [expected]
+        matched = any(
+            isinstance(data, _TYPES[t]) and not (t in ("integer", "number") and isinstance(data, bool))
+            for t in types
+        )
+        if not matched:
+            return [f"{path} 应为 {'/'.join(types)}，实际为 {type(data).__name__}"]
+
+    if isinstance(data, dict):
+        for key in schema.get("required", []):
+            if key not in data:
+                errors.append(f"{path} 缺少字段 {key}")
+        properties = schema.get("properties", {})
+        extra = schema.get("additionalProperties")
+        for key, value in data.items():
+            if key in properties:
+                errors += validate(value, properties[key], f"{path}.{key}")
+            elif isinstance(extra, dict):
+                errors += validate(value, extra, f"{path}.{key}")
+    elif isinstance(data, list) and isinstance(schema.get("items"), dict):
+        for i, item in enumerate(data):
+            errors += validate(item, schema["items"], f"{path}[{i}]")
+    return errors
+
+
+# ---------- 结构化请求 ----------
+
+def _fix_prompt(raw: str, problems: List[str], schema: dict) -> str:
+    if len(raw) > FIX_MAX_CHARS:
+        raw = raw[:FIX_MAX_CHARS]
+    return (
+        f"要求的 JSON Schema：\n{json.dumps(schema, ensure_ascii=False)}\n\n"
+        "发现的问题：\n" + "\n".join(f"- {p}" for p in problems) + "\n\n"
+        f"原始输出：\n{raw}\n\n"
+        "请只输出修正后的完整 JSON。"
+    )
+
+
+def _check(raw: str, schema: dict) -> Tuple[Any, bool, List[str]]:
+    """
+    本地解析并校验，返回 (数据, 是否修复, 问题列表)；解析失败时数据为 None。
+    """
+    expect = "array" if schema.get("type") == "array" else "object"
+    try:
+        data, repaired = parse_json(raw, expect)
+    except StructuredOutputError as e:
+        return None, False, [str(e)]
+    return data, repaired, validate(data, schema)
+
+
+def request_json(prompt: str, schema: dict, call_site: Optional[str] = None, system: Optional[str] = None,
+                 cache: bool = False, fix_attempts: int = FIX_ATTEMPTS) -> Any:
+    """
+    以 JSON 模式请求模型，返回符合 schema 的数据。
+    先在本地解析与修复（代码块、多余文字、多余逗号、截断），仍不合格时才把原始输出和问题
+    发回模型做一次修正，避免整段生成因格式问题被丢弃。
+
+    :param prompt: 提示文本，需说明返回 JSON 及其字段（JSON 模式要求提示中出现 "json"）
+    :param schema: 期望的 JSON Schema（见 validate 支持的子集）
+    :param call_site: 调用点名称；修正请求记为 "<call_site>-fix"
+    :param system: 稳定的 system 前缀
+    :param cache: 是否使用持久化缓存
+    :param fix_attempts: 最多追加的修正请求次数
+    :return: 解析后的数据
+    :raises LLMError: 请求本身失败
+    :raises StructuredOutputError: 修正后仍不合格（修正请求失败时同样抛出，raw 为原始输出）
+    """
+    raw = get_response_from_llm(prompt, cache=cache, call_site=call_site, system=system, json_mode=True)
+
+    data, repaired, problems = _check(raw, schema)
+    if not problems:
+        _count("repaired" if repaired else "parsed")
+        return data
+
+    for attempt in range(fix_attempts):
+        print(f"[结构化输出] {call_site or ''} 的 JSON 不合格，请求修正（第 {attempt + 1} 次）：{problems[:3]}")
+        try:
+            fixed = get_response_from_llm(_fix_prompt(raw, problems, schema),
+                                          call_site=f"{call_site or 'json'}-fix",
+                                          system=JSON_FIX_SYSTEM_PROMPT, json_mode=True)
+        except LLMError as e:
+            problems = problems + [f"修正请求失败：{e}"]
+            break
+        data, _, fixed_problems = _check(fixed, schema)
+        if not fixed_problems:
+            _count("fixed")
+            return data
+        raw, problems = fixed, fixed_problems
+
+    _count("failed")
+    raise StructuredOutputError(f"模型输出不符合要求的 JSON 结构：{'；'.join(problems[:5])}", raw)
@@ -1,12 +1,26 @@
+import hashlib
 import os
-from llm import get_response_from_llm
+import time
+from typing import Callable, Iterator, Optional
+import context_builder
+from fileio import atomic_write_text
+from llm import LLMError, get_response_from_llm, is_retryable, retry_delay, stream_response_from_llm
 
-def generate_novel_from_decision(decision: dict, background: dict):
+# 章节存储目录
+NOVEL_DIR = "resources/novel"
+# 流中断后最多续写的次数
+MAX_RESUMES = 3
+# 续写时附带的已生成正文末尾长度（字符）
+RESUME_TAIL_CHARS = 1500
+
+def build_novel_prompt(decision: dict, background: dict, story_so_far: str = "") -> str:
     """
-    根据决策和背景调用大模型生成文学创作，并以递增数字命名存储为txt文件。
-    
+    根据决策和背景构造章节创作的提示文本。
+
     :param decision: 包含 "agent_name", "goal", "plan" 的决策字典。
     :param background: 包含环境和个人信息的背景字典。
+    :param story_so_far: 此前章节的故事梗概（见 story_summary），为空时不加入提示。
+    :return: 提示文本
     """
     # 提取环境和个人信息
     environment = background.get("environment", {})
@@ -16,14 +30,24 @@ def generate_novel_from_decision(decision: dict, background: dict):
     atmosphere = environment.get("atmosphere", "未知氛围")
     writing_style = environment.get("writing_style", "未知文风")
 
+    context = context_builder.render_sections("chapter", [
+        ("environment", context_builder.trim_environment(environment)),
+        # 梗概已限制长度，优先于角色信息保留
+        ("story_so_far", story_so_far),
+        ("personal_info", personal_info),
+    ])
+    # 梗概为空时提示与之前完全相同，已有 .part 文件的提示哈希不变
+    story_section = f"以下是此前章节的故事梗概，本章需与之衔接：\n{context['story_so_far']}\n\n" if story_so_far else ""
+
     # 生成输入文本
-    input_text = (
+    prompt = (
         f"你是一个小说创作大师，以下是你需要创作的背景和决策信息：\n\n"
         f"请对于当前环境进行完整详实且富有文学性的描述，不要随意跳出环境的限制，如果角色的决策需要去环境之外完成，那么就稍微描写即可.只生成一章的内容（大概3200字）\n"
         f"请注意，注意你创作的情节的完整性,同时只生成小说的正文。\n\n"
+        f"{story_section}"
         f"以下是当前环境和背景信息：\n"
-        f"环境：{environment}\n"
-        f"个人信息：{personal_info}\n\n"
+        f"环境：{context['environment']}\n"
+        f"个人信息：{context['personal_info']}\n\n"
         f"以下是决策信息：\n"
         f"角色名: {decision['agent_name']}\n"
         f"目标: {decision['goal']}\n"
@@ -36,22 +60,128 @@ def generate_novel_from_decision(decision: dict, background: dict):
         f"5. 体现角色的目标和计划。\n"
         f"6. 输出格式为一章完整的小说（至少3000字）。\n"
     )
+    context_builder.log_prompt_size("chapter", prompt)
+    return prompt
 
-    # 调用大模型生成文本
-    generated_text = get_response_from_llm(input_text)
+def build_resume_prompt(prompt: str, partial_text: str) -> str:
+    """
+    构造续写提示：附上已生成正文的末尾，要求从断开处继续。
+    """
+    return (
+        f"{prompt}\n"
+        f"以下是这一章已经写好的正文末尾，请从断开处直接续写剩余内容，"
+        f"不要重复已有内容，也不要添加任何说明：\n"
+        f"{partial_text[-RESUME_TAIL_CHARS:]}"
+    )
 
-    # 确定存储路径
-    output_dir = "resources/novel"
+def next_chapter_path(output_dir: str = NOVEL_DIR, after: Optional[str] = None) -> str:
+    """
+    获取下一个章节文件路径（以递增数字命名）。
+
+    :param output_dir: 章节存储目录
+    :param after: 已预留但可能尚未写完的章节路径，新编号不小于它的下一个编号
+    """
     os.makedirs(output_dir, exist_ok=True)  # 确保目录存在
 
     # 获取当前目录下的所有以数字命名的txt文件
     existing_files = [f for f in os.listdir(output_dir) if f.endswith(".txt") and f[:-4].isdigit()]
     existing_numbers = sorted(int(f[:-4]) for f in existing_files)
-    next_number = existing_numbers[-1] + 1 if existing_numbers else 1  # 计算下一个文件编号
+    if after:
+        existing_numbers.append(int(os.path.basename(after)[:-4]))
+    next_number = max(existing_numbers) + 1 if existing_numbers else 1  # 计算下一个文件编号
+    return os.path.join(output_dir, f"{next_number}.txt")
+
+def iter_novel_chunks(decision: dict, background: dict, output_path: Optional[str] = None,
+                      max_resumes: int = MAX_RESUMES, story_so_far: str = "") -> Iterator[str]:
+    """
+    流式生成章节：每个片段到达后立即追加写入 <章节>.txt.part 并 yield 给调用方，
+    全部完成后原子重命名为 <章节>.txt。
+
+    流中断时基于已写入的部分正文续写；若上次运行留下了同一提示的 .part 文件，
+    也会从该部分正文继续。
+
+    :param decision: 包含 "agent_name", "goal", "plan" 的决策字典。
+    :param background: 包含环境和个人信息的背景字典。
+    :param output_path: 章节文件路径，默认为下一个递增编号。
+    :param max_resumes: 流中断后最多续写的次数。
+    :param story_so_far: 此前章节的故事梗概。
+    :return: 文本片段迭代器
+    """
+    prompt = build_novel_prompt(decision, background, story_so_far)
+    output_path = output_path or next_chapter_path()
+    part_path = output_path + ".part"
+    # 记录提示哈希，只续写属于同一决策的残留部分
+    key_path = part_path + ".key"
+    prompt_key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    partial_text = ""
+    if os.path.exists(part_path) and os.path.exists(key_path):
+        with open(key_path, "r", encoding="utf-8") as f:
+            if f.read().strip() == prompt_key:
+                with open(part_path, "r", encoding="utf-8") as part_file:
+                    partial_text = part_file.read()
+    if partial_text:
+        print(f"检测到未完成的章节 {part_path}，从已生成的 {len(partial_text)} 字继续")
+        yield partial_text
+    else:
+        with open(key_path, "w", encoding="utf-8") as f:
+            f.write(prompt_key)
+
+    resumes = 0
+    with open(part_path, "a" if partial_text else "w", encoding="utf-8") as part_file:
+        while True:
+            request_prompt = build_resume_prompt(prompt, partial_text) if partial_text else prompt
+            try:
+                for chunk in stream_response_from_llm(
+                        request_prompt, call_site="chapter-resume" if partial_text else "chapter"):
+                    part_file.write(chunk)
+                    part_file.flush()
+                    partial_text += chunk
+                    yield chunk
+                break
+            except LLMError as e:
+                if not is_retryable(e):
+                    raise RuntimeError(f"章节生成失败（{e}），部分内容保存在 {part_path}") from e
+                if resumes >= max_resumes:
+                    raise RuntimeError(f"章节生成中断且续写次数已用尽，部分内容保存在 {part_path}") from e
+                delay = retry_delay(e, resumes)
+                resumes += 1
+                print(f"章节流中断（{e}），{delay:.1f}s 后第 {resumes} 次续写，已生成 {len(partial_text)} 字")
+                time.sleep(delay)
+        os.fsync(part_file.fileno())
+
+    os.replace(part_path, output_path)
+    os.remove(key_path)
+
+def generate_novel_from_decision(decision: dict, background: dict, stream: bool = True,
+                                 on_chunk: Optional[Callable[[str], None]] = None,
+                                 output_path: Optional[str] = None, output_dir: str = NOVEL_DIR,
+                                 story_so_far: str = ""):
+    """
+    根据决策和背景调用大模型生成文学创作，并以递增数字命名存储为txt文件。
+
+    :param decision: 包含 "agent_name", "goal", "plan" 的决策字典。
+    :param background: 包含环境和个人信息的背景字典。
+    :param stream: 是否流式生成并边生成边写入文件。
+    :param on_chunk: 流式模式下每收到一个片段时的回调。
+    :param output_path: 章节文件路径（例如从检查点恢复时预先分配的路径），默认为 output_dir 下的下一个编号。
+    :param output_dir: 章节存储目录。
+    :param story_so_far: 此前章节的故事梗概，用于保持情节连贯。
+    :return: 章节文件路径
+    """
+    # 确定存储路径
+    output_path = output_path or next_chapter_path(output_dir)
 
-    # 保存生成的文本
-    output_path = os.path.join(output_dir, f"{next_number}.txt")
-    with open(output_path, "w", encoding="utf-8") as file:
-        file.write(generated_text)
+    if stream:
+        for chunk in iter_novel_chunks(decision, background, output_path, story_so_far=story_so_far):
+            if on_chunk is not None:
+                on_chunk(chunk)
+    else:
+        # 调用大模型生成文本
+        generated_text = get_response_from_llm(build_novel_prompt(decision, background, story_so_far),
+                                               call_site="chapter")
+        # 保存生成的文本
+        atomic_write_text(output_path, generated_text)
 
-    print(f"文学作品已生成并保存至 {output_path}")
\ No newline at end of file
+    print(f"文学作品已生成并保存至 {output_path}")
+    return output_path